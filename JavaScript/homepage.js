@@ -161,20 +161,28 @@ async function evaluate(event)
 //end of form submit eventlisteners
 //display rules
 async function fetchrules()
-{
+{   // the list is paginated: follow the next links until every rule is loaded
+    const rules=[];
     try {
-        url='http://127.0.0.1:8000/rules/';
-        const response = await fetch(url);
-        if(response.ok)
-        return await response.json();
-        else{console.log(response);
-            const errordata=await response.json();
-            console.error(`Error : ${errordata.detail}`);}
+        let url='http://127.0.0.1:8000/rules/?page_size=1000';
+        while(url)
+        {
+            const response = await fetch(url);
+            if(!response.ok)
+            {   console.log(response);
+                const errordata=await response.json();
+                console.error(`Error : ${errordata.detail}`);
+                break;
+            }
+            const page=await response.json();
+            rules.push(...page.results);
+            url=page.next;
+        }
     } catch (error) {
         console.error('Error fetching Rules:', error);
         alert(`Error fetching Rules: ${error}`);
     }
-
+    return rules;
 }
 
 async function displayRules()
@@ -0,0 +1,22 @@
+# Standalone performance benchmarks for the rule engine.
+# Each module can be run directly, e.g. `python -m main.benchmarks.parser`.
+import os
+import time
+
+
+def setup_django():
+    # Configures Django when a benchmark is run as a script instead of through manage.py
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ruleEngineApplication.settings')
+    import django
+    django.setup()
+
+
+def best_of(func, repeat=5, number=1):
+    # Best wall-clock time of `number` calls to func over `repeat` runs, in seconds per call
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
@@ -0,0 +1,64 @@
+# Compares the request latency (p50 / p99) of the DRF evaluate endpoint and the lean
+# evaluate_fast endpoint, through the full middleware stack with Django's test client.
+# Run with `python -m main.benchmarks.latency`; it uses a throwaway test database.
+from . import setup_django
+from .parser import generate_rule, normalize
+from .parallel import generate_records
+import contextlib
+import io
+import json
+import time
+
+
+def _percentile(timings, fraction):
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(requests=3000, conditions=20, warmup=200):
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from main import models, views
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            rule_string = normalize(generate_rule(conditions))
+            result = views.create_rule(rule_string)
+        rule = models.rules(rule_name='latency', rule_string=rule_string)
+        rule.set_ast(result['content'], result['compact'])
+        rule.save()
+
+        client = Client()
+        bodies = [json.dumps({'data': record}) for record in generate_records(requests)]
+        results = []
+        for name in ('evaluate', 'evaluate_fast'):
+            url = f'/rules/{rule.id}/{name}'
+            for body in bodies[:warmup]:
+                client.post(url, body, content_type='application/json')
+            timings = []
+            for body in bodies:
+                start = time.perf_counter()
+                response = client.post(url, body, content_type='application/json')
+                timings.append(time.perf_counter() - start)
+                assert response.status_code == 200, response.content
+            results.append({
+                'endpoint': name,
+                'p50_seconds': _percentile(timings, 0.5),
+                'p99_seconds': _percentile(timings, 0.99),
+                'requests_per_second': len(timings) / sum(timings),
+            })
+        return results
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+if __name__ == '__main__':
+    setup_django()
+    print(f"{'endpoint':>14} {'p50':>9} {'p99':>9} {'req/s':>8}")
+    for row in run():
+        print(f"{row['endpoint']:>14} {row['p50_seconds'] * 1e6:>7.0f}us {row['p99_seconds'] * 1e6:>7.0f}us "
+              f"{row['requests_per_second']:>8,.0f}")
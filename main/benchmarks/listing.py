@@ -0,0 +1,109 @@
+# Cost of listing the rule store on a large seeded table: the whole table serialized in one
+# response (what GET /rules/ did before pagination, and still does without ?page_size=) against
+# cursor pages with the AST columns deferred, and name lookups through the (rule_name, id) index.
+# Run with `python -m main.benchmarks.listing`; it uses a throwaway test database.
+from . import setup_django
+from .parser import generate_rule, normalize
+import contextlib
+import io
+import time
+import tracemalloc
+
+
+def _measure(func):
+    # (seconds, peak traced memory in bytes, result) of func; timed without tracing, which slows it down
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def seed(count, conditions=20, distinct=50, batch_size=1000):
+    # Stores `count` rules cycling through `distinct` generated rule strings, named rule-<n % 100>
+    from main import models, views
+    parsed = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(distinct):
+            rule_string = normalize(generate_rule(conditions))
+            parsed.append((rule_string, views.create_rule(rule_string)))
+    for start in range(0, count, batch_size):
+        batch = []
+        for n in range(start, min(count, start + batch_size)):
+            rule_string, result = parsed[n % distinct]
+            rule = models.rules(rule_name=f'rule-{n % 100}', rule_string=rule_string)
+            rule.set_ast(result['content'], result['compact'])
+            batch.append(rule)
+        models.rules.objects.bulk_create(batch)
+
+
+def run(count=20000):
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from rest_framework.renderers import JSONRenderer
+    from main import models, views, serializers  # views first: serializers imports it
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        seed(count)
+        client = Client()
+
+        def unpaginated(rules):
+            # the former list view: every row serialized into one response
+            data = serializers.ruleStoreModelSerializer(rules, many=True).data
+            JSONRenderer().render(data)
+            return len(data)
+
+        def get(url):
+            response = client.get(url)
+            assert response.status_code == 200, response.content
+            return response.json()
+
+        def all_pages():
+            url, rows = '/rules/?page_size=1000', 0
+            while url:
+                page = get(url)
+                rows += len(page['results'])
+                url = page['next']
+            return rows
+
+        def last_page():
+            # follows the cursor to the end of the table, then times only the last request
+            url = '/rules/?page_size=1000'
+            while True:
+                page = get(url)
+                if page['next'] is None:
+                    return url
+                url = page['next']
+
+        deep_url = last_page()
+        scenarios = [
+            ('whole table, one response', lambda: unpaginated(models.rules.objects.all())),
+            ('same, AST columns deferred', lambda: unpaginated(models.rules.objects.only(*views.ruleStoreViewSet.list_fields))),
+            ('first page (100)', lambda: len(get('/rules/?page_size=100')['results'])),
+            ('last page (1000)', lambda: len(get(deep_url)['results'])),
+            ('all pages (1000 each)', all_pages),
+            ('?rule_name= lookup', lambda: len(get('/rules/?rule_name=rule-42&page_size=1000')['results'])),
+            ('?rule_name_prefix= lookup', lambda: len(get('/rules/?rule_name_prefix=rule-42&page_size=1000')['results'])),
+        ]
+        results = []
+        for name, func in scenarios:
+            func()  # warm up
+            elapsed, peak, rows = _measure(func)
+            results.append({'scenario': name, 'rows': rows, 'seconds': elapsed, 'peak_bytes': peak})
+        return results
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+if __name__ == '__main__':
+    setup_django()
+    print(f"{'scenario':>26} {'rows':>7} {'time':>10} {'peak memory':>12}")
+    for row in run():
+        print(f"{row['scenario']:>26} {row['rows']:>7} {row['seconds'] * 1e3:>8.1f}ms {row['peak_bytes'] / 2**20:>10.1f}MB")
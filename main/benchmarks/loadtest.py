@@ -0,0 +1,254 @@
+# Load test comparing a WSGI deployment (a fixed pool of threads, each serving one request at a
+# time) with an ASGI one (a single event loop keeping every request in flight) at increasing
+# numbers of concurrent clients. Reports requests per second and p50 / p99 latency.
+#
+# `python -m main.benchmarks.loadtest` drives both Django applications in-process on a throwaway
+# test database: WSGI requests go to evaluate_fast from a pool of --threads threads, ASGI requests
+# go to evaluate_async as concurrent tasks on one loop. Every database query is delayed by
+# --query-delay seconds to stand in for a database server's round trip, the wait async views
+# overlap and a WSGI thread sits out.
+#
+# `python -m main.benchmarks.loadtest --url http://127.0.0.1:8000/rules/1/evaluate_async` instead
+# sends the requests over HTTP/1.1 keep-alive connections to a running server, e.g.
+#   uvicorn ruleEngineApplication.asgi:application --workers 1
+#   gunicorn ruleEngineApplication.wsgi --workers 1 --threads 8
+from . import setup_django
+from .parser import generate_rule, normalize
+from .parallel import generate_records
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import time
+
+CONCURRENCY = (1, 8, 32, 128)
+
+
+def _percentile(timings, fraction):
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _summary(deployment, concurrency, timings, elapsed):
+    return {
+        'deployment': deployment,
+        'concurrency': concurrency,
+        'requests_per_second': len(timings) / elapsed,
+        'p50_seconds': _percentile(timings, 0.5),
+        'p99_seconds': _percentile(timings, 0.99),
+    }
+
+
+def _delay_queries(delay):
+    # Adds `delay` seconds to every query of every connection opened from now on (and the current one)
+    from django.db import connection
+    from django.db.backends.signals import connection_created
+
+    def wrapper(execute, sql, params, many, context):
+        time.sleep(delay)
+        return execute(sql, params, many, context)
+
+    def install(sender, connection, **kwargs):
+        connection.execute_wrappers.append(wrapper)
+
+    connection.execute_wrappers.append(wrapper)
+    connection_created.connect(install, weak=False)
+    return lambda: connection_created.disconnect(install)
+
+
+async def _asgi_post(application, path, body):
+    # One request through the ASGI application, returns the response status
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'POST',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())],
+        'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    received = False
+    response_status = None
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await asyncio.Event().wait()  # the client never disconnects
+
+    async def send(message):
+        nonlocal response_status
+        if message['type'] == 'http.response.start':
+            response_status = message['status']
+
+    await application(scope, receive, send)
+    return response_status
+
+
+def _wsgi_post(application, path, body):
+    # One request through the WSGI application, returns the response status
+    environ = {
+        'REQUEST_METHOD': 'POST', 'PATH_INFO': path, 'SCRIPT_NAME': '', 'QUERY_STRING': '',
+        'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': 'testserver',
+        'REMOTE_ADDR': '127.0.0.1', 'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body), 'wsgi.errors': io.StringIO(), 'wsgi.url_scheme': 'http',
+        'wsgi.version': (1, 0), 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    statuses = []
+    response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    return int(statuses[0].split()[0])
+
+
+async def _drive(send_one, bodies, concurrency):
+    # Sends the bodies from `concurrency` clients, each waiting for its response before the next
+    # request; returns (per-request latencies, elapsed seconds)
+    queue = iter(bodies)
+    timings = []
+
+    async def client():
+        for body in queue:
+            start = time.perf_counter()
+            response_status = await send_one(body)
+            timings.append(time.perf_counter() - start)
+            assert response_status == 200, response_status
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return timings, time.perf_counter() - start
+
+
+def _run_asgi(path, bodies, concurrency):
+    from django.core.asgi import get_asgi_application
+    application = get_asgi_application()
+    return asyncio.run(_drive(lambda body: _asgi_post(application, path, body), bodies, concurrency))
+
+
+def _run_wsgi(path, bodies, concurrency, threads):
+    # Clients beyond the thread count wait for a free thread, like connections queued by a WSGI server
+    from django.core.wsgi import get_wsgi_application
+    application = get_wsgi_application()
+    pool = ThreadPoolExecutor(max_workers=threads)
+
+    async def send_one(body):
+        return await asyncio.get_running_loop().run_in_executor(pool, _wsgi_post, application, path, body)
+
+    try:
+        return asyncio.run(_drive(send_one, bodies, concurrency))
+    finally:
+        pool.shutdown()
+
+
+def run(requests=2000, conditions=20, threads=8, query_delay=0.002, concurrency=CONCURRENCY):
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+    from main import models, views
+    from main.cache import compiled_rules
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    restore = _delay_queries(query_delay)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            rule_string = normalize(generate_rule(conditions))
+            result = views.create_rule(rule_string)
+        rule = models.rules(rule_name='loadtest', rule_string=rule_string)
+        rule.set_ast(result['content'], result['compact'])
+        rule.save()
+        compiled_rules.clear()
+
+        bodies = [json.dumps({'data': record}).encode() for record in generate_records(requests)]
+        results = []
+        for clients in concurrency:
+            timings, elapsed = _run_wsgi(f'/rules/{rule.id}/evaluate_fast', bodies, clients, threads)
+            results.append(_summary(f'wsgi ({threads} threads)', clients, timings, elapsed))
+            timings, elapsed = _run_asgi(f'/rules/{rule.id}/evaluate_async', bodies, clients)
+            results.append(_summary('asgi', clients, timings, elapsed))
+        return results
+    finally:
+        restore()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+async def _http_client(host, port, path, bodies):
+    # One keep-alive HTTP/1.1 connection sending the bodies in turn; reconnects when the server closes it
+    timings = []
+    reader = writer = None
+    for body in bodies:
+        request = (
+            f"POST {path} HTTP/1.1\r\nHost: {host}:{port}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n\r\n"
+        ).encode() + body
+        start = time.perf_counter()
+        if writer is None:
+            reader, writer = await asyncio.open_connection(host, port)
+        writer.write(request)
+        status_line = await reader.readline()
+        length = 0
+        close = status_line.startswith(b'HTTP/1.0')
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            name = name.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'connection':
+                close = value.strip().lower() == 'close'
+        await reader.readexactly(length)
+        timings.append(time.perf_counter() - start)
+        assert status_line.split()[1] == b'200', status_line
+        if close:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+    return timings
+
+
+def run_http(url, requests=2000, concurrency=CONCURRENCY):
+    # Load test against a running server; url is the full address of an evaluate endpoint
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    bodies = [json.dumps({'data': record}).encode() for record in generate_records(requests)]
+    results = []
+    for clients in concurrency:
+        shares = [bodies[i::clients] for i in range(clients)]
+
+        async def load():
+            return await asyncio.gather(*(_http_client(host, port, parts.path, share) for share in shares))
+
+        start = time.perf_counter()
+        timings = [timing for share in asyncio.run(load()) for timing in share]
+        results.append(_summary(parts.path, clients, timings, time.perf_counter() - start))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Concurrent load test of the evaluation endpoints")
+    parser.add_argument('--url', help="evaluate endpoint of a running server (in-process WSGI vs ASGI when omitted)")
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', default=','.join(map(str, CONCURRENCY)),
+                        help="comma-separated numbers of concurrent clients")
+    parser.add_argument('--threads', type=int, default=8, help="WSGI threads (in-process only)")
+    parser.add_argument('--query-delay', type=float, default=0.002,
+                        help="seconds added to every database query (in-process only)")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(',')]
+    if args.url:
+        results = run_http(args.url, args.requests, levels)
+    else:
+        setup_django()
+        results = run(args.requests, threads=args.threads, query_delay=args.query_delay, concurrency=levels)
+    print(f"{'deployment':>18} {'clients':>8} {'req/s':>8} {'p50':>9} {'p99':>9}")
+    for row in results:
+        print(f"{row['deployment']:>18} {row['concurrency']:>8} {row['requests_per_second']:>8,.0f} "
+              f"{row['p50_seconds'] * 1e3:>7.1f}ms {row['p99_seconds'] * 1e3:>7.1f}ms")
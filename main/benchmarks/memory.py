@@ -0,0 +1,47 @@
+# Reports the in-memory cost per rule of each AST representation.
+# Run with `python -m main.benchmarks.memory`.
+from . import setup_django
+from .parser import generate_rule, normalize
+import contextlib
+import gc
+import io
+import tracemalloc
+
+
+def _measure(build, count):
+    # Bytes allocated (and still alive) per item by calling build() `count` times
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = [build(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / count
+
+
+def run(rules=500, conditions=(5, 50, 500)):
+    from main import views
+    from main.compact import CompactAST
+    from main.compiler import compile_ast
+
+    results = []
+    for size in conditions:
+        with contextlib.redirect_stdout(io.StringIO()):
+            stored = [views.create_rule(normalize(generate_rule(size, seed=seed)))['content'] for seed in range(rules)]
+        results.append({
+            'conditions': size,
+            'json_text_bytes': sum(len(text) for text in stored) / rules,
+            'node_tree_bytes': _measure(lambda i: views.loads_ast(stored[i]), rules),
+            'compact_ast_bytes': _measure(lambda i: CompactAST.from_node(views.loads_ast(stored[i])), rules),
+            'compiled_rule_bytes': _measure(lambda i: compile_ast(views.loads_ast(stored[i])), rules),
+        })
+    return results
+
+
+if __name__ == '__main__':
+    setup_django()
+    print(f"{'conditions':>10} {'json text':>10} {'Node tree':>10} {'CompactAST':>11} {'CompiledRule':>13}   (bytes per rule)")
+    for row in run():
+        print(f"{row['conditions']:>10} {row['json_text_bytes']:>10.0f} {row['node_tree_bytes']:>10.0f} "
+              f"{row['compact_ast_bytes']:>11.0f} {row['compiled_rule_bytes']:>13.0f}")
@@ -0,0 +1,61 @@
+# Measures how offline scoring (evaluate_stream's score_chunk: evaluation plus NDJSON output)
+# scales with the number of worker processes of ParallelEvaluator, against in-process scoring.
+# Run with `python -m main.benchmarks.parallel`; rows/s should grow with workers up to the CPU count.
+from . import setup_django
+from .parser import FIELDS, generate_rule, normalize
+import contextlib
+import io
+import os
+import random
+import time
+
+
+def generate_records(count, seed=0, fields=FIELDS):
+    rng = random.Random(seed)
+    return [
+        {
+            field: rng.choice(['Sales', 'Marketing', 'HR']) if field == 'department' else rng.randint(0, 100000)
+            for field in fields
+        }
+        for _ in range(count)
+    ]
+
+
+def run(rows=200000, rules=4, conditions=50, chunk_size=2000, workers=None):
+    from main import views
+    from main.compiler import compile_ast
+    from main.management.commands.evaluate_stream import chunked, score_chunk
+    from main.parallel import ParallelEvaluator
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        compiled_by_id = {
+            seed: compile_ast(views.create_rule(normalize(generate_rule(conditions, seed=seed)))['compact'])
+            for seed in range(rules)
+        }
+    records = list(enumerate(generate_records(rows), start=1))
+    counts = workers or sorted({1, 2, 4, os.cpu_count() or 1})
+
+    start = time.perf_counter()
+    for chunk in chunked(records, chunk_size):
+        score_chunk(compiled_by_id, chunk)
+    results = [{'workers': 0, 'rows_per_second': rows / (time.perf_counter() - start)}]
+
+    for count in counts:
+        with ParallelEvaluator(compiled_by_id, workers=count) as evaluator:
+            # Warm the pool up so process start-up is not part of the measurement
+            list(evaluator.map([records[:1]] * count, score_chunk))
+            start = time.perf_counter()
+            for _ in evaluator.map(chunked(records, chunk_size), score_chunk):
+                pass
+            results.append({'workers': count, 'rows_per_second': rows / (time.perf_counter() - start)})
+    return results
+
+
+if __name__ == '__main__':
+    setup_django()
+    print(f"CPUs: {os.cpu_count()}")
+    print(f"{'workers':>8} {'rows/s':>10} {'speedup':>8}   (workers 0 = in-process)")
+    results = run()
+    baseline = results[0]['rows_per_second']
+    for row in results:
+        print(f"{row['workers']:>8} {row['rows_per_second']:>10,.0f} {row['rows_per_second'] / baseline:>7.2f}x")
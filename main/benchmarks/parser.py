@@ -0,0 +1,67 @@
+# Measures how rule creation scales with the number of conditions in a rule.
+# Run with `python -m main.benchmarks.parser`; time per condition should stay flat as rules grow.
+from . import best_of, setup_django
+import contextlib
+import io
+import random
+
+FIELDS = ['age', 'salary', 'experience', 'department']
+
+
+def generate_rule(conditions, group_size=2, seed=0, and_ratio=None, fields=FIELDS, distinct_fields=False):
+    # Builds a rule string of `conditions` conditions on `fields` grouped in parenthesized AND/OR
+    # blocks of `group_size`; and_ratio is the share of AND blocks (None picks each operator with
+    # even odds). Fields other than department are numeric. With distinct_fields the n-th condition
+    # tests fields[n], so no condition can subsume or contradict another
+    rng = random.Random(seed)
+    terms = []
+    for n in range(conditions):
+        field = fields[n] if distinct_fields else rng.choice(fields)
+        if field == 'department':
+            terms.append(f"department = '{rng.choice(['Sales', 'Marketing', 'HR'])}'")
+        else:
+            terms.append(f"{field} {rng.choice(['>', '<'])} {rng.randint(0, 100000)}")
+    while len(terms) > 1:
+        grouped = []
+        for start in range(0, len(terms), group_size):
+            group = terms[start:start + group_size]
+            if and_ratio is None:
+                operator = f" {rng.choice(['AND', 'OR'])} "
+            else:
+                operator = ' AND ' if rng.random() < and_ratio else ' OR '
+            grouped.append(f"( {operator.join(group)} )" if len(group) > 1 else group[0])
+        terms = grouped
+    return terms[0]
+
+
+def normalize(rule_string):
+    # Same pre-pass as ruleStoreViewSet.get_serializer_context
+    from main import views
+    return views.normalize_rule_string(rule_string)
+
+
+def run(sizes=(10, 100, 1000, 5000), repeat=3):
+    from main import views
+    from main.cache import parsed_groups
+    parsed_groups.max_tokens = 0  # every call parses the whole rule, not cached groups
+    results = []
+    for size in sizes:
+        rule_string = generate_rule(size)
+        with contextlib.redirect_stdout(io.StringIO()):
+            normalize_time = best_of(lambda: normalize(rule_string), repeat=repeat)
+            formatted = normalize(rule_string)
+            parse_time = best_of(lambda: views.create_rule(formatted), repeat=repeat)
+        results.append({
+            'conditions': size,
+            'normalize_ms': normalize_time * 1000,
+            'create_rule_ms': parse_time * 1000,
+            'us_per_condition': (normalize_time + parse_time) / size * 1e6,
+        })
+    return results
+
+
+if __name__ == '__main__':
+    setup_django()
+    print(f"{'conditions':>10} {'normalize ms':>13} {'create_rule ms':>15} {'us/condition':>13}")
+    for row in run():
+        print(f"{row['conditions']:>10} {row['normalize_ms']:>13.2f} {row['create_rule_ms']:>15.2f} {row['us_per_condition']:>13.2f}")
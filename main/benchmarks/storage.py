@@ -0,0 +1,44 @@
+# Compares the stored size and load-to-compiled time of rules.rule_ast (JSON text) and
+# rules.rule_ast_compact (binary CompactAST).
+# Run with `python -m main.benchmarks.storage`.
+from . import best_of, setup_django
+from .parser import generate_rule, normalize
+import contextlib
+import io
+
+
+def run(rules=200, conditions=(5, 50, 500)):
+    from main import views
+    from main.compact import CompactAST, decode, encode
+    from main.compiler import compile_ast
+
+    results = []
+    for size in conditions:
+        with contextlib.redirect_stdout(io.StringIO()):
+            texts = [views.create_rule(normalize(generate_rule(size, seed=seed)))['content'] for seed in range(rules)]
+        blobs = [encode(CompactAST.from_node(views.loads_ast(text))) for text in texts]
+
+        def load_json():
+            for text in texts:
+                compile_ast(views.loads_ast(text))
+
+        def load_compact():
+            for blob in blobs:
+                compile_ast(decode(blob))
+
+        results.append({
+            'conditions': size,
+            'json_bytes': sum(len(text.encode('utf-8')) for text in texts) / rules,
+            'compact_bytes': sum(len(blob) for blob in blobs) / rules,
+            'json_load_seconds': best_of(load_json, repeat=3) / rules,
+            'compact_load_seconds': best_of(load_compact, repeat=3) / rules,
+        })
+    return results
+
+
+if __name__ == '__main__':
+    setup_django()
+    print(f"{'conditions':>10} {'json bytes':>11} {'compact':>9} {'json load':>11} {'compact load':>13}   (per rule)")
+    for row in run():
+        print(f"{row['conditions']:>10} {row['json_bytes']:>11.0f} {row['compact_bytes']:>9.0f} "
+              f"{row['json_load_seconds'] * 1e6:>9.1f}us {row['compact_load_seconds'] * 1e6:>11.1f}us")
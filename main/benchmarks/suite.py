@@ -0,0 +1,270 @@
+# Reproducible benchmark suite: parsing, deserializing, evaluating and combining synthetic rules,
+# and the API round trips through Django's test client, on a throwaway test database.
+# Run with `python manage.py benchmark` (see main/management/commands/benchmark.py), which writes
+# the results as JSON and can fail when a run is slower than a stored baseline.
+#
+# Rules come from generate_rule with fixed seeds, shaped by their number of conditions, nesting
+# levels and share of AND blocks, with a field per condition so the optimizer cannot fold them
+# away; records come from generate_records over the same fields. The 'segments' rule is instead
+# an OR of many narrow (department, numeric band) segments over a few fields, which a record
+# mostly walks to the end: the kind of rule the result cache is for. Every figure is the best
+# of `repeat` runs, in seconds per call (or per record, per request), so runs on the same machine
+# are comparable.
+from . import best_of, setup_django
+from .parallel import generate_records
+from .parser import generate_rule, normalize
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import random
+import sys
+from datetime import datetime, timezone
+
+# name -> (conditions, nesting levels, share of AND blocks)
+SHAPES = {
+    'small': (10, 2, 0.5),
+    'medium': (100, 3, 0.5),
+    'large': (1000, 4, 0.5),
+    'deep': (256, 8, 0.5),
+    'and_heavy': (100, 3, 0.9),
+    'or_heavy': (100, 3, 0.1),
+}
+SEGMENTS = (200, 4)     # segments of the 'segments' rule, numeric fields they are spread over
+COMBINE_SIZES = (10, 100)
+
+
+def shape_fields(conditions):
+    # One field per condition of a shape, the first one textual
+    return ['department'] + [f'field{n}' for n in range(conditions - 1)]
+
+
+def synthetic_rule(conditions, nesting, and_ratio, seed=0):
+    # Normalized rule string with `conditions` conditions nested `nesting` groups deep
+    group_size = max(2, math.ceil(conditions ** (1 / nesting)))
+    return normalize(generate_rule(
+        conditions, group_size=group_size, seed=seed, and_ratio=and_ratio,
+        fields=shape_fields(conditions), distinct_fields=True,
+    ))
+
+
+def segment_rule(segments, fields, seed=0):
+    # OR of `segments` groups "( department = 'X' AND fieldN > a AND fieldN < a + 1000 )"
+    rng = random.Random(seed)
+    groups = []
+    for _ in range(segments):
+        field = f'field{rng.randrange(fields)}'
+        low = rng.randint(0, 99000)
+        groups.append(
+            f"( department = '{rng.choice(['Sales', 'Marketing', 'HR'])}' AND {field} > {low} AND {field} < {low + 1000} )"
+        )
+    return normalize(' OR '.join(groups))
+
+
+def ast_depth(node):
+    depth = 0
+    stack = [(node, 1)]
+    while stack:
+        node, level = stack.pop()
+        if node is None:
+            continue
+        depth = max(depth, level)
+        stack += [(node.left, level + 1), (node.right, level + 1)]
+    return depth
+
+
+def environment():
+    import django
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'started': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+
+
+def _store(rule_string, name):
+    from main import models, views
+    result = views.create_rule(rule_string)
+    rule = models.rules(rule_name=name, rule_string=rule_string)
+    rule.set_ast(result['content'], result['compact'])
+    rule.save()
+    return rule
+
+
+def _edits(rule_string, count):
+    # Copies of rule_string with one numeric constant changed, each at a different place
+    tokens = rule_string.split(' ')
+    numbers = [index for index, token in enumerate(tokens) if token.isdigit()]
+    edits = []
+    for n in range(count):
+        edited = list(tokens)
+        edited[numbers[(n * 7919) % len(numbers)]] = str(n)
+        edits.append(' '.join(edited))
+    return edits
+
+
+def _core_benchmarks(record_count, repeat, seed):
+    from main import views
+    from main.cache import parsed_groups, rule_results
+    from main.compiler import compile_ast
+    results = {}
+    rules = [
+        (name, synthetic_rule(*shape, seed=seed), shape_fields(shape[0]),
+         {'conditions': shape[0], 'nesting': shape[1], 'and_ratio': shape[2]})
+        for name, shape in SHAPES.items()
+    ]
+    segments, fields = SEGMENTS
+    rules.append(('segments', segment_rule(segments, fields, seed=seed), shape_fields(fields + 1),
+                  {'conditions': 3 * segments, 'fields': fields + 1}))
+    for name, rule_string, fields, shape in rules:
+        records = generate_records(record_count, seed=seed, fields=fields)
+        created = views.create_rule(rule_string)
+        ast_json = json.loads(created['content'])
+        root = views.deserialize_ast(ast_json)
+        compiled = compile_ast(created['compact'])
+        shape = {**shape, 'ast_depth': ast_depth(root)}
+
+        def evaluate_all(evaluate):
+            for record in records:
+                evaluate(record)
+
+        def cold_create():
+            # the whole rule parsed, as for a new rule
+            max_tokens, parsed_groups.max_tokens = parsed_groups.max_tokens, 0
+            try:
+                views.create_rule(rule_string)
+            finally:
+                parsed_groups.max_tokens = max_tokens
+
+        def evaluate_rule_all(cache_size):
+            # evaluate_rule, as the evaluate endpoints call it, with rule_results disabled (0) or
+            # holding every record; warmed up below, so the memoized run only has cache hits on
+            # the rules the cache accepts ('segments'), and only pays its shape check on the others
+            maxsize, rule_results.maxsize = rule_results.maxsize, cache_size
+            try:
+                evaluate_all(lambda record: views.evaluate_rule(name, 1, compiled, record))
+            finally:
+                rule_results.maxsize = maxsize
+
+        evaluate_rule_all(len(records))
+        edits = iter(_edits(rule_string, repeat + 1))
+        cases = (
+            ('create_rule', 'call', cold_create, 1),
+            # an update changing one constant: groups the edit left alone come from parsed_groups
+            ('create_rule_edited', 'call', lambda: views.create_rule(next(edits)), 1),
+            ('deserialize_ast', 'call', lambda: views.deserialize_ast(ast_json), 1),
+            ('evaluate_ast', 'record', lambda: evaluate_all(lambda record: views.evaluate_ast(root, record)), len(records)),
+            ('evaluate_compiled', 'record', lambda: evaluate_all(compiled.evaluate), len(records)),
+            ('evaluate_rule', 'record', lambda: evaluate_rule_all(0), len(records)),
+            ('evaluate_rule_memoized', 'record', lambda: evaluate_rule_all(len(records)), len(records)),
+        )
+        for case, unit, func, per_run in cases:
+            results[f'{case}[{name}]'] = {'seconds': best_of(func, repeat=repeat) / per_run, 'unit': unit, **shape}
+    return results
+
+
+def _combine_benchmarks(repeat, seed):
+    from main import views
+    results = {}
+    conditions, nesting, and_ratio = SHAPES['small']
+    for count in COMBINE_SIZES:
+        ids = [
+            _store(synthetic_rule(conditions, nesting, and_ratio, seed=seed + n), f'combine-{count}').id
+            for n in range(count)
+        ]
+        results[f'combine_rules[{count} rules]'] = {
+            'seconds': best_of(lambda: views.RuleCombiner(ids).combine_rules(), repeat=repeat),
+            'unit': 'call', 'rules': count, 'conditions': conditions,
+        }
+    return results
+
+
+def _api_benchmarks(record_count, requests, repeat, seed):
+    from django.test import Client
+    client = Client()
+    rule_string = synthetic_rule(*SHAPES['medium'], seed=seed)
+    records = generate_records(record_count, seed=seed, fields=shape_fields(SHAPES['medium'][0]))
+    rule = _store(rule_string, 'api')
+    combine_ids = [_store(synthetic_rule(*SHAPES['small'], seed=seed + n), 'api-combine').id for n in range(10)]
+    bodies = [json.dumps({'data': record}) for record in records[:requests]]
+    batch = json.dumps({'data': records})
+
+    def post(url, body, expected=200):
+        response = client.post(url, body, content_type='application/json')
+        assert response.status_code == expected, (url, response.status_code, response.content[:200])
+
+    def post_each(url):
+        for body in bodies:
+            post(url, body)
+
+    def get(url):
+        response = client.get(url)
+        assert response.status_code == 200, (url, response.status_code)
+
+    cases = (
+        ('POST /rules/', lambda: post('/rules/', json.dumps({'rule_name': 'api-create', 'rule_string': rule_string}), 201), 1),
+        ('POST evaluate', lambda: post_each(f'/rules/{rule.id}/evaluate'), len(bodies)),
+        ('POST evaluate_fast', lambda: post_each(f'/rules/{rule.id}/evaluate_fast'), len(bodies)),
+        (f'POST evaluate_batch ({len(records)} records)', lambda: post(f'/rules/{rule.id}/evaluate_batch', batch), 1),
+        ('POST combine_rules (10 rules)',
+         lambda: post('/rules/combine_rules', json.dumps({'rule_name': 'api-combined', 'ids': combine_ids}), 201), 1),
+        ('GET /rules/?page_size=100', lambda: get('/rules/?page_size=100'), 1),
+    )
+    results = {}
+    for name, func, per_run in cases:
+        func()  # warm up: caches, compiled forms
+        results[f'api[{name}]'] = {'seconds': best_of(func, repeat=repeat) / per_run, 'unit': 'request'}
+    return results
+
+
+def run(quick=False, repeat=None, seed=0, only=None):
+    # {'environment': ..., 'parameters': ..., 'benchmarks': {name: {'seconds': ..., 'unit': ..., ...}}}.
+    # only limits the run to the groups 'core', 'combine' and 'api' it lists
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    repeat = repeat or (3 if quick else 5)
+    record_count = 200 if quick else 1000
+    requests = 50 if quick else 200
+    groups = only or ('core', 'combine', 'api')
+    parameters = {'quick': quick, 'repeat': repeat, 'seed': seed, 'records': record_count, 'requests': requests}
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    benchmarks = {}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            if 'core' in groups:
+                benchmarks.update(_core_benchmarks(record_count, repeat, seed))
+            if 'combine' in groups:
+                benchmarks.update(_combine_benchmarks(repeat, seed))
+            if 'api' in groups:
+                benchmarks.update(_api_benchmarks(record_count, requests, repeat, seed))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+    return {'environment': environment(), 'parameters': parameters, 'benchmarks': benchmarks}
+
+
+def compare(baseline, current, threshold):
+    # [(name, baseline seconds, current seconds, ratio, regressed)] for the benchmarks in both runs;
+    # a benchmark regressed when it takes more than (1 + threshold) times its baseline
+    rows = []
+    for name, result in current['benchmarks'].items():
+        before = baseline['benchmarks'].get(name)
+        if before is None:
+            continue
+        ratio = result['seconds'] / before['seconds'] if before['seconds'] else math.inf
+        rows.append((name, before['seconds'], result['seconds'], ratio, ratio > 1 + threshold))
+    return rows
+
+
+if __name__ == '__main__':
+    # Same as `python manage.py benchmark`, with the same options
+    setup_django()
+    from django.core.management import execute_from_command_line
+    execute_from_command_line(['manage.py', 'benchmark', *sys.argv[1:]])
@@ -0,0 +1,135 @@
+from . import fastjson
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+import os
+
+# Bulk import and export of rules as NDJSON, one {"rule_name": ..., "rule_string": ...} object per line.
+#
+# Import: non-blank lines are read in batches of batch_size. Every batch is parsed (on a process
+# pool when workers != 1) and its valid rules are inserted with one bulk_create in one transaction,
+# so a catalog of N rules costs N/batch_size commits instead of N. A line that is not an object
+# with a rule_name and a valid rule_string is reported with its line number and skipped; the
+# other rules are still imported. While the pool parses the next batches, this process inserts
+# the current one, and only a bounded window of batches is ever held in memory.
+#
+# Export: rules are read in id order, batch_size rows per keyset query, and yielded as NDJSON
+# in the same format (plus "id"), so an export can be imported again as is.
+#
+# Workers parse with views.create_rule, so they make sure Django is set up in the pool initializer;
+# only lines and parsed rows (AST JSON and the encoded CompactAST) cross process boundaries.
+# Imported rules bypass the parsed-group cache, which is meant for rules being edited: a catalog
+# would only evict those groups with ones that are never looked up again.
+
+RULE_NAME_MAX_LENGTH = 255
+
+
+def parse_line(line_number, line):
+    # (line number, (rule_name, rule_string, rule_ast, rule_ast_compact), None) for a valid line,
+    # (line number, None, error message) otherwise. line may be text or bytes
+    from . import compact, views
+    try:
+        item = fastjson.loads(line)
+    except ValueError as error:
+        return line_number, None, f"Invalid JSON: {error}"
+    if not isinstance(item, dict):
+        return line_number, None, "Expected an object with rule_name and rule_string"
+    rule_name = item.get('rule_name')
+    rule_string = item.get('rule_string')
+    if not isinstance(rule_name, str) or not rule_name.strip():
+        return line_number, None, "rule_name: a non-empty string is required"
+    rule_name = rule_name.strip()
+    if len(rule_name) > RULE_NAME_MAX_LENGTH:
+        return line_number, None, f"rule_name: at most {RULE_NAME_MAX_LENGTH} characters"
+    if not isinstance(rule_string, str) or not rule_string.strip():
+        return line_number, None, "rule_string: a non-empty string is required"
+    try:
+        rule_string = views.normalize_rule_string(rule_string)
+        parsed = views.create_rule(rule_string, cache_groups=False)
+    except Exception as error:
+        return line_number, None, str(error)
+    if not parsed['valid']:
+        return line_number, None, parsed['content']
+    return line_number, (rule_name, rule_string, parsed['content'], compact.encode(parsed['compact'])), None
+
+
+def parse_lines(lines):
+    # parse_line of every (line number, line) pair
+    return [parse_line(line_number, line) for line_number, line in lines]
+
+
+def _init_worker():
+    from django.apps import apps
+    if not apps.ready:
+        import django
+        django.setup()
+
+
+def parsed_batches(batches, workers=1):
+    # Yields parse_lines of every batch, in input order; workers=0 uses every CPU
+    if workers == 1:
+        for batch in batches:
+            yield parse_lines(batch)
+        return
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+    try:
+        futures = deque()
+        for batch in batches:
+            futures.append(executor.submit(parse_lines, batch))
+            if len(futures) >= 2 * workers:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def batched(lines, size):
+    # Groups the non-blank lines into lists of at most `size` (line number, line) pairs
+    numbered = ((line_number, line) for line_number, line in enumerate(lines, start=1) if line.strip())
+    while True:
+        batch = list(islice(numbered, size))
+        if not batch:
+            return
+        yield batch
+
+
+def import_rules(lines, batch_size=500, workers=1):
+    # Imports NDJSON lines (text or bytes); yields (ids of the rules created, [(line number, error)])
+    # per batch, once the batch is committed
+    from django.db import transaction
+    from . import models
+    for parsed in parsed_batches(batched(lines, batch_size), workers):
+        rows = []
+        errors = []
+        for line_number, fields, error in parsed:
+            if error is not None:
+                errors.append((line_number, error))
+                continue
+            rule_name, rule_string, rule_ast, rule_ast_compact = fields
+            rows.append(models.rules(
+                rule_name=rule_name, rule_string=rule_string, rule_ast=rule_ast, rule_ast_compact=rule_ast_compact
+            ))
+        created = []
+        if rows:
+            with transaction.atomic():
+                created = [rule.pk for rule in models.rules.objects.bulk_create(rows)]
+            models.bulk_created(created)
+        yield created, errors
+
+
+def export_rules(batch_size=1000):
+    # Yields the stored rules as NDJSON bytes, one chunk per batch_size rules, in id order
+    from . import models
+    rows = models.rules.objects.order_by('id').values_list('id', 'rule_name', 'rule_string')
+    last_id = None
+    while True:
+        batch = list((rows if last_id is None else rows.filter(id__gt=last_id))[:batch_size])
+        if not batch:
+            return
+        yield b''.join(
+            fastjson.dumps({'id': rule_id, 'rule_name': rule_name, 'rule_string': rule_string}) + b'\n'
+            for rule_id, rule_name, rule_string in batch
+        )
+        last_id = batch[-1][0]
@@ -0,0 +1,341 @@
+from collections import OrderedDict, defaultdict
+from django.conf import settings
+from django.core.cache import caches
+from time import monotonic
+import threading
+import uuid
+
+
+class CompiledRuleCache:
+    # Process level LRU cache of compiled rules keyed by rule id plus the rule's version.
+    # An entry whose stored version differs from the requested one is treated as a miss,
+    # so a rule saved by another worker is never served stale.
+    # recent() additionally serves an entry without a version, for recent_ttl seconds after the version
+    # was last checked against the database (get/set). It is what lets the async views skip the probe;
+    # saves in this process invalidate the entry at once, saves in other workers are seen within recent_ttl.
+    def __init__(self, maxsize=1024, recent_ttl=0):
+        self.maxsize = maxsize
+        self.recent_ttl = recent_ttl
+        self._entries = OrderedDict()  # rule_id -> (version, compiled, time the version was checked)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.recent_hits = 0
+
+    def get(self, rule_id, version):
+        with self._lock:
+            entry = self._entries.get(rule_id)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                return None
+            if self.recent_ttl:
+                self._entries[rule_id] = (version, entry[1], monotonic())
+            self._entries.move_to_end(rule_id)
+            self.hits += 1
+            return entry[1]
+
+    def recent(self, rule_id):
+        # (version, compiled) when the version was checked less than recent_ttl seconds ago, else None
+        entry = self._entries.get(rule_id) if self.recent_ttl else None
+        if entry is None or monotonic() - entry[2] >= self.recent_ttl:
+            return None
+        self.recent_hits += 1
+        return entry[0], entry[1]
+
+    def set(self, rule_id, version, compiled):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[rule_id] = (version, compiled, monotonic())
+            self._entries.move_to_end(rule_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, rule_id):
+        with self._lock:
+            self._entries.pop(rule_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'recent_hits': self.recent_hits,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+
+class SharedRuleCache:
+    # Rule data shared by every worker process through Django's cache framework (CACHES[alias]):
+    #   rule:<id>:version        the rule's current version, 0 when it does not exist
+    #   rule:<id>:<version>:ast  encode_compiled() of that version; never changes, so never invalidated
+    #   rules:generation         token replaced on every change, for whole-store structures (the match index)
+    # A version read from here saves the per-request database probe, so a save or delete deletes the key
+    # instead of writing it, and readers fill it in again from the database. That keeps two concurrent
+    # writers from leaving the older version behind; the remaining race (a reader filling in a version
+    # read just before a write) is bounded by version_timeout. A version_timeout of 0 disables version
+    # keys, which is what a per-process backend such as locmem needs: it cannot see other workers' saves.
+    GENERATION_KEY = 'rules:generation'
+
+    def __init__(self, alias='rules', version_timeout=0):
+        self.alias = alias
+        self.version_timeout = version_timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def _version_key(rule_id):
+        return f'rule:{rule_id}:version'
+
+    @staticmethod
+    def _payload_key(rule_id, version):
+        return f'rule:{rule_id}:{version}:ast'
+
+    def versions(self, rule_ids):
+        # {rule_id: version} of the given rules that have a version key (0 for a missing rule)
+        if not self.version_timeout:
+            return {}
+        keys = {self._version_key(rule_id): rule_id for rule_id in rule_ids}
+        return {keys[key]: version for key, version in self.cache.get_many(list(keys)).items()}
+
+    def remember_versions(self, versions):
+        # Stores {rule_id: version} read from the database (0 for a missing rule)
+        if self.version_timeout and versions:
+            self.cache.set_many(
+                {self._version_key(rule_id): version for rule_id, version in versions.items()}, self.version_timeout
+            )
+
+    def payloads(self, keys):
+        # {(rule_id, version): (ast bytes, plan bytes or None)} for the keys that are cached
+        keys = {self._payload_key(rule_id, version): (rule_id, version) for rule_id, version in keys}
+        return {keys[key]: payload for key, payload in self.cache.get_many(list(keys)).items()}
+
+    def set_payloads(self, payloads):
+        if payloads:
+            self.cache.set_many({self._payload_key(*key): payload for key, payload in payloads.items()})
+
+    def changed(self, rule_id):
+        # Called after a rule is saved, deleted or re-planned
+        self.changed_many([rule_id])
+
+    def changed_many(self, rule_ids):
+        # Same as changed() for many rules at once (bulk imports), with a single new generation
+        self.cache.delete_many([self._version_key(rule_id) for rule_id in rule_ids])
+        self.cache.set(self.GENERATION_KEY, uuid.uuid4().hex)
+
+    def generation(self):
+        # Current generation token; a missing key (expired, evicted, cache cleared) starts a new one
+        token = self.cache.get(self.GENERATION_KEY)
+        if token is None:
+            self.cache.add(self.GENERATION_KEY, uuid.uuid4().hex)
+            token = self.cache.get(self.GENERATION_KEY)
+        return token
+
+
+class ParsedGroupCache:
+    # Process level LRU cache of parsed parenthesized groups, keyed by the group's normalized text
+    # ("( age > 30 AND salary > 50000 )"). A group parses to the same subtree wherever it appears,
+    # so create_rule takes the subtree of a group it has seen instead of parsing its tokens again:
+    # re-parsing an edited rule only walks the groups that enclose the edit. Groups shorter than
+    # min_tokens are not worth the lookup; the cache holds at most max_tokens tokens of groups
+    # (about 46 bytes each, nested groups counted again). Subtrees are shared between the rules
+    # that contain them and must not be modified.
+    def __init__(self, max_tokens=50000, min_tokens=32):
+        self.max_tokens = max_tokens
+        self.min_tokens = min_tokens
+        self._entries = OrderedDict()  # group text -> (subtree, tokens)
+        self._tokens = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def enabled_for(self, tokens):
+        return self.max_tokens > 0 and len(tokens) >= 2 * self.min_tokens
+
+    def groups(self, tokens):
+        # {index of '(': index of its ')'} for the groups of tokens long enough to be cached
+        closing = {}
+        opened = []
+        for index, token in enumerate(tokens):
+            if token == '(':
+                opened.append(index)
+            elif token == ')' and opened:
+                start = opened.pop()
+                if index - start >= self.min_tokens:
+                    closing[start] = index
+        return closing
+
+    def get(self, text):
+        with self._lock:
+            entry = self._entries.get(text)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(text)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, text, subtree, tokens):
+        if tokens > self.max_tokens:
+            return
+        with self._lock:
+            previous = self._entries.pop(text, None)
+            if previous is not None:
+                self._tokens -= previous[1]
+            self._entries[text] = (subtree, tokens)
+            self._tokens += tokens
+            while self._tokens > self.max_tokens:
+                self._tokens -= self._entries.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': self._tokens,
+                'maxsize': self.max_tokens,
+            }
+
+
+class ResultCache:
+    # Process level LRU cache of evaluation results keyed by rule id, version and a hash of the values
+    # of the fields the rule references (CompiledRule.fields), so a record seen before, or one that
+    # only differs in fields the rule never reads, is answered with a dictionary lookup. The values
+    # are kept with the entry and compared on a hit, so two records whose hashes collide never share
+    # a result. They are keyed with their types: 1, 1.0 and True are equal but a rule can tell them apart.
+    # Building the key reads every referenced field, so it only pays off for rules with many
+    # conditions per field; other rules skip the cache after an O(1) check of their shape, and
+    # evaluating them costs what it costs without the cache.
+    # Entries expire after ttl seconds (0 keeps them until evicted). A new version makes the entries
+    # of the old one unreachable, and invalidate() drops them right away. Only results are stored:
+    # a record that raises is evaluated, and raises, every time. maxsize 0 disables the cache.
+    MISSING = object()  # stands in for a referenced field the record does not have
+    MIN_CONDITIONS = 32             # smaller rules evaluate in about the time a lookup takes
+    MIN_CONDITIONS_PER_FIELD = 8    # below this the key costs about as much as evaluating
+
+    def __init__(self, maxsize=0, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (rule_id, version, hash) -> (values, expiry or None, result)
+        self._keys = defaultdict(set)  # rule_id -> its keys in _entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, rule_id, version, compiled, data):
+        # Cache key of evaluating the compiled rule against data, None when the rule is not worth
+        # caching or data cannot be cached (not a dict, or a referenced value that is not hashable)
+        if self.maxsize <= 0 or type(data) is not dict:
+            return None
+        conditions = len(compiled.conditions)
+        if conditions < self.MIN_CONDITIONS or conditions < self.MIN_CONDITIONS_PER_FIELD * len(compiled.fields):
+            return None
+        try:
+            values = compiled.field_values(data)
+        except KeyError:
+            missing = self.MISSING
+            values = tuple([data.get(field, missing) for field in compiled.fields])
+        if 0 in values:
+            # -0.0 == 0.0, but '=' with a text constant compares str(value), which tells them apart
+            values = tuple([repr(value) if type(value) is float else value for value in values])
+        values = (values, tuple(map(type, values)))
+        try:
+            return (rule_id, version, hash(values)), values
+        except TypeError:
+            return None
+
+    def get(self, key):
+        # The cached result, None on a miss
+        key, values = key
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != values:
+                self.misses += 1
+                return None
+            if entry[1] is not None and entry[1] <= monotonic():
+                self._remove(key)
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, result):
+        if result is None:
+            return
+        key, values = key
+        expiry = monotonic() + self.ttl if self.ttl > 0 else None
+        with self._lock:
+            self._entries[key] = (values, expiry, result)
+            self._entries.move_to_end(key)
+            self._keys[key[0]].add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        del self._entries[key]
+        keys = self._keys[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._keys[key[0]]
+
+    def invalidate(self, rule_id):
+        with self._lock:
+            for key in self._keys.pop(rule_id, ()):
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+
+compiled_rules = CompiledRuleCache(
+    maxsize=getattr(settings, 'RULE_CACHE_SIZE', 1024),
+    recent_ttl=getattr(settings, 'RULE_ASYNC_VERSION_TTL', 1),
+)
+# Shared predicate tables for multi-rule evaluation, keyed by the requested ids and their versions
+compiled_rulesets = CompiledRuleCache(maxsize=getattr(settings, 'RULESET_CACHE_SIZE', 32))
+# Versions and encoded ASTs shared between worker processes (settings.CACHES['rules'])
+shared_rules = SharedRuleCache(
+    alias=getattr(settings, 'RULE_CACHE_ALIAS', 'rules'),
+    version_timeout=getattr(settings, 'RULE_VERSION_TIMEOUT', 0),
+)
+# Parsed groups of recently created or updated rules, for incremental re-parsing (see create_rule)
+parsed_groups = ParsedGroupCache(max_tokens=getattr(settings, 'RULE_PARSE_CACHE_TOKENS', 50000))
+# Results of recent evaluations, for records evaluated again (disabled unless RULE_RESULT_CACHE_SIZE > 0)
+rule_results = ResultCache(
+    maxsize=getattr(settings, 'RULE_RESULT_CACHE_SIZE', 0),
+    ttl=getattr(settings, 'RULE_RESULT_CACHE_TTL', 300),
+)
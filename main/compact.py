@@ -0,0 +1,242 @@
+from .values import operand_json
+from array import array
+import struct
+import sys
+import zlib
+
+# Array-backed AST representation.
+#
+# A CompactAST stores a rule in pre-order as four parallel arrays instead of one Python object
+# per node: an opcode (OPERAND / AND / OR), the index of the left and right child (-1 when
+# absent) and, for operands, an index into the rule's own tuple of distinct condition strings.
+# The strings are interned with sys.intern, so a condition repeated across rules ("age > 30") is
+# stored once per process while a rule using it is alive, and freed with the last such rule:
+# there is no process-wide table to outgrow the rules actually loaded.
+
+OPERAND = 0
+AND = 1
+OR = 2
+NO_CHILD = -1
+
+OPCODES = {'AND': AND, 'OR': OR}
+OPERATORS = {AND: 'AND', OR: 'OR'}
+
+
+def _condition_ids(conditions):
+    # intern(condition) -> index of condition in the list `conditions`, appended on first use
+    ids = {}
+
+    def intern(condition):
+        condition_id = ids.get(condition)
+        if condition_id is None:
+            condition_id = ids[condition] = len(conditions)
+            conditions.append(sys.intern(condition))
+        return condition_id
+    return intern
+
+
+class CompactAST:
+    __slots__ = ('opcodes', 'left', 'right', 'values', 'conditions')
+
+    def __init__(self, opcodes=None, left=None, right=None, values=None, conditions=()):
+        self.opcodes = opcodes if opcodes is not None else array('b')
+        self.left = left if left is not None else array('i')
+        self.right = right if right is not None else array('i')
+        self.values = values if values is not None else array('i')  # index into conditions, -1 for operators
+        self.conditions = conditions  # distinct condition strings of the rule
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    @classmethod
+    def from_node(cls, root):
+        # Flattens a Node tree (or anything with node_type/value/left/right) in pre-order
+        compact = cls()
+        if root is None:
+            return compact
+        opcodes, left, right, values = compact.opcodes, compact.left, compact.right, compact.values
+        conditions = []
+        intern = _condition_ids(conditions)
+        stack = [(root, -1, None)]
+        while stack:
+            node, parent, side = stack.pop()
+            index = len(opcodes)
+            if parent >= 0:
+                (left if side == 'left' else right)[parent] = index
+            if node.node_type == 'operand':
+                opcodes.append(OPERAND)
+                values.append(intern(node.value))
+            elif node.node_type == 'operator':
+                opcode = OPCODES.get(node.value)
+                if opcode is None:
+                    raise ValueError(f"Unsupported operator: {node.value}")
+                opcodes.append(opcode)
+                values.append(-1)
+                if node.right is not None:
+                    stack.append((node.right, index, 'right'))
+                if node.left is not None:
+                    stack.append((node.left, index, 'left'))
+            else:
+                raise ValueError(f"Invalid node type: {node.node_type}")
+            left.append(NO_CHILD)
+            right.append(NO_CHILD)
+        compact.conditions = tuple(conditions)
+        return compact
+
+    @classmethod
+    def from_json(cls, ast_dict):
+        # Flattens the nested dict stored in rules.rule_ast without building Nodes
+        compact = cls()
+        if not ast_dict:
+            return compact
+        opcodes, left, right, values = compact.opcodes, compact.left, compact.right, compact.values
+        conditions = []
+        intern = _condition_ids(conditions)
+        stack = [(ast_dict, -1, None)]
+        while stack:
+            data, parent, side = stack.pop()
+            index = len(opcodes)
+            if parent >= 0:
+                (left if side == 'left' else right)[parent] = index
+            if data['node_type'] == 'operand':
+                opcodes.append(OPERAND)
+                values.append(intern(data['value']))
+            elif data['node_type'] == 'operator':
+                opcode = OPCODES.get(data['value'])
+                if opcode is None:
+                    raise ValueError(f"Unsupported operator: {data['value']}")
+                opcodes.append(opcode)
+                values.append(-1)
+                if data.get('right'):
+                    stack.append((data['right'], index, 'right'))
+                if data.get('left'):
+                    stack.append((data['left'], index, 'left'))
+            else:
+                raise ValueError(f"Invalid node type: {data['node_type']}")
+            left.append(NO_CHILD)
+            right.append(NO_CHILD)
+        compact.conditions = tuple(conditions)
+        return compact
+
+    def condition(self, index):
+        return self.conditions[self.values[index]]
+
+    def condition_set(self):
+        # Distinct conditions of the rule
+        return {self.conditions[value] for value in set(self.values) if value >= 0}
+
+    def to_node(self, node_class):
+        # Rebuilds a Node tree; node_class is views.Node
+        if not self.opcodes:
+            return None
+        conditions = self.conditions
+        nodes = [None] * len(self.opcodes)
+        for index in range(len(self.opcodes) - 1, -1, -1):
+            opcode = self.opcodes[index]
+            if opcode == OPERAND:
+                nodes[index] = node_class(node_type='operand', value=conditions[self.values[index]])
+            else:
+                left, right = self.left[index], self.right[index]
+                nodes[index] = node_class(
+                    node_type='operator',
+                    value=OPERATORS[opcode],
+                    left=nodes[left] if left != NO_CHILD else None,
+                    right=nodes[right] if right != NO_CHILD else None,
+                )
+        return nodes[0]
+
+    def to_json(self):
+        # Same nested dict as ast_to_json(self.to_node(...)), built without creating Nodes
+        if not self.opcodes:
+            return None
+        dicts = [None] * len(self.opcodes)
+        for index in range(len(self.opcodes) - 1, -1, -1):
+            opcode = self.opcodes[index]
+            if opcode == OPERAND:
+                condition = self.conditions[self.values[index]]
+                dicts[index] = {'node_type': 'operand', 'value': condition, **operand_json(condition)}
+            else:
+                left, right = self.left[index], self.right[index]
+                dicts[index] = {
+                    'node_type': 'operator',
+                    'value': OPERATORS[opcode],
+                    'left': dicts[left] if left != NO_CHILD else None,
+                    'right': dicts[right] if right != NO_CHILD else None,
+                }
+        return dicts[0]
+
+    def nbytes(self):
+        # Memory held by the arrays and the condition tuple (the interned strings are shared between rules)
+        parts = (self, self.opcodes, self.left, self.right, self.values, self.conditions)
+        return sum(sys.getsizeof(part) for part in parts)
+
+
+# Binary storage format for rules.rule_ast_compact:
+#   header: b'RA', format version, flags, node count, condition count (little endian)
+#   payload (zlib compressed when FLAG_COMPRESSED is set):
+#     uint32 byte length of each condition, the UTF-8 conditions back to back,
+#     int8 opcodes, int32 left, int32 right, int32 condition index (into this rule's conditions)
+MAGIC = b'RA'
+FORMAT_VERSION = 1
+FLAG_COMPRESSED = 1
+_HEADER = struct.Struct('<2sBBII')
+
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def encode(compact):
+    # Conditions are renumbered in order of first use, so equal trees encode to equal bytes
+    local_ids = {}
+    local_values = array('i', (
+        local_ids.setdefault(value, len(local_ids)) if value >= 0 else -1 for value in compact.values
+    ))
+    texts = [compact.conditions[condition_id].encode('utf-8') for condition_id in local_ids]
+    lengths = array('I', map(len, texts))
+    payload = b''.join([
+        _little_endian(lengths).tobytes(),
+        b''.join(texts),
+        compact.opcodes.tobytes(),
+        _little_endian(compact.left).tobytes(),
+        _little_endian(compact.right).tobytes(),
+        _little_endian(local_values).tobytes(),
+    ])
+    compressed = zlib.compress(payload, 6)
+    flags = 0
+    if len(compressed) < len(payload):
+        payload, flags = compressed, FLAG_COMPRESSED
+    return _HEADER.pack(MAGIC, FORMAT_VERSION, flags, len(compact.opcodes), len(texts)) + payload
+
+
+def decode(blob):
+    blob = bytes(blob)
+    magic, version, flags, node_count, condition_count = _HEADER.unpack_from(blob)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported compact AST format (version {version})")
+    payload = blob[_HEADER.size:]
+    if flags & FLAG_COMPRESSED:
+        payload = zlib.decompress(payload)
+
+    def take(typecode, count):
+        nonlocal offset
+        values = array(typecode)
+        end = offset + values.itemsize * count
+        values.frombytes(payload[offset:end])
+        offset = end
+        return _little_endian(values)
+
+    offset = 0
+    lengths = take('I', condition_count)
+    conditions = []
+    for length in lengths:
+        conditions.append(sys.intern(payload[offset:offset + length].decode('utf-8')))
+        offset += length
+    opcodes = take('b', node_count)
+    left = take('i', node_count)
+    right = take('i', node_count)
+    values = take('i', node_count)
+    return CompactAST(opcodes, left, right, values, tuple(conditions))
@@ -0,0 +1,353 @@
+from .compact import CompactAST, NO_CHILD, OPERAND, AND, decode, encode
+from .values import Schema, converter, operand_key, parse_operand, to_number
+from datetime import date
+from functools import lru_cache
+from operator import itemgetter
+import operator
+
+# Compiles a rule AST into a flat jump table so evaluation never walks the Node tree.
+#
+# Every operand (leaf) becomes one pre-bound predicate with its field name, comparison
+# function and typed constant resolved up front. Each leaf also gets two jump targets:
+# the next leaf to evaluate when the predicate is true and when it is false. AND/OR
+# short-circuiting is encoded entirely in those targets, e.g. for "a AND b" a false `a`
+# jumps straight to FALSE, exactly like evaluate_ast skipping the right subtree.
+
+TRUE = -1
+FALSE = -2
+
+# Conditions written by the optimizer for subtrees that are always true / always false
+CONSTANTS = {'TRUE': True, 'FALSE': False}
+
+COMPARATORS = {
+    '>': operator.gt,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>=': operator.ge,
+}
+
+
+# Value types that compare with a number / date constant without raising
+NUMBER_TYPES = frozenset((int, float, bool))
+DATE_TYPES = frozenset((date,))
+
+
+def _raising_predicate(field, message):
+    # Keeps evaluate_condition's lazy errors: nothing is raised unless the leaf is reached,
+    # and a missing field is still reported before a bad operator or constant
+    missing = f"Field '{field}' not present in input data"
+
+    def predicate(data):
+        if field is not None and field not in data:
+            raise ValueError(missing)
+        raise ValueError(message)
+    return predicate
+
+
+def parse_condition(condition):
+    # Splits a condition such as "department = 'Sales'" into ('department', '=', 'Sales')
+    parts = condition.split()
+    if len(parts) != 3:
+        raise ValueError(f"Invalid condition format: {condition}")
+    field, op, value = parts
+    return field, op, value.strip("'")  # Removing quotes if any (for string comparisons)
+
+
+@lru_cache(maxsize=65536)
+def compile_condition(condition):
+    # Turns a condition string such as "age > 30" into a predicate(data) -> bool.
+    # The condition is parsed and its constant typed here, once (see main.values);
+    # predicates are stateless, so rules sharing a condition share one closure
+    if condition in CONSTANTS:
+        constant = CONSTANTS[condition]
+        return lambda data: constant
+    try:
+        field, op, value = parse_condition(condition)
+    except ValueError as error:
+        return _raising_predicate(None, str(error))
+    try:
+        constant = parse_operand(condition).constant
+    except ValueError as error:
+        return _raising_predicate(field, str(error))
+    missing = f"Field '{field}' not present in input data"
+
+    if op == '=':
+        if type(constant) is str or type(constant) is date:
+            # dates and strings compare as text, identical to str(data_value) == value
+            def predicate(data):
+                try:
+                    data_value = data[field]
+                except (KeyError, TypeError):
+                    raise ValueError(missing) from None
+                return data_value == value if type(data_value) is str else str(data_value) == value
+            return predicate
+
+        def predicate(data):
+            # numeric equality for numbers and canonical number strings, text equality otherwise
+            try:
+                data_value = data[field]
+            except (KeyError, TypeError):
+                raise ValueError(missing) from None
+            kind = type(data_value)
+            if kind is int or kind is float:
+                return data_value == constant
+            if kind is str:
+                number = to_number(data_value)
+                return number == value if number is data_value else number == constant
+            return str(data_value) == value
+        return predicate
+
+    compare = COMPARATORS[op]
+    convert = converter(constant)
+
+    def predicate(data):
+        try:
+            data_value = data[field]
+        except (KeyError, TypeError):
+            raise ValueError(missing) from None
+        try:
+            return compare(data_value, constant)
+        except TypeError:
+            # a string holding a number or date is compared as one; anything else keeps the error
+            if type(data_value) is not str:
+                raise
+            converted = convert(data_value)
+            if converted is data_value:
+                raise
+            return compare(converted, constant)
+    return predicate
+
+
+def referenced_fields(conditions):
+    fields = set()
+    for condition in conditions:
+        if condition is None or condition in CONSTANTS:
+            continue
+        try:
+            fields.add(parse_condition(condition)[0])
+        except ValueError:
+            continue  # no field: the leaf always raises
+    return tuple(sorted(fields))
+
+
+def _no_fields(data):
+    return ()
+
+
+def _missing_child(data):
+    # evaluate_ast treats an absent child as None, which is falsy
+    return None
+
+
+class CompiledRule:
+    __slots__ = ('ast', 'conditions', 'predicates', 'on_true', 'on_false', 'schema', 'fields', 'field_values')
+
+    def __init__(self, ast, conditions, predicates, on_true, on_false):
+        self.ast = ast  # CompactAST the rule was compiled from
+        self.conditions = conditions  # operand strings in evaluation order (None for absent children)
+        self.predicates = predicates
+        self.on_true = on_true
+        self.on_false = on_false
+        # Conversion of text columns for the fields compared with numbers or dates (main.vectorized);
+        # the predicates convert the strings they reach themselves
+        self.schema = Schema.from_conditions(conditions)
+        # Sorted names of the fields the rule reads; the result depends on nothing else in a record.
+        # field_values(data) returns their values as a tuple (KeyError when one is missing)
+        self.fields = referenced_fields(conditions)
+        self.field_values = itemgetter(*self.fields, *self.fields[:1]) if self.fields else _no_fields
+
+    def evaluate(self, data):
+        predicates = self.predicates
+        if not predicates:
+            return None
+        on_true = self.on_true
+        on_false = self.on_false
+        i = 0
+        while i >= 0:
+            i = on_true[i] if predicates[i](data) else on_false[i]
+        return i == TRUE
+
+    __call__ = evaluate
+
+
+class PlannedRule(CompiledRule):
+    # A rule with a reordered evaluation plan (see main.statistics). The inherited tables are the
+    # original rule's, so rule sets, the match index and columnar evaluation are unaffected.
+    # evaluate() only takes the planned order when the record has every referenced field, with a
+    # number wherever the rule compares with a number and a date wherever it compares with a date:
+    # no leaf can raise then, so both orders give the same result. Anything else falls back to
+    # the original order and its exact errors.
+    __slots__ = ('planned', 'present', 'numeric', 'dates')
+
+    def __init__(self, original, planned):
+        super().__init__(original.ast, original.conditions, original.predicates, original.on_true, original.on_false)
+        self.planned = planned
+        kinds = {}  # field -> set of constant types it is compared with ('=' needs presence only)
+        for condition in original.conditions:
+            if condition is None or condition in CONSTANTS:
+                continue
+            field, op, constant = parse_operand(condition)
+            compared = kinds.setdefault(field, set())
+            if op != '=':
+                compared.add(date if isinstance(constant, date) else int)
+        text_fields = [field for field, compared in kinds.items() if not compared]
+        numeric_fields = [field for field, compared in kinds.items() if int in compared]
+        date_fields = [field for field, compared in kinds.items() if date in compared]
+        # itemgetters check presence in one call; the typed ones always return a tuple
+        self.present = itemgetter(*text_fields) if text_fields else None
+        self.numeric = itemgetter(*numeric_fields, *numeric_fields[:1]) if numeric_fields else None
+        self.dates = itemgetter(*date_fields, *date_fields[:1]) if date_fields else None
+
+    def evaluate(self, data):
+        try:
+            if self.present is not None:
+                self.present(data)
+            values = self.numeric(data) if self.numeric is not None else ()
+            dates = self.dates(data) if self.dates is not None else ()
+        except (KeyError, TypeError):
+            return CompiledRule.evaluate(self, data)
+        if NUMBER_TYPES.issuperset(map(type, values)) and DATE_TYPES.issuperset(map(type, dates)):
+            return self.planned.evaluate(data)
+        return CompiledRule.evaluate(self, data)
+
+    __call__ = evaluate
+
+
+def plannable(compiled):
+    # Only rules whose every leaf is a well-formed condition can be safely reordered
+    for condition in compiled.conditions:
+        if condition is None or condition in CONSTANTS:
+            continue
+        try:
+            parse_operand(condition)
+        except ValueError:
+            return False
+    return True
+
+
+def compile_ast(root):
+    # Compiles a rule into a CompiledRule. Accepts a Node tree (as built by deserialize_ast /
+    # create_rule) or a CompactAST; both passes use explicit stacks, so depth is not limited.
+    compact = root if isinstance(root, CompactAST) else CompactAST.from_node(root)
+    opcodes, lefts, rights = compact.opcodes, compact.left, compact.right
+    if not opcodes:
+        return CompiledRule(compact, (), (), (), ())
+
+    # Pass 1: number the leaves left to right and record, for every operator in pre-order,
+    # the index of the first leaf of its right subtree (where a short-circuit jump lands).
+    # A missing child (NO_CHILD) counts as a leaf that is never true.
+    conditions = []
+    right_entries = []
+    stack = [(0, -1)]
+    while stack:
+        index, parent = stack.pop()
+        if parent >= 0:
+            right_entries[parent] = len(conditions)
+        if index == NO_CHILD:
+            conditions.append(None)
+        elif opcodes[index] == OPERAND:
+            conditions.append(compact.condition(index))
+        else:
+            stack.append((rights[index], len(right_entries)))
+            stack.append((lefts[index], -1))
+            right_entries.append(None)
+
+    # Pass 2: walk the tree in the same order, pushing the true/false continuations down to the leaves
+    on_true = []
+    on_false = []
+    operator_index = 0
+    stack = [(0, TRUE, FALSE)]
+    while stack:
+        index, if_true, if_false = stack.pop()
+        if index == NO_CHILD or opcodes[index] == OPERAND:
+            on_true.append(if_true)
+            on_false.append(if_false)
+            continue
+        right_entry = right_entries[operator_index]
+        operator_index += 1
+        stack.append((rights[index], if_true, if_false))
+        if opcodes[index] == AND:
+            stack.append((lefts[index], right_entry, if_false))
+        else:
+            stack.append((lefts[index], if_true, right_entry))
+
+    predicates = [
+        _missing_child if condition is None else compile_condition(condition)
+        for condition in conditions
+    ]
+    return CompiledRule(compact, tuple(conditions), tuple(predicates), tuple(on_true), tuple(on_false))
+
+
+def encode_compiled(compiled):
+    # Picklable form of a compiled rule, (ast bytes, plan bytes or None): compiled rules hold
+    # closures, so rules are shipped to worker processes and shared caches in this form
+    plan = encode(compiled.planned.ast) if isinstance(compiled, PlannedRule) else None
+    return encode(compiled.ast), plan
+
+
+def compile_encoded(ast, plan=None):
+    # Inverse of encode_compiled
+    compiled = compile_ast(decode(ast))
+    if plan is not None:
+        compiled = PlannedRule(compiled, compile_ast(decode(plan)))
+    return compiled
+
+
+_UNSET = object()
+
+
+class CompiledRuleSet:
+    # Evaluates many compiled rules against one record through a shared predicate table.
+    # Conditions that mean the same thing ("age > 30" in several rules) share one slot, and
+    # a slot is evaluated at most once per record no matter how many rules reach it.
+    __slots__ = ('rule_ids', 'predicates', 'slots', 'on_true', 'on_false')
+
+    def __init__(self, compiled_by_id):
+        table = {}
+        self.rule_ids = []
+        self.predicates = []
+        self.slots = []
+        self.on_true = []
+        self.on_false = []
+        for rule_id, compiled in compiled_by_id.items():
+            rule_slots = []
+            for condition, predicate in zip(compiled.conditions, compiled.predicates):
+                try:
+                    key = operand_key(parse_operand(condition)) if condition is not None else None
+                except ValueError:
+                    key = condition
+                slot = table.get(key) if key is not None else None
+                if slot is None:
+                    slot = len(self.predicates)
+                    self.predicates.append(predicate)
+                    if key is not None:
+                        table[key] = slot
+                rule_slots.append(slot)
+            self.rule_ids.append(rule_id)
+            self.slots.append(rule_slots)
+            self.on_true.append(compiled.on_true)
+            self.on_false.append(compiled.on_false)
+
+    def evaluate(self, data):
+        # Returns (matching rule ids, {rule_id: error message}) for a single record
+        predicates = self.predicates
+        memo = [_UNSET] * len(predicates)
+        matches = []
+        errors = {}
+        for rule_id, slots, on_true, on_false in zip(self.rule_ids, self.slots, self.on_true, self.on_false):
+            if not slots:
+                continue
+            try:
+                i = 0
+                while i >= 0:
+                    slot = slots[i]
+                    outcome = memo[slot]
+                    if outcome is _UNSET:
+                        outcome = memo[slot] = predicates[slot](data)
+                    i = on_true[i] if outcome else on_false[i]
+            except (ValueError, KeyError, TypeError) as error:
+                errors[rule_id] = str(error)
+                continue
+            if i == TRUE:
+                matches.append(rule_id)
+        return matches, errors
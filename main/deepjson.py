@@ -0,0 +1,111 @@
+import json
+import re
+
+# json.dumps/json.loads recurse once per nesting level and raise RecursionError around a
+# thousand levels, which a left-deep rule AST reaches easily. These wrappers use the stdlib
+# codec when it can cope and fall back to explicit-stack versions producing identical output.
+
+_TOKEN = re.compile(r'[ \t\n\r]*(?:([{}\[\],:])|(")|(-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][-+]?\d+)?)|(true|false|null))')
+_LITERALS = {'true': True, 'false': False, 'null': None}
+
+
+def dumps(obj, indent=None):
+    try:
+        return json.dumps(obj, indent=indent)
+    except RecursionError:
+        return _dumps_iterative(obj, indent)
+
+
+def loads(text):
+    try:
+        return json.loads(text)
+    except RecursionError:
+        return _loads_iterative(text)
+
+
+def _dumps_iterative(obj, indent):
+    # Work items are either literal text or (value, nesting level) still to be encoded
+    item_separator = ',' if indent is not None else ', '
+    parts = []
+    work = [(obj, 0)]
+    while work:
+        item = work.pop()
+        if isinstance(item, str):
+            parts.append(item)
+            continue
+        value, level = item
+        if isinstance(value, dict):
+            items = list(value.items())
+        elif isinstance(value, (list, tuple)):
+            items = [(None, element) for element in value]
+        else:
+            parts.append(json.dumps(value))
+            continue
+        opening, closing = ('{', '}') if isinstance(value, dict) else ('[', ']')
+        if not items:
+            parts.append(opening + closing)
+            continue
+        if indent is None:
+            newline = closing_newline = ''
+        else:
+            newline = '\n' + ' ' * (indent * (level + 1))
+            closing_newline = '\n' + ' ' * (indent * level)
+        work.append(closing_newline + closing)
+        for position in range(len(items) - 1, -1, -1):
+            key, element = items[position]
+            work.append((element, level + 1))
+            prefix = newline if position == 0 else item_separator + newline
+            if key is not None:
+                prefix += json.dumps(str(key)) + ': '
+            work.append(prefix)
+        work.append(opening)
+    return ''.join(parts)
+
+
+def _loads_iterative(text):
+    # Minimal JSON parser with an explicit container stack; strings are decoded by the stdlib scanner
+    stack = []          # [container, pending dict key]
+    pos = 0
+    result = None
+    done = False
+    expect_key = False
+    while True:
+        match = _TOKEN.match(text, pos)
+        if match is None or done:
+            if done and not text[pos:].strip():
+                return result
+            raise ValueError(f"Invalid JSON at position {pos}")
+        punctuation, quote, number, literal = match.groups()
+        pos = match.end()
+
+        if punctuation in ('{', '['):
+            stack.append([{} if punctuation == '{' else [], None])
+            expect_key = punctuation == '{'
+            continue
+        if punctuation in ('}', ']'):
+            if not stack:
+                raise ValueError(f"Invalid JSON at position {pos}")
+            value = stack.pop()[0]
+        elif punctuation == ',':
+            expect_key = bool(stack) and isinstance(stack[-1][0], dict)
+            continue
+        elif punctuation == ':':
+            continue
+        elif quote:
+            value, pos = json.decoder.scanstring(text, pos)
+            if expect_key:
+                stack[-1][1] = value
+                expect_key = False
+                continue
+        elif number:
+            value = json.loads(number)
+        else:
+            value = _LITERALS[literal]
+
+        if not stack:
+            result = value
+            done = True
+        elif isinstance(stack[-1][0], dict):
+            stack[-1][0][stack[-1][1]] = value
+        else:
+            stack[-1][0].append(value)
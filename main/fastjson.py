@@ -0,0 +1,23 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; the stdlib codec gives the same results, only slower
+    orjson = None
+
+# Request/response body codec for the lean endpoints, which read and write bytes directly
+# instead of going through DRF's parsers, serializers and renderers.
+# Both functions raise ValueError for undecodable input, whichever codec is in use.
+
+
+def loads(body):
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def dumps(obj):
+    # Compact UTF-8 JSON bytes
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
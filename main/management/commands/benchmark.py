@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand, CommandError
+from main.benchmarks.suite import compare, run
+import json
+
+# Runs the benchmark suite of main/benchmarks/suite.py on a throwaway test database and prints
+# one line per benchmark. --output writes the results as JSON; --compare reads an earlier
+# result file and fails (exit status 1) when a benchmark got slower than --threshold allows.
+#
+#   python manage.py benchmark --output baseline.json
+#   python manage.py benchmark --compare baseline.json --threshold 0.25 --output current.json
+#   python manage.py benchmark --quick --only core
+#
+# Timings are only comparable between runs on the same machine with the same --quick setting.
+
+
+class Command(BaseCommand):
+    help = "Times rule parsing, deserialization, evaluation, combining and the API, optionally against a baseline"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="file to write the results to, as JSON")
+        parser.add_argument('--compare', metavar='BASELINE', help="results file of an earlier run to compare with")
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help="allowed slowdown against the baseline, as a fraction (default 0.25)")
+        parser.add_argument('--quick', action='store_true', help="fewer records, requests and repeats")
+        parser.add_argument('--repeat', type=int, help="runs per benchmark, the best is kept (default 5, 3 with --quick)")
+        parser.add_argument('--seed', type=int, default=0, help="seed of the synthetic rules and records")
+        parser.add_argument('--only', nargs='+', choices=('core', 'combine', 'api'), help="benchmark groups to run")
+
+    def handle(self, *args, **options):
+        if options['threshold'] < 0:
+            raise CommandError("--threshold must not be negative")
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as baseline_file:
+                    baseline = json.load(baseline_file)
+            except (OSError, ValueError) as error:
+                raise CommandError(f"Cannot read the baseline {options['compare']}: {error}")
+
+        results = run(quick=options['quick'], repeat=options['repeat'], seed=options['seed'], only=options['only'])
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+                output.write('\n')
+
+        if baseline is None:
+            for name, result in results['benchmarks'].items():
+                self.stdout.write(f"{name:<48} {_format(result['seconds']):>10}/{result['unit']}")
+            return
+
+        if baseline.get('parameters', {}).get('quick') != results['parameters']['quick']:
+            self.stderr.write("Warning: the baseline was run with a different --quick setting")
+        rows = compare(baseline, results, options['threshold'])
+        for name, before, after, ratio, regressed in rows:
+            line = f"{name:<48} {_format(before):>10} -> {_format(after):>10} {ratio:>6.2f}x"
+            self.stdout.write(self.style.ERROR(line + "  REGRESSION") if regressed else line)
+        regressions = [row[0] for row in rows if row[4]]
+        if regressions:
+            raise CommandError(
+                f"{len(regressions)} of {len(rows)} benchmarks are more than {options['threshold']:.0%} slower "
+                f"than {options['compare']}: {', '.join(regressions)}"
+            )
+
+
+def _format(seconds):
+    if seconds >= 1:
+        return f"{seconds:.2f}s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f}ms"
+    return f"{seconds * 1e6:.1f}us"
@@ -0,0 +1,159 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.http import Http404
+from itertools import islice
+from main.parallel import ParallelEvaluator, evaluate_records
+from main.values import to_number
+import csv
+import json
+import sys
+import time
+
+# Scores an NDJSON or CSV file (or stdin) against stored rules without loading it into memory.
+#
+# The input flows through a chain of generators: lines are parsed into records one at a time,
+# grouped into chunks of --chunk-size rows, evaluated, and every chunk's results are written and
+# flushed before the next chunk is read. Only one chunk is ever held in memory, or with
+# --workers N a bounded window of 2N chunks being evaluated by N worker processes.
+#
+#   python manage.py evaluate_stream 1 2 --input records.ndjson --output results.ndjson
+#   cat records.csv | python manage.py evaluate_stream 3 --format csv
+#   python manage.py evaluate_stream 1 --input big.ndjson --output out.ndjson --workers 0
+#
+# Each output line is {"row": n, "results": {"<rule id>": true|false|null}, "errors": {...}};
+# a rule that raises for a row (e.g. a missing field) gets null and its error message.
+
+
+def read_ndjson(stream):
+    # Yields (row number, record); undecodable lines yield a ValueError in place of the record
+    for row, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield row, json.loads(line)
+        except ValueError as error:
+            yield row, ValueError(f"Invalid JSON on line {row}: {error}")
+
+
+def read_csv(stream):
+    # Yields (row number, record) from a CSV file with a header line; row numbers count data rows.
+    # Empty cells are left out of the record, so a rule sees them as missing fields. Cells that are
+    # the canonical text of a number are read as numbers, so '=' conditions (which compare the
+    # text) see exactly the original cell; dates are converted by the rules' schema. A row with more
+    # cells than the header yields a ValueError in place of the record, like an undecodable NDJSON line
+    for row, record in enumerate(csv.DictReader(stream), start=1):
+        if None in record:
+            yield row, ValueError(f"Row {row} has {len(record[None])} more cell(s) than the header")
+            continue
+        yield row, {field: to_number(value) for field, value in record.items() if value not in ('', None)}
+
+
+def chunked(rows, size):
+    # Groups an iterator into lists of at most `size` items
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def score_chunk(compiled_by_id, chunk):
+    # Output text for a chunk of (row number, record) pairs
+    output = evaluate_records(compiled_by_id, [record for row, record in chunk])
+    return ''.join(
+        json.dumps({'row': row, 'results': results, 'errors': errors}) + '\n'
+        for (row, record), (results, errors) in zip(chunk, output)
+    )
+
+
+def evaluate_chunks(chunks, compiled_by_id, sample=None, evaluator=None):
+    # Yields the output text of every chunk, in input order. sample(rule_id, compiled, records)
+    # is called once per chunk and rule, e.g. to feed runtime statistics; it always runs in this
+    # process. With a ParallelEvaluator the chunks are scored on its worker processes
+    def sampled(chunks):
+        for chunk in chunks:
+            records = [record for row, record in chunk if not isinstance(record, Exception)]
+            for rule_id, compiled in compiled_by_id.items():
+                sample(rule_id, compiled, records)
+            yield chunk
+
+    if sample is not None:
+        chunks = sampled(chunks)
+    if evaluator is not None:
+        yield from evaluator.map(chunks, score_chunk)
+        return
+    for chunk in chunks:
+        yield score_chunk(compiled_by_id, chunk)
+
+
+class Command(BaseCommand):
+    help = 'Evaluates stored rules against an NDJSON or CSV stream and writes one NDJSON result line per row.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('rule_ids', nargs='+', type=int, help='Ids of the stored rules to evaluate')
+        parser.add_argument('--input', default='-', help="Input file, '-' for stdin (default)")
+        parser.add_argument('--output', default='-', help="Output file, '-' for stdout (default)")
+        parser.add_argument('--format', choices=['ndjson', 'csv'], help='Input format (default: from the file extension, else ndjson)')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows evaluated and written per chunk (default 1000)')
+        parser.add_argument('--workers', type=int, default=1, help='Worker processes evaluating chunks; 0 uses every CPU (default 1, in-process)')
+        parser.add_argument('--progress', type=int, default=0, help='Report throughput every N rows (default: only at the end)')
+
+    def handle(self, *args, **options):
+        from main import views
+        from main.statistics import rule_statistics
+
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        if options['workers'] < 0:
+            raise CommandError('--workers must be 0 or more')
+        try:
+            compiled_by_id, versions = views.load_compiled_rules(list(dict.fromkeys(options['rule_ids'])))
+        except Http404 as error:
+            raise CommandError(str(error))
+
+        fmt = options['format']
+        if fmt is None:
+            fmt = 'csv' if options['input'].lower().endswith('.csv') else 'ndjson'
+
+        def sample(rule_id, compiled, records):
+            # Same sampled profiling as the batch endpoint, so offline scoring also tunes rule plans
+            for index in rule_statistics.sample_positions(len(records)):
+                if rule_statistics.record(rule_id, compiled, records[index]):
+                    views.save_evaluation_plan(rule_id, versions[rule_id], compiled)
+
+        try:
+            source = sys.stdin if options['input'] == '-' else open(options['input'], newline='', encoding='utf-8')
+            target = sys.stdout if options['output'] == '-' else open(options['output'], 'w', encoding='utf-8')
+        except OSError as error:
+            raise CommandError(str(error))
+        rows = 0
+        next_report = options['progress']
+        evaluator = None
+        if options['workers'] != 1:
+            evaluator = ParallelEvaluator(compiled_by_id, workers=options['workers'] or None)
+        start = time.perf_counter()
+        try:
+            records = read_csv(source) if fmt == 'csv' else read_ndjson(source)
+            chunks = chunked(records, options['chunk_size'])
+            for text in evaluate_chunks(chunks, compiled_by_id, sample, evaluator):
+                target.write(text)
+                target.flush()
+                rows += text.count('\n')
+                if next_report and rows >= next_report:
+                    self._report(rows, start)
+                    next_report += options['progress']
+        finally:
+            if evaluator is not None:
+                evaluator.close()
+            if source is not sys.stdin:
+                source.close()
+            if target is not sys.stdout:
+                target.close()
+        self._report(rows, start, final=True)
+
+    def _report(self, rows, start, final=False):
+        elapsed = time.perf_counter() - start
+        rate = rows / elapsed if elapsed > 0 else 0.0
+        prefix = 'Evaluated' if final else 'Progress:'
+        self.stderr.write(f"{prefix} {rows} rows in {elapsed:.2f}s ({rate:,.0f} rows/s)")
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from main.bulk import export_rules
+import sys
+
+# Writes every stored rule as NDJSON, {"id": ..., "rule_name": ..., "rule_string": ...} per line in
+# id order, reading --batch-size rows per query so the table is never loaded at once.
+# The output can be read back by import_rules (which ignores "id") or posted to /rules/import.
+#
+#   python manage.py export_rules --output catalog.ndjson
+
+
+class Command(BaseCommand):
+    help = 'Exports the stored rules as NDJSON without loading the whole table into memory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='-', help="Output file, '-' for stdout (default)")
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rules read per query (default 1000)')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        try:
+            target = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        except OSError as error:
+            raise CommandError(str(error))
+        try:
+            for chunk in export_rules(batch_size=options['batch_size']):
+                target.write(chunk)
+            target.flush()
+        finally:
+            if target is not sys.stdout.buffer:
+                target.close()
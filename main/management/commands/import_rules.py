@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from main.bulk import import_rules
+import sys
+import time
+
+# Imports rules from an NDJSON file (or stdin), one {"rule_name": ..., "rule_string": ...} per line,
+# the format written by export_rules. Batches of --batch-size lines are parsed, on --workers
+# processes, and inserted with bulk_create, one transaction per batch (see main.bulk).
+#
+#   python manage.py import_rules --input catalog.ndjson --workers 0
+#   python manage.py export_rules | python manage.py import_rules
+#
+# Lines that cannot be imported are reported on stderr with their line number and skipped; the
+# command then exits with status 1, after the valid rules have been imported.
+
+
+class Command(BaseCommand):
+    help = 'Imports rules from an NDJSON stream, parsing them in parallel and inserting them in batched transactions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--input', default='-', help="Input file, '-' for stdin (default)")
+        parser.add_argument('--batch-size', type=int, default=500, help='Lines parsed and inserted per transaction (default 500)')
+        parser.add_argument('--workers', type=int, default=1, help='Worker processes parsing batches; 0 uses every CPU (default 1, in-process)')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if options['workers'] < 0:
+            raise CommandError('--workers must be 0 or more')
+        try:
+            source = sys.stdin if options['input'] == '-' else open(options['input'], encoding='utf-8')
+        except OSError as error:
+            raise CommandError(str(error))
+        created = 0
+        failed = 0
+        start = time.perf_counter()
+        try:
+            for ids, errors in import_rules(source, batch_size=options['batch_size'], workers=options['workers']):
+                created += len(ids)
+                failed += len(errors)
+                for line_number, error in errors:
+                    self.stderr.write(f"Line {line_number}: {error}")
+        finally:
+            if source is not sys.stdin:
+                source.close()
+        elapsed = time.perf_counter() - start
+        rate = created / elapsed if elapsed > 0 else 0.0
+        self.stderr.write(f"Imported {created} rules in {elapsed:.2f}s ({rate:,.0f} rules/s)")
+        if failed:
+            raise CommandError(f"{failed} lines were not imported")
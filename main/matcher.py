@@ -0,0 +1,267 @@
+from .compact import NO_CHILD, OPERAND, OR
+from .compiler import COMPARATORS, CONSTANTS, TRUE
+from .values import parse_operand, to_number
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+import threading
+
+# Discrimination network for matching one record against the whole rule store.
+#
+# For every rule we pick a set of "trigger" conditions such that the rule can only be true
+# when at least one of them is true: an operand triggers itself, an OR needs the triggers of
+# both children and an AND only needs the triggers of one child (the smaller set). Trigger
+# conditions are indexed per field, a hash index for "department = 'Sales'" and sorted
+# threshold lists for "salary > 50000", so a record only visits rules with a satisfied trigger.
+# Rules with a trigger that cannot be indexed (bad constant, unknown operator, date comparison)
+# are always visited.
+
+
+def _condition_key(condition):
+    # Normalized (field, operator, constant) key for an indexable condition, None otherwise.
+    # '=' keys hold the number for numeric constants and the text for the others, matching how
+    # the predicates compare; comparisons are indexed for numbers only
+    if condition is None:
+        return None
+    try:
+        field, op, constant = parse_operand(condition)
+    except ValueError:
+        return None
+    numeric = isinstance(constant, (int, float))
+    if op == '=':
+        return field, op, constant if numeric else condition.split()[2].strip("'")
+    return (field, op, constant) if numeric else None
+
+
+def trigger_conditions(compact):
+    # Returns the set of condition keys that must contain a true condition for the rule to be true,
+    # or None when the rule cannot be indexed. In pre-order children come after their parent, so
+    # walking the CompactAST backwards sees both children of every operator before the operator
+    results = [frozenset()] * len(compact)
+    for index in range(len(compact) - 1, -1, -1):
+        opcode = compact.opcodes[index]
+        if opcode == OPERAND:
+            condition = compact.condition(index)
+            if CONSTANTS.get(condition) is False:
+                continue  # never true, nothing to trigger on
+            key = _condition_key(condition)
+            results[index] = None if key is None else frozenset((key,))
+            continue
+        left_index, right_index = compact.left[index], compact.right[index]
+        left = results[left_index] if left_index != NO_CHILD else frozenset()
+        right = results[right_index] if right_index != NO_CHILD else frozenset()
+        if opcode == OR:
+            results[index] = None if left is None or right is None else left | right
+        elif left is None:
+            results[index] = right
+        elif right is None:
+            results[index] = left
+        else:
+            results[index] = left if len(left) <= len(right) else right
+    return results[0] if results else frozenset()
+
+
+class RuleIndex:
+    # Keeps the trigger indexes and compiled rules of every stored rule, refreshed lazily:
+    # saves and deletes only mark a rule stale and the next sync reloads just those rules
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._stale = set()
+        self._rules = {}                       # rule_id -> (version, compiled, condition keys, trigger keys or None)
+        self._watchers = defaultdict(set)      # condition key -> rule ids it triggers
+        self._always = set()                   # rule ids without an indexable trigger set
+        self._equal = defaultdict(dict)        # field -> {constant: key}
+        self._ordered = defaultdict(list)      # (field, operator) -> sorted constants
+        self._fields = defaultdict(int)        # field -> number of indexed keys on it
+        self.generation = None                 # shared rules generation the index was last refreshed at
+
+    def invalidate(self, rule_id):
+        with self._lock:
+            self._stale.add(rule_id)
+
+    def refresh(self, versions, generation=None):
+        # Marks stale every indexed rule whose version differs from versions ({rule_id: version} of
+        # every stored rule), and every stored rule the index does not have yet
+        with self._lock:
+            if self._loaded:
+                self._stale.update(rule_id for rule_id, entry in self._rules.items() if versions.get(rule_id) != entry[0])
+                self._stale.update(rule_id for rule_id in versions if rule_id not in self._rules)
+            self.generation = generation
+
+    def invalidate_all(self):
+        with self._lock:
+            self._loaded = False
+
+    def sync(self, load_rules):
+        # Brings the index up to date. load_rules(None) must yield every stored rule and
+        # load_rules(ids) only the given ids, as (rule_id, version, compiled rule)
+        with self._lock:
+            full = not self._loaded
+            stale, self._stale = self._stale, set()
+            if not full and not stale:
+                return
+            try:
+                if full:
+                    for rule_id in list(self._rules):
+                        self.remove(rule_id)
+                seen = set()
+                for rule_id, version, compiled in load_rules(None if full else stale):
+                    self.update(rule_id, version, compiled)
+                    seen.add(rule_id)
+                for rule_id in stale - seen:
+                    self.remove(rule_id)
+            except Exception:
+                self._stale |= stale
+                raise
+            self._loaded = True
+
+    def update(self, rule_id, version, compiled):
+        # Indexes a new rule, or re-indexes an updated one: only the trigger keys it gained or lost
+        # are touched, the ones it kept stay in place
+        triggers = trigger_conditions(compiled.ast)
+        keys = [_condition_key(condition) or condition for condition in compiled.conditions]
+        with self._lock:
+            previous = self._rules.get(rule_id)
+            old = (previous[3] or frozenset()) if previous is not None else frozenset()
+            new = triggers or frozenset()
+            for key in old - new:
+                self._unwatch(rule_id, key)
+            for key in new - old:
+                watchers = self._watchers[key]
+                if not watchers:
+                    self._index_key(key)
+                watchers.add(rule_id)
+            if triggers is None:
+                self._always.add(rule_id)
+            else:
+                self._always.discard(rule_id)
+            self._rules[rule_id] = (version, compiled, keys, triggers)
+
+    def remove(self, rule_id):
+        with self._lock:
+            entry = self._rules.pop(rule_id, None)
+            if entry is None:
+                return
+            self._always.discard(rule_id)
+            for key in entry[3] or ():
+                self._unwatch(rule_id, key)
+
+    def _unwatch(self, rule_id, key):
+        watchers = self._watchers[key]
+        watchers.discard(rule_id)
+        if not watchers:
+            del self._watchers[key]
+            self._unindex_key(key)
+
+    def _index_key(self, key):
+        field, op, constant = key
+        if op == '=':
+            self._equal[field][constant] = key
+        else:
+            insort(self._ordered[(field, op)], constant)
+        self._fields[field] += 1
+
+    def _unindex_key(self, key):
+        field, op, constant = key
+        if op == '=':
+            del self._equal[field][constant]
+        else:
+            self._ordered[(field, op)].remove(constant)
+        self._fields[field] -= 1
+        if not self._fields[field]:
+            del self._fields[field]
+
+    def _satisfied(self, data):
+        # Returns (keys known to be true, keys that might be true) for the record
+        certain = []
+        possible = []
+        for field in self._fields:
+            if field not in data:
+                continue
+            value = data[field]
+            kind = type(value)
+            if kind is str:
+                # Converted here for the lookups only; the predicates convert what they reach
+                number = to_number(value)
+            constants = self._equal.get(field)
+            if constants:
+                # The constants an '=' predicate can find equal to value (see compile_condition)
+                if kind is str:
+                    candidates = (value,) if number is value else (value, number)
+                elif kind is int or kind is float:
+                    candidates = (value, str(value))
+                else:
+                    candidates = (str(value),)
+                for candidate in candidates:
+                    key = constants.get(candidate)
+                    if key is not None:
+                        certain.append(key)
+            if kind is str:
+                value = number
+            numeric = isinstance(value, (int, float))
+            for op in COMPARATORS:
+                ordered = self._ordered.get((field, op))
+                if not ordered:
+                    continue
+                if not numeric:
+                    # evaluate_condition would raise for this value; let the rule report it
+                    possible.extend((field, op, constant) for constant in ordered)
+                    continue
+                if op == '>':
+                    matched = ordered[:bisect_left(ordered, value)]
+                elif op == '>=':
+                    matched = ordered[:bisect_right(ordered, value)]
+                elif op == '<':
+                    matched = ordered[bisect_right(ordered, value):]
+                else:
+                    matched = ordered[bisect_left(ordered, value):]
+                certain.extend((field, op, constant) for constant in matched)
+        return certain, possible
+
+    def match(self, data):
+        # Returns (sorted matching rule ids, {rule_id: error}) visiting only rules with a satisfied trigger
+        with self._lock:
+            certain, possible = self._satisfied(data)
+            candidates = set(self._always)
+            for key in certain:
+                candidates |= self._watchers[key]
+            for key in possible:
+                candidates |= self._watchers[key]
+            known = set(certain)
+            rules = [(rule_id, *self._rules[rule_id][1:3]) for rule_id in candidates]
+
+        matches = []
+        errors = {}
+        memo = {}
+        for rule_id, compiled, keys in rules:
+            try:
+                if _evaluate(compiled, keys, data, known, memo):
+                    matches.append(rule_id)
+            except (ValueError, KeyError, TypeError) as error:
+                errors[rule_id] = str(error)
+        matches.sort()
+        return matches, errors
+
+
+def _evaluate(compiled, keys, data, known, memo):
+    # Same loop as CompiledRule.evaluate, reusing condition outcomes already decided by the index
+    # or by an earlier rule for this record
+    predicates = compiled.predicates
+    on_true = compiled.on_true
+    on_false = compiled.on_false
+    if not predicates:
+        return False
+    i = 0
+    while i >= 0:
+        key = keys[i]
+        if key in known:
+            outcome = True
+        else:
+            outcome = memo.get(key)
+            if outcome is None:
+                outcome = memo[key] = predicates[i](data)
+        i = on_true[i] if outcome else on_false[i]
+    return i == TRUE
+
+
+rule_index = RuleIndex()
@@ -0,0 +1,156 @@
+from bisect import bisect_left
+from django.conf import settings
+from functools import wraps
+from time import perf_counter
+import itertools
+import threading
+
+# Process-level instrumentation of the rule engine, exposed in the Prometheus text format by /metrics.
+#
+# Stages (parsing, loading, compiling, evaluating, combining, ...) record their latency in fixed-bucket
+# histograms, and every evaluated rule keeps a count and total time, so slow rules show up as the ones
+# with the highest seconds per evaluation. Recording is a clock read, a bisect and a few additions
+# under a lock; with RULE_METRICS_ENABLED off, timed() returns functions unwrapped.
+# Single evaluations are too short for that: only one in `sample_every` is timed, and it is recorded
+# as `sample_every` evaluations, so their histogram and per-rule figures are estimates.
+# Every worker process keeps its own figures: scrape each worker, or sum them in the query.
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+    1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+PREFIX = 'rule_engine'
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # per bucket, the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+
+class Metrics:
+    def __init__(self, enabled=True, top_rules=100, sample_every=16):
+        self.enabled = enabled
+        self.top_rules = top_rules  # rules exported per scrape, slowest per evaluation first
+        self.sample_every = max(sample_every, 1)
+        self._evaluations = itertools.count()
+        self._lock = threading.Lock()
+        self._stages = {}  # stage -> Histogram
+        self._rules = {}   # rule_id -> [evaluations, seconds]
+
+    def observe(self, stage, seconds, weight=1):
+        # weight: number of calls this one stands for (sampled timings)
+        if not self.enabled:
+            return
+        bucket = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = Histogram()
+            histogram.counts[bucket] += weight
+            histogram.sum += seconds * weight
+            histogram.count += weight
+
+    def evaluation_weight(self):
+        # sample_every for the one evaluation in sample_every that should be timed, 0 for the others
+        if self.enabled and not next(self._evaluations) % self.sample_every:
+            return self.sample_every
+        return 0
+
+    def rule_evaluated(self, rule_id, seconds, evaluations=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            entry = self._rules.get(rule_id)
+            if entry is None:
+                self._rules[rule_id] = [evaluations, seconds]
+            else:
+                entry[0] += evaluations
+                entry[1] += seconds
+
+    def timed(self, stage):
+        # Decorator recording each call's duration under stage, exceptions included
+        def decorator(func):
+            if not self.enabled:
+                return func
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                start = perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(stage, perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._rules.clear()
+
+    def snapshot(self):
+        # ({stage: (bucket counts, sum, count)}, {rule_id: (evaluations, seconds)}) copied under the lock
+        with self._lock:
+            stages = {stage: (list(h.counts), h.sum, h.count) for stage, h in self._stages.items()}
+            rules = {rule_id: tuple(entry) for rule_id, entry in self._rules.items()}
+        return stages, rules
+
+    def render(self, caches=None):
+        # Prometheus text exposition format (version 0.0.4). caches maps a cache name to its stats() dict
+        stages, rules = self.snapshot()
+        lines = [
+            f'# HELP {PREFIX}_stage_seconds Time spent in each stage of rule processing.',
+            f'# TYPE {PREFIX}_stage_seconds histogram',
+        ]
+        for stage in sorted(stages):
+            counts, total, count = stages[stage]
+            cumulative = 0
+            for bound, bucket_count in zip(BUCKETS, counts):
+                cumulative += bucket_count
+                lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {total!r}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {count}')
+
+        slowest = sorted(rules.items(), key=lambda item: item[1][1] / item[1][0], reverse=True)[:self.top_rules]
+        lines += [
+            f'# HELP {PREFIX}_rule_evaluations_total Records evaluated per rule (the {self.top_rules} slowest rules).',
+            f'# TYPE {PREFIX}_rule_evaluations_total counter',
+        ]
+        lines += [f'{PREFIX}_rule_evaluations_total{{rule="{rule_id}"}} {entry[0]}' for rule_id, entry in slowest]
+        lines += [
+            f'# HELP {PREFIX}_rule_evaluation_seconds_total Time spent evaluating each rule.',
+            f'# TYPE {PREFIX}_rule_evaluation_seconds_total counter',
+        ]
+        lines += [f'{PREFIX}_rule_evaluation_seconds_total{{rule="{rule_id}"}} {entry[1]!r}' for rule_id, entry in slowest]
+        lines += [
+            f'# HELP {PREFIX}_rules_evaluated Distinct rules evaluated by this process.',
+            f'# TYPE {PREFIX}_rules_evaluated gauge',
+            f'{PREFIX}_rules_evaluated {len(rules)}',
+        ]
+
+        caches = caches or {}
+        for name, kind, help_text in (
+            ('hits', 'counter', 'Cache lookups answered from the cache.'),
+            ('misses', 'counter', 'Cache lookups that had to load and compile, parse, or evaluate.'),
+            ('evictions', 'counter', 'Entries evicted to stay within maxsize, or expired.'),
+            ('size', 'gauge', 'Entries currently cached (tokens for parsed_groups).'),
+            ('maxsize', 'gauge', 'Maximum number of cached entries (tokens for parsed_groups).'),
+        ):
+            metric = f'{PREFIX}_cache_{name}_total' if kind == 'counter' else f'{PREFIX}_cache_{name}'
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} {kind}')
+            lines += [f'{metric}{{cache="{cache}"}} {stats[name]}' for cache, stats in sorted(caches.items())]
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics(
+    enabled=getattr(settings, 'RULE_METRICS_ENABLED', True),
+    top_rules=getattr(settings, 'RULE_METRICS_TOP_RULES', 100),
+    sample_every=getattr(settings, 'RULE_METRICS_SAMPLE_EVERY', 16),
+)
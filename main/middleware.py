@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from time import perf_counter
+import cProfile
+import io
+import itertools
+import logging
+import pstats
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class RequestProfilerMiddleware:
+    # Opt-in cProfile hook for individual requests, removed from the stack unless RULE_PROFILE_ENABLED:
+    #   - a request sent with the header "X-Profile: 1" is run under cProfile and answered with the
+    #     profile (text/plain, slowest functions by cumulative time) instead of its response;
+    #   - with RULE_PROFILE_SAMPLE_EVERY = N, every Nth request is profiled and its profile logged
+    #     as a warning through the main.middleware logger, the response is left alone.
+    # One request is profiled at a time; others arriving meanwhile run normally. The profile covers
+    # the thread serving the request.
+    def __init__(self, get_response):
+        if not getattr(settings, 'RULE_PROFILE_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_every = getattr(settings, 'RULE_PROFILE_SAMPLE_EVERY', 0)
+        self.top = getattr(settings, 'RULE_PROFILE_TOP', 40)
+        self._requests = itertools.count(1)
+        self._busy = threading.Lock()
+
+    def __call__(self, request):
+        explicit = request.headers.get('X-Profile') == '1'
+        sampled = bool(self.sample_every) and next(self._requests) % self.sample_every == 0
+        if not (explicit or sampled) or not self._busy.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profile = cProfile.Profile()
+            start = perf_counter()
+            response = profile.runcall(self.get_response, request)
+            elapsed = perf_counter() - start
+        finally:
+            self._busy.release()
+
+        summary = f"{request.method} {request.path} -> {response.status_code} in {elapsed * 1e3:.1f}ms"
+        report = self._report(profile)
+        if explicit:
+            return HttpResponse(f"{summary}\n\n{report}", content_type='text/plain; charset=utf-8')
+        logger.warning("Profiled %s\n%s", summary, report)
+        return response
+
+    def _report(self, profile):
+        output = io.StringIO()
+        pstats.Stats(profile, stream=output).strip_dirs().sort_stats('cumulative').print_stats(self.top)
+        return output.getvalue()
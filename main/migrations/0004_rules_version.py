@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_delete_operands'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rules',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
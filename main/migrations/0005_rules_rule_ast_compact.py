@@ -0,0 +1,147 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:03
+
+from array import array
+from django.db import migrations, models
+import json
+import re
+import struct
+import sys
+import zlib
+
+# The backfill writes format version 1 of rules.rule_ast_compact (see main.compact). The encoder and
+# the JSON reader it needs are frozen copies, so later changes to main.compact or main.deepjson
+# cannot change what this migration writes.
+
+OPERAND = 0
+OPCODES = {'AND': 1, 'OR': 2}
+NO_CHILD = -1
+HEADER = struct.Struct('<2sBBII')
+
+TOKEN = re.compile(r'[ \t\n\r]*(?:([{}\[\],:])|(")|(-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][-+]?\d+)?)|(true|false|null))')
+LITERALS = {'true': True, 'false': False, 'null': None}
+
+
+def loads(text):
+    # json.loads, with an explicit-stack parser for ASTs nested deeper than the recursion limit
+    try:
+        return json.loads(text)
+    except RecursionError:
+        pass
+    stack = []  # [container, pending dict key]
+    pos = 0
+    result = None
+    done = False
+    expect_key = False
+    while True:
+        match = TOKEN.match(text, pos)
+        if match is None or done:
+            if done and not text[pos:].strip():
+                return result
+            raise ValueError(f"Invalid JSON at position {pos}")
+        punctuation, quote, number, literal = match.groups()
+        pos = match.end()
+        if punctuation in ('{', '['):
+            stack.append([{} if punctuation == '{' else [], None])
+            expect_key = punctuation == '{'
+            continue
+        if punctuation in ('}', ']'):
+            if not stack:
+                raise ValueError(f"Invalid JSON at position {pos}")
+            value = stack.pop()[0]
+        elif punctuation == ',':
+            expect_key = bool(stack) and isinstance(stack[-1][0], dict)
+            continue
+        elif punctuation == ':':
+            continue
+        elif quote:
+            value, pos = json.decoder.scanstring(text, pos)
+            if expect_key:
+                stack[-1][1] = value
+                expect_key = False
+                continue
+        elif number:
+            value = json.loads(number)
+        else:
+            value = LITERALS[literal]
+        if not stack:
+            result = value
+            done = True
+        elif isinstance(stack[-1][0], dict):
+            stack[-1][0][stack[-1][1]] = value
+        else:
+            stack[-1][0].append(value)
+
+
+def little_endian(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def encode(ast_dict):
+    # Pre-order opcodes, child indexes and condition indexes of the nested rule_ast dict, with the
+    # conditions numbered in order of first use
+    opcodes, left, right, values = array('b'), array('i'), array('i'), array('i')
+    condition_ids = {}
+    stack = [(ast_dict, -1, None)] if ast_dict else []
+    while stack:
+        data, parent, side = stack.pop()
+        index = len(opcodes)
+        if parent >= 0:
+            (left if side == 'left' else right)[parent] = index
+        if data['node_type'] == 'operand':
+            opcodes.append(OPERAND)
+            values.append(condition_ids.setdefault(data['value'], len(condition_ids)))
+        elif data['node_type'] == 'operator':
+            opcode = OPCODES.get(data['value'])
+            if opcode is None:
+                raise ValueError(f"Unsupported operator: {data['value']}")
+            opcodes.append(opcode)
+            values.append(-1)
+            if data.get('right'):
+                stack.append((data['right'], index, 'right'))
+            if data.get('left'):
+                stack.append((data['left'], index, 'left'))
+        else:
+            raise ValueError(f"Invalid node type: {data['node_type']}")
+        left.append(NO_CHILD)
+        right.append(NO_CHILD)
+    texts = [condition.encode('utf-8') for condition in condition_ids]
+    payload = b''.join([
+        little_endian(array('I', map(len, texts))).tobytes(),
+        b''.join(texts),
+        opcodes.tobytes(),
+        little_endian(left).tobytes(),
+        little_endian(right).tobytes(),
+        little_endian(values).tobytes(),
+    ])
+    compressed = zlib.compress(payload, 6)
+    flags = 0
+    if len(compressed) < len(payload):
+        payload, flags = compressed, 1
+    return HEADER.pack(b'RA', 1, flags, len(opcodes), len(texts)) + payload
+
+
+def backfill_rule_ast_compact(apps, schema_editor):
+    rules = apps.get_model('main', 'rules')
+    for rule in rules.objects.filter(rule_ast_compact__isnull=True).iterator():
+        rule_ast = loads(rule.rule_ast) if isinstance(rule.rule_ast, str) else rule.rule_ast
+        rule.rule_ast_compact = encode(rule_ast)
+        rule.save(update_fields=['rule_ast_compact'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_rules_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rules',
+            name='rule_ast_compact',
+            field=models.BinaryField(null=True),
+        ),
+        migrations.RunPython(backfill_rule_ast_compact, migrations.RunPython.noop),
+    ]
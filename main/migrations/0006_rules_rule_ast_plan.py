@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_rules_rule_ast_compact'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rules',
+            name='rule_ast_plan',
+            field=models.BinaryField(null=True),
+        ),
+    ]
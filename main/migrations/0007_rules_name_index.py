@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_rules_rule_ast_plan'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rules',
+            index=models.Index(fields=['rule_name', 'id'], name='main_rules_name_id_idx'),
+        ),
+    ]
@@ -1,10 +1,113 @@
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from . import compact
+from . import deepjson
+from .cache import compiled_rules, rule_results, shared_rules
+from .matcher import rule_index
+from .statistics import rule_statistics
 
 # Create your models here.
 
+# Columns derived from rule_string; writing any of them changes the rule's version
+AST_FIELDS=frozenset(('rule_ast','rule_ast_compact','rule_ast_plan'))
+
 class rules(models.Model):
     rule_name=models.CharField(max_length=255)
     rule_string=models.TextField()
     rule_ast=models.JSONField()
+    # Binary CompactAST (see main.compact.encode); used for loading, rule_ast stays for the API
+    rule_ast_compact=models.BinaryField(null=True)
+    # Binary CompactAST with AND/OR children reordered from runtime statistics (see main.statistics)
+    rule_ast_plan=models.BinaryField(null=True)
+    version=models.PositiveIntegerField(default=1)
+
+    class Meta:
+        # Name lookups and name filters on the paginated list, which walks the rules in id order
+        indexes=[models.Index(fields=['rule_name','id'],name='main_rules_name_id_idx')]
+
+    def set_ast(self,rule_ast,compact_ast=None):
+        # Replaces both stored forms of the AST; compact_ast avoids re-reading rule_ast when the caller has it
+        if compact_ast is None:
+            compact_ast=compact_ast_from_json(rule_ast)
+        self.rule_ast=rule_ast
+        self.rule_ast_compact=compact.encode(compact_ast)
+        self.rule_ast_plan=None  # planned for the old AST
+        self._conditions=compact_ast.condition_set()  # statistics of these conditions outlive the update
+
+    def evaluation_plan(self):
+        # Decoded reordered CompactAST, None until statistics have produced one
+        if self.rule_ast_plan is None:
+            return None
+        return compact.decode(self.rule_ast_plan)
+
+    def compact_ast(self):
+        # Decoded CompactAST, falling back to the JSON column for rows written before it existed
+        if self.rule_ast_compact is not None:
+            return compact.decode(self.rule_ast_compact)
+        return compact_ast_from_json(self.rule_ast)
+
+    def save(self,*args,**kwargs):
+        # Every update bumps the version so cached compiled forms of the old AST are never reused.
+        # Saving only other columns (update_fields without the AST ones) keeps the version and the caches.
+        # The bump happens in the database: a plan stored meanwhile (save_evaluation_plan) has already
+        # bumped it, and a version computed from the loaded value would give two ASTs the same version
+        update_fields=kwargs.get('update_fields')
+        if update_fields is not None and AST_FIELDS.isdisjoint(update_fields):
+            return super().save(*args,**kwargs)
+        updating=not self._state.adding
+        if updating:
+            self.version=models.F('version')+1
+            if update_fields is not None:
+                kwargs['update_fields']={*update_fields,'version'}
+        if self.rule_ast_compact is None and self.rule_ast:
+            self.rule_ast_compact=compact.encode(compact_ast_from_json(self.rule_ast))
+        super().save(*args,**kwargs)
+        if updating:
+            self.refresh_from_db(fields=['version'])
+
+
+# The caches are told about changes by signals rather than by save() and delete(), so rows deleted
+# with QuerySet.delete() (which sends post_delete for each of them) are dropped as well.
+# QuerySet.update() and bulk_create() send nothing: see save_evaluation_plan and bulk_created
+
+@receiver(post_save,sender=rules)
+def rule_saved(sender,instance,update_fields=None,**kwargs):
+    if update_fields is not None and AST_FIELDS.isdisjoint(update_fields):
+        return
+    compiled_rules.invalidate(instance.pk)
+    rule_results.invalidate(instance.pk)
+    shared_rules.changed(instance.pk)
+    rule_index.invalidate(instance.pk)
+    conditions=getattr(instance,'_conditions',None)
+    instance._conditions=None
+    if conditions is None:
+        rule_statistics.invalidate(instance.pk)
+    else:
+        rule_statistics.retain(instance.pk,conditions)
+
+
+@receiver(post_delete,sender=rules)
+def rule_deleted(sender,instance,**kwargs):
+    compiled_rules.invalidate(instance.pk)
+    rule_results.invalidate(instance.pk)
+    shared_rules.changed(instance.pk)
+    rule_index.invalidate(instance.pk)
+    rule_statistics.invalidate(instance.pk)
+
+
+def compact_ast_from_json(rule_ast):
+    # rule_ast holds the JSON text produced by dumps_ast (older rows may hold the dict itself)
+    if isinstance(rule_ast,str):
+        rule_ast=deepjson.loads(rule_ast)
+    return compact.CompactAST.from_json(rule_ast)
 
 
+def bulk_created(rule_ids):
+    # bulk_create skips rules.save(): tells the caches about the rows it inserted, as save() would
+    for rule_id in rule_ids:
+        compiled_rules.invalidate(rule_id)
+        rule_results.invalidate(rule_id)
+        rule_index.invalidate(rule_id)
+        rule_statistics.invalidate(rule_id)
+    shared_rules.changed_many(rule_ids)
@@ -0,0 +1,243 @@
+from .compiler import COMPARATORS, CONSTANTS
+from .values import operand_key, parse_operand
+
+# Rule optimizer, run on the AST before it is stored (create, update and combine).
+#
+# The tree is rebuilt bottom-up into n-ary AND/OR nodes. Every rewrite keeps the result of every
+# record, and the error of every record that raised (a missing field, a string that is not a number):
+# a child of an AND chain is only reached when every child before it was true without raising, and a
+# child of an OR chain when every child before it was false, so a child can be dropped or folded only
+# on what its earlier siblings already established. The rewrites are:
+#   - nested chains of the same operator are flattened ("(a AND b) AND c" -> AND[a, b, c]);
+#   - a child repeating an earlier child, operand or whole subtree, is dropped;
+#   - a numeric bound (int or float) implied by an earlier bound on the same field is dropped: under
+#     AND "age > 30 AND age > 25" -> "age > 30", under OR "age < 30 OR age < 20" -> "age < 30";
+#   - two adjacent bounds on one field with the same operator and constant type, which raise the same
+#     errors, are merged into the tighter one under AND and the looser one under OR;
+#   - under AND, a child that cannot hold given the earlier ones (an empty range, two different '='
+#     values) becomes the FALSE constant condition, and the children after it are dropped:
+#     "b > 4 AND b < 0" -> "b > 4 AND FALSE", which still raises for a record without b;
+#   - TRUE under AND and FALSE under OR are dropped, and the children after FALSE under AND or
+#     TRUE under OR, which are never reached, too. A missing child evaluates as FALSE.
+# Complementary rays under OR ("age > 30 OR age <= 30") are not folded: NaN satisfies neither.
+# The result is turned back into a balanced binary tree. Leaves keep their left-to-right order,
+# so short-circuiting visits conditions in the same order as before.
+
+LOWER_BOUNDS = ('>', '>=')
+UPPER_BOUNDS = ('<', '<=')
+CONSTANTS_TEXT = {value: text for text, value in CONSTANTS.items()}
+
+
+def _bound(condition):
+    # (field, operator, number) for a numeric comparison, None otherwise
+    try:
+        field, op, constant = parse_operand(condition)
+    except ValueError:
+        return None
+    if op not in COMPARATORS or not isinstance(constant, (int, float)):
+        return None
+    return field, op, constant
+
+
+def _equality(condition):
+    # (field, kind, constant) for an '=' test. Two tests of one kind with different constants
+    # cannot both hold: numbers compare numerically, anything else as text
+    try:
+        field, op, constant = parse_operand(condition)
+    except ValueError:
+        return None
+    if op != '=':
+        return None
+    if isinstance(constant, (int, float)):
+        return field, 'number', constant
+    return field, 'text', condition.split()[2].strip("'")
+
+
+def _strength(op, constant):
+    # Sort key of a bound: larger is tighter for lower bounds and looser for upper bounds
+    if op in LOWER_BOUNDS:
+        return (constant, 1 if op == '>' else 0)
+    return (constant, 1 if op == '<=' else 0)
+
+
+def _empty(side, strength, other):
+    # Whether a bound and the opposite bound `other` (None when unknown) leave no number
+    if other is None:
+        return False
+    (low, low_exclusive), (high, high_inclusive) = (strength, other) if side == 'lower' else (other, strength)
+    return low > high or (low == high and (low_exclusive or not high_inclusive))
+
+
+class _Builder:
+    # Hash-conses the optimized n-ary nodes: every distinct node gets an id, so duplicate
+    # detection is an integer comparison and ids always sort after their children's ids
+    def __init__(self):
+        self.entries = []   # id -> ('operand', condition) or (operator, tuple of child ids)
+        self.ids = {}       # canonical key -> id
+        self.true = self.operand(CONSTANTS_TEXT[True])
+        self.false = self.operand(CONSTANTS_TEXT[False])
+
+    def _register(self, key, entry):
+        node_id = self.ids.get(key)
+        if node_id is None:
+            node_id = self.ids[key] = len(self.entries)
+            self.entries.append(entry)
+        return node_id
+
+    def operand(self, condition):
+        try:
+            key = ('operand', operand_key(parse_operand(condition)))
+        except ValueError:
+            key = ('operand', condition)
+        return self._register(key, ('operand', condition))
+
+    def operator(self, op, children):
+        flat = []
+        for child in children:
+            kind, payload = self.entries[child]
+            flat.extend(payload if kind == op else (child,))
+        kept = self._simplify(op, flat)
+        if not kept:
+            return self.true if op == 'AND' else self.false
+        if len(kept) == 1:
+            return kept[0]
+        return self._register((op, tuple(kept)), (op, tuple(kept)))
+
+    def _simplify(self, op, children):
+        # The children of an op chain left to evaluate, in order (see the rewrites above)
+        tighten = op == 'AND'
+        absorbing, neutral = (self.false, self.true) if tighten else (self.true, self.false)
+        kept = []
+        seen = set()
+        known = {}      # (field, side) -> strength of the bound that held (AND) or failed (OR)
+        equals = {}     # (field, kind) -> constant of an '=' test that held, under AND
+        previous = None  # bound of the last kept child, when it is a numeric bound
+        for child in children:
+            if child == neutral or child in seen:
+                continue
+            if child == absorbing:
+                kept.append(child)
+                return kept
+            seen.add(child)
+            kind, condition = self.entries[child]
+            bound = _bound(condition) if kind == 'operand' else None
+            if bound is None:
+                equality = _equality(condition) if kind == 'operand' and tighten else None
+                if equality is not None:
+                    field, value_kind, value = equality
+                    if equals.setdefault((field, value_kind), value) != value:
+                        kept.append(absorbing)  # a value cannot equal two different constants
+                        return kept
+                kept.append(child)
+                previous = None
+                continue
+
+            field, comparison, constant = bound
+            side = 'lower' if comparison in LOWER_BOUNDS else 'upper'
+            strength = _strength(comparison, constant)
+            current = known.get((field, side))
+            # Lower bounds grow tighter with strength and upper bounds looser
+            tighter = (strength > current) == (side == 'lower') if current is not None else True
+            if current is not None and (strength == current or tighter != tighten):
+                continue  # implied: true after the bound that held, false after the one that failed
+            if tighten and _empty(side, strength, known.get((field, 'upper' if side == 'lower' else 'lower'))):
+                kept.append(absorbing)
+                return kept
+            if (previous is not None and previous[0] == field and previous[1] == comparison
+                    and type(previous[2]) is type(constant)):
+                kept.pop()  # implied by this bound (AND) or implying it (OR), with the same errors
+            known[(field, side)] = strength
+            kept.append(child)
+            previous = bound
+        return kept
+
+    def node_count(self, root):
+        # Size of the binary tree rebuilt from root (n children need n - 1 operator nodes)
+        sizes = {}
+        for node_id in self._reachable(root):
+            kind, payload = self.entries[node_id]
+            if kind == 'operand':
+                sizes[node_id] = 1
+            else:
+                sizes[node_id] = sum(sizes[child] for child in payload) + len(payload) - 1
+        return sizes[root]
+
+    def _reachable(self, root):
+        # Ids reachable from root in increasing order, i.e. children before parents
+        seen = {root}
+        stack = [root]
+        while stack:
+            kind, payload = self.entries[stack.pop()]
+            if kind != 'operand':
+                for child in payload:
+                    if child not in seen:
+                        seen.add(child)
+                        stack.append(child)
+        return sorted(seen)
+
+    def to_node(self, root, node_class):
+        # Rebuilds Node objects; n-ary nodes become balanced binary trees with the same leaf order
+        nodes = {}
+        for node_id in self._reachable(root):
+            kind, payload = self.entries[node_id]
+            if kind == 'operand':
+                nodes[node_id] = node_class(node_type='operand', value=payload)
+                continue
+            level = [nodes[child] for child in payload]
+            while len(level) > 1:
+                paired = [
+                    node_class(node_type='operator', left=level[i], right=level[i + 1], value=kind)
+                    for i in range(0, len(level) - 1, 2)
+                ]
+                if len(level) % 2:
+                    paired.append(level[-1])
+                level = paired
+            nodes[node_id] = level[0]
+        return nodes[root]
+
+
+
+def optimize_ast(root):
+    # Returns (optimized root, number of nodes removed). root is a Node tree; the optimized
+    # tree is built from the same class
+    if root is None:
+        return None, 0
+    builder = _Builder()
+    original_count = 0
+    results = []
+    # Work items are Nodes to visit or (operator, child count) markers. A whole chain of one
+    # operator is collected at once, so a left-deep chain of n conditions costs O(n), not O(n^2)
+    stack = [root]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, tuple):
+            op, count = item
+            children = results[-count:]
+            del results[-count:]
+            results.append(builder.operator(op, children))
+            continue
+        if item is None:
+            results.append(builder.false)  # evaluate_ast treats a missing child as false
+        elif item.node_type == 'operand':
+            original_count += 1
+            results.append(builder.operand(item.value))
+        elif item.node_type != 'operator':
+            raise ValueError(f"Invalid node type: {item.node_type}")
+        elif item.value not in ('AND', 'OR'):
+            raise ValueError(f"Unsupported operator: {item.value}")
+        else:
+            children = []
+            chain = [item]
+            while chain:
+                node = chain.pop()
+                if node is not None and node.node_type == 'operator' and node.value == item.value:
+                    original_count += 1
+                    chain.append(node.right)
+                    chain.append(node.left)
+                else:
+                    children.append(node)
+            stack.append((item.value, len(children)))
+            stack.extend(reversed(children))
+    optimized = results.pop()
+    removed = original_count - builder.node_count(optimized)
+    return builder.to_node(optimized, type(root)), removed
@@ -0,0 +1,90 @@
+from .compiler import compile_encoded, encode_compiled
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+# Multi-process evaluation of large batches.
+#
+# Compiled rules hold closures and cannot be pickled, so each worker receives the rules once,
+# as the binary CompactAST (and evaluation plan) of every rule, and compiles them itself in the
+# pool initializer. After that only chunks of records and their results cross process
+# boundaries. Chunks are submitted with a bounded window and their results are yielded in
+# submission order, so output order matches the input and memory stays bounded for streams.
+# This module only depends on the compiler, so workers never need Django to be set up.
+
+
+def rule_payload(compiled_by_id):
+    # Picklable form of {rule_id: compiled rule}: {rule_id: (ast bytes, plan bytes or None)}
+    return {rule_id: encode_compiled(compiled) for rule_id, compiled in compiled_by_id.items()}
+
+
+def compile_payload(payload):
+    # Inverse of rule_payload
+    return {rule_id: compile_encoded(ast, plan) for rule_id, (ast, plan) in payload.items()}
+
+
+def evaluate_records(compiled_by_id, records):
+    # Returns [(results, errors)] per record, with results = {rule_id: bool or None} and
+    # errors = {rule_id: message}. A record given as an exception is reported for every rule
+    output = []
+    for record in records:
+        results = {}
+        errors = {}
+        for rule_id, compiled in compiled_by_id.items():
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                results[rule_id] = compiled.evaluate(record)
+            except (ValueError, KeyError, TypeError) as error:
+                results[rule_id] = None
+                errors[rule_id] = str(error)
+        output.append((results, errors))
+    return output
+
+
+_worker_rules = None
+
+
+def _init_worker(payload):
+    global _worker_rules
+    _worker_rules = compile_payload(payload)
+
+
+def _run_in_worker(func, chunk):
+    return func(_worker_rules, chunk)
+
+
+class ParallelEvaluator:
+    # Evaluates chunks of records on a process pool:
+    #
+    #   with ParallelEvaluator(compiled_by_id, workers=4) as evaluator:
+    #       for outputs in evaluator.map(chunks):   # one list of (results, errors) per chunk
+    #           ...
+    #
+    # map(chunks, func) runs func(compiled_by_id, chunk) instead of evaluate_records. func must be
+    # a module-level function; returning finished output (e.g. serialized text) from it keeps the
+    # formatting work in the workers and what is sent back small.
+    def __init__(self, compiled_by_id, workers=None, pending=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.pending = pending or 2 * self.workers   # chunks in flight at most
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker, initargs=(rule_payload(compiled_by_id),)
+        )
+
+    def map(self, chunks, func=evaluate_records):
+        futures = deque()
+        for chunk in chunks:
+            futures.append(self._executor.submit(_run_in_worker, func, chunk))
+            if len(futures) >= self.pending:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+    def close(self):
+        self._executor.shutdown(cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
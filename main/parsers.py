@@ -0,0 +1,33 @@
+from rest_framework.parsers import BaseParser
+from rest_framework.exceptions import ParseError
+from django.conf import settings
+import codecs
+import json
+
+
+class NDJSONLineError(ValueError):
+    # Stands in for a record whose line could not be decoded, so the batch can report it in place
+    pass
+
+
+class NDJSONParser(BaseParser):
+    # Parses newline-delimited JSON into a list of records, one per non-blank line
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            reader = codecs.getreader(encoding)(stream)
+            records = []
+            for line_number, line in enumerate(reader, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError as error:
+                    records.append(NDJSONLineError(f"Invalid JSON on line {line_number}: {error}"))
+            return records
+        except UnicodeDecodeError as error:
+            raise ParseError(f"NDJSON parse error - {error}")
@@ -14,10 +14,28 @@ class ruleStoreModelSerializer(serializers.ModelSerializer):
         if(not json_data['valid']):
             raise serializers.ValidationError(json_data['content'])
         else:
-            rule=models.rules(rule_ast=json_data['content'],**validated_data)
+            rule=models.rules(**validated_data)
+            rule.set_ast(json_data['content'],json_data.get('compact'))
             rule.save()
             return rule
 
+    def update(self, instance, validated_data):
+        # Re-parses the AST along with the string so the stored rule and its cached compiled form stay in sync.
+        # When the normalized string is unchanged only the other fields are written, so the version,
+        # the compiled forms and the evaluation plan of the rule are kept
+        json_data=self.context['data'] if 'rule_string' in validated_data else None
+        if json_data is None or json_data.get('unchanged'):
+            validated_data.pop('rule_string',None)
+            for field,value in validated_data.items():
+                setattr(instance,field,value)
+            instance.save(update_fields=list(validated_data))
+            return instance
+        validated_data['rule_string']=self.context['rule_string']
+        if(not json_data['valid']):
+            raise serializers.ValidationError(json_data['content'])
+        instance.set_ast(json_data['content'],json_data.get('compact'))
+        return super().update(instance, validated_data)
+
     
 class ruleCombineSerializer(serializers.Serializer):
     #gets list of rules_id
@@ -30,3 +48,23 @@ class ruleCombineSerializer(serializers.Serializer):
 class ruleEvaluvateSerializer(serializers.Serializer):
     data=serializers.JSONField()
 
+
+class ruleBatchEvaluvateSerializer(ruleEvaluvateSerializer):
+    # Either a list of records or, for columnar evaluation, a mapping of field name to column values.
+    # Records are left unvalidated here; a malformed record is reported in place by the view
+    data=serializers.ListField(allow_empty=True,required=False)
+    columns=serializers.DictField(required=False)
+
+    def validate(self, attrs):
+        if ('data' in attrs)==('columns' in attrs):
+            raise serializers.ValidationError("Provide either 'data' (a list of records) or 'columns' (column arrays)")
+        return attrs
+
+
+class ruleEvaluateManySerializer(ruleEvaluvateSerializer):
+    # One record against a set of rule ids; every stored rule when ids is omitted
+    ids=serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        required=False
+    )
@@ -0,0 +1,296 @@
+from .compact import CompactAST, NO_CHILD, OPERAND, AND
+from .compiler import CompiledRule, PlannedRule, FALSE, TRUE, compile_condition, plannable
+from django.conf import settings
+from functools import lru_cache
+from time import perf_counter_ns
+import threading
+
+# Runtime statistics and cost-based reordering of AND/OR children.
+#
+# One evaluation in `sample_every` is also profiled: the next `leaves_per_sample` leaves of the
+# rule, in a window that moves on with every profiled record, are run on the record (not just the
+# ones short-circuiting reaches) and their outcomes and durations are added to per-condition
+# counters, so the true rates are not biased by the written order and a profiled record costs at
+# most `leaves_per_sample` predicate calls, however large the rule. Once every leaf has been
+# profiled on about `min_samples` records the rule is re-planned: each chain of AND (or OR)
+# children is sorted by cost / P(false) (or cost / P(true)), the order that minimizes expected
+# cost when the conditions are independent, and the plan is kept when it is estimated to be
+# clearly cheaper.
+# The plan is always derived from the rule's original AST and only changes evaluation order.
+# Costs are in nanoseconds. Single predicate calls are too short to time reliably in absolute
+# terms, so the measured times only weigh the leaves of a rule against each other: a leaf costs
+# LEAF_NS (one loop step with a typical comparison) times its time relative to the rule's mean.
+# A plan also pays PlannedRule's field check on every record. The constants are calibrated when a
+# rule is first planned (see costs()), so neither import nor profiling pays for the calibration.
+
+MIN_GAIN = 0.1          # required relative reduction of the estimated cost
+
+
+def _best_ns(func, number=2000, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter_ns()
+        for _ in range(number):
+            func()
+        best = min(best, (perf_counter_ns() - start) / number)
+    return best
+
+
+def _probe_ns(predicate, data, samples=1001):
+    # Median of timing one call the way record() does, perf_counter_ns overhead included
+    timings = []
+    for _ in range(samples):
+        start = perf_counter_ns()
+        predicate(data)
+        timings.append(perf_counter_ns() - start)
+    return sorted(timings)[samples // 2]
+
+
+def _step_ns(predicates, data):
+    # Cost of one jump-loop step with the given (always true) predicates, and the rules timed
+    width = len(predicates)
+    conditions = tuple(f'f{i} > 0' for i in range(width))
+    chain = CompiledRule(CompactAST(), conditions, predicates, tuple(range(1, width)) + (TRUE,), (FALSE,) * width)
+    single = CompiledRule(CompactAST(), conditions[:1], predicates[:1], (TRUE,), (FALSE,))
+    return (_best_ns(lambda: chain.evaluate(data)) - _best_ns(lambda: single.evaluate(data))) / (width - 1), chain, single
+
+
+def _calibrate(width=8):
+    # Returns (no-op predicate timed as in record(), jump-loop step with a typical comparison
+    # predicate, PlannedRule field check), in ns
+    data = {f'f{i}': 1 for i in range(width)}
+    probe = _probe_ns(lambda data: True, data)
+    leaf, chain, single = _step_ns(tuple(compile_condition(f'f{i} > 0') for i in range(width)), data)
+    planned = PlannedRule(chain, single)
+    check = (_best_ns(lambda: planned.evaluate(data)) - _best_ns(lambda: single.evaluate(data))) / width
+    return probe, max(leaf, 1.0), max(check, 0.0)
+
+
+@lru_cache(maxsize=None)
+def costs():
+    # (PROBE_NS, LEAF_NS, CHECK_NS) of _calibrate, measured once per process on first use
+    return _calibrate()
+
+
+class RuleStatistics:
+    def __init__(self, sample_every, min_samples, leaves_per_sample=16):
+        self.sample_every = sample_every
+        self.min_samples = min_samples
+        self.leaves_per_sample = max(leaves_per_sample, 1)
+        self._evaluations = 0
+        self._lock = threading.Lock()
+        # rule_id -> [profiled records since the last plan, {condition: [runs, true, total ns]},
+        #             index of the first leaf of the next window]
+        self._rules = {}
+
+    def sample_positions(self, count):
+        # Positions among the next `count` evaluations that should be profiled
+        if self.sample_every <= 0 or count <= 0:
+            return range(0)
+        with self._lock:
+            start = self._evaluations
+            self._evaluations += count
+        return range(-start % self.sample_every, count, self.sample_every)
+
+    def should_sample(self):
+        return bool(self.sample_positions(1))
+
+    def record(self, rule_id, compiled, data):
+        # Profiles the rule's next window of leaves on data. Returns True when the rule is due for planning
+        conditions = compiled.conditions
+        leaves = len(conditions)
+        if not leaves:
+            return False
+        window = min(self.leaves_per_sample, leaves)
+        with self._lock:
+            entry = self._rules.get(rule_id)
+            if entry is None:
+                entry = self._rules[rule_id] = [0, {}, 0]
+            first = entry[2] % leaves
+            entry[2] = first + window
+        outcomes = []
+        predicates = compiled.predicates
+        for index in range(first, first + window):
+            index %= leaves
+            condition = conditions[index]
+            if condition is None:
+                continue
+            predicate = predicates[index]
+            start = perf_counter_ns()
+            try:
+                outcome = predicate(data)
+            except (ValueError, KeyError, TypeError):
+                continue
+            outcomes.append((condition, outcome, perf_counter_ns() - start))
+        with self._lock:
+            entry = self._rules.get(rule_id)
+            if entry is None:
+                return False  # invalidated meanwhile
+            conditions = entry[1]
+            for condition, outcome, elapsed in outcomes:
+                counters = conditions.get(condition)
+                if counters is None:
+                    counters = conditions[condition] = [0, 0, 0]
+                counters[0] += 1
+                if outcome:
+                    counters[1] += 1
+                counters[2] += elapsed
+            entry[0] += 1
+            # A window covers window / leaves of the rule, so every leaf has about min_samples runs then
+            if entry[0] * window < self.min_samples * leaves:
+                return False
+            entry[0] = 0
+            return True
+
+    def invalidate(self, rule_id):
+        with self._lock:
+            self._rules.pop(rule_id, None)
+
+    def retain(self, rule_id, conditions):
+        # After an update of the rule: keeps the counters of the conditions it still has. A condition's
+        # outcomes and cost do not depend on the rule around it, so the next plan starts from them
+        with self._lock:
+            entry = self._rules.get(rule_id)
+            if entry is not None:
+                entry[1] = {condition: counters for condition, counters in entry[1].items() if condition in conditions}
+
+    def snapshot(self, rule_id):
+        # {condition: (runs, true rate, mean ns beyond a no-op predicate)} for the rule
+        with self._lock:
+            entry = self._rules.get(rule_id)
+            conditions = dict(entry[1]) if entry else {}
+        probe_ns = costs()[0]
+        return {
+            condition: (runs, true / runs, max(total / runs - probe_ns, 1))
+            for condition, (runs, true, total) in conditions.items() if runs
+        }
+
+    def plan(self, rule_id, compiled):
+        # Returns a reordered CompactAST worth storing for the rule, or None
+        if not compiled.conditions or not plannable(compiled):
+            return None
+        stats = self.snapshot(rule_id)
+        if not stats:
+            return None
+        planned, planned_cost, original_cost = reorder_ast(compiled.ast, stats)
+        planned_cost += costs()[2] * len({condition.split()[0] for condition in compiled.conditions if condition})
+        if planned_cost > original_cost * (1 - MIN_GAIN):
+            return None
+        current = compiled.planned.ast if isinstance(compiled, PlannedRule) else compiled.ast
+        if _same_order(planned, current):
+            return None
+        return planned
+
+
+def _same_order(first, second):
+    # Each tree numbers its own conditions, so the leaves are compared by text
+    return (
+        first.opcodes == second.opcodes and first.left == second.left and first.right == second.right
+        and [first.conditions[value] if value >= 0 else None for value in first.values]
+        == [second.conditions[value] if value >= 0 else None for value in second.values]
+    )
+
+
+def _chain(compact, index):
+    # Children of the maximal chain of index's operator starting at index, left to right
+    opcode = compact.opcodes[index]
+    children = []
+    stack = [index]
+    while stack:
+        current = stack.pop()
+        if current != NO_CHILD and compact.opcodes[current] == opcode:
+            stack.append(compact.right[current])
+            stack.append(compact.left[current])
+        else:
+            children.append(current)
+    return children
+
+
+def _combine(opcode, children, estimates):
+    # (probability true, expected cost) of evaluating children in order with short-circuiting
+    reach = 1.0
+    cost = 0.0
+    for child in children:
+        probability, child_cost = estimates[child]
+        cost += reach * child_cost
+        reach *= probability if opcode == AND else 1 - probability
+    return (reach if opcode == AND else 1 - reach), cost
+
+
+def reorder_ast(compact, stats):
+    # Returns (reordered CompactAST, its estimated cost, the original's estimated cost) using
+    # stats = {condition: (runs, true rate, mean ns)}; unseen leaves get average figures
+    leaf_ns = costs()[1]
+    mean_cost = sum(cost for runs, rate, cost in stats.values()) / len(stats) if stats else 0.0
+    weight = leaf_ns / mean_cost if mean_cost > 0 else 0.0
+    size = len(compact)
+    parents = [NO_CHILD] * size
+    for index in range(size):
+        for child in (compact.left[index], compact.right[index]):
+            if compact.opcodes[index] != OPERAND and child != NO_CHILD:
+                parents[child] = index
+
+    estimates = {NO_CHILD: (0.0, 0.0)}      # index -> (probability true, cost) in the planned order
+    original = {NO_CHILD: (0.0, 0.0)}       # same, in the written order
+    orders = {}                             # chain head -> children in planned order
+    # Children have larger pre-order indexes than their parents, so a backwards pass sees them first
+    for index in range(size - 1, -1, -1):
+        opcode = compact.opcodes[index]
+        if opcode == OPERAND:
+            runs, rate, cost = stats.get(compact.condition(index), (0, 0.5, mean_cost))
+            cost = cost * weight if weight else leaf_ns
+            estimates[index] = original[index] = ((rate * runs + 1) / (runs + 2), cost)
+            continue
+        if parents[index] != NO_CHILD and compact.opcodes[parents[index]] == opcode:
+            continue  # part of its parent's chain
+        children = _chain(compact, index)
+        original[index] = _combine(opcode, children, original)
+
+        def rank(child):
+            probability, cost = estimates[child]
+            decisive = 1 - probability if opcode == AND else probability
+            return cost / decisive if decisive > 0 else float('inf')
+        orders[index] = sorted(children, key=rank)
+        estimates[index] = _combine(opcode, orders[index], estimates)
+
+    planned = CompactAST(conditions=compact.conditions)
+    if size:
+        _emit(compact, orders, planned)
+    return planned, estimates[0][1] if size else 0.0, original[0][1] if size else 0.0
+
+
+def _emit(compact, orders, planned):
+    # Writes the planned tree in pre-order; each chain becomes a balanced tree of its operator
+    opcodes, left, right, values = planned.opcodes, planned.left, planned.right, planned.values
+    stack = [(0, -1, None)]     # (source index or (opcode, chain children), parent, side)
+    while stack:
+        source, parent, side = stack.pop()
+        if not isinstance(source, tuple) and source in orders:
+            source = (compact.opcodes[source], orders[source])
+        if isinstance(source, tuple) and len(source[1]) == 1:
+            stack.append((source[1][0], parent, side))
+            continue
+        if source == NO_CHILD:
+            continue  # the parent's child pointer stays NO_CHILD
+        index = len(opcodes)
+        if parent >= 0:
+            (left if side == 'left' else right)[parent] = index
+        left.append(NO_CHILD)
+        right.append(NO_CHILD)
+        if not isinstance(source, tuple):
+            opcodes.append(OPERAND)
+            values.append(compact.values[source])
+            continue
+        opcode, children = source
+        opcodes.append(opcode)
+        values.append(-1)
+        middle = len(children) // 2
+        stack.append(((opcode, children[middle:]), index, 'right'))
+        stack.append(((opcode, children[:middle]), index, 'left'))
+
+
+rule_statistics = RuleStatistics(
+    sample_every=getattr(settings, 'RULE_STATS_SAMPLE_EVERY', 64),
+    min_samples=getattr(settings, 'RULE_PLAN_MIN_SAMPLES', 1000),
+    leaves_per_sample=getattr(settings, 'RULE_STATS_LEAVES_PER_SAMPLE', 16),
+)
@@ -1,3 +1,956 @@
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db.models import F
+from datetime import date
+from itertools import product
+from unittest import mock, skipIf
+import io
+import tempfile
+from main import compact, deepjson, fastjson, models, views
+from main.cache import compiled_rules, compiled_rulesets, parsed_groups, rule_results, shared_rules
+from main.compact import CompactAST
+from main.compiler import compile_ast
+from main.matcher import rule_index
+from main.metrics import Metrics, metrics
+from main.optimizer import optimize_ast
+from main.parallel import ParallelEvaluator, compile_payload, evaluate_records, rule_payload
+from main.statistics import reorder_ast, rule_statistics
+from main.values import parse_operand, to_number, to_value
+from main.vectorized import evaluate_columns, np
 
-# Create your tests here.
+RULE = "( ( age > 30 AND department = 'Sales' ) OR ( age < 25 AND department = 'Marketing' ) ) AND ( salary > 50000 OR experience > 5 )"
+
+
+def parse(rule_string):
+    # Node tree of a rule string, as create_rule stores it
+    parsed = views.create_rule(rule_string)
+    assert parsed['valid'], parsed['content']
+    return views.loads_ast(parsed['content'])
+
+
+def conditions(rule_string):
+    # Leaf conditions of the parsed rule, in pre-order
+    compact_ast = views.create_rule(rule_string)['compact']
+    return [compact_ast.condition(index) for index in range(len(compact_ast)) if compact_ast.values[index] >= 0]
+
+
+def compiled(rule_string):
+    return compile_ast(CompactAST.from_node(parse(rule_string)))
+
+
+def outcome(evaluate, data):
+    # Result of evaluate(data), or the type of the exception it raised
+    try:
+        return evaluate(data)
+    except Exception as error:
+        return type(error)
+
+
+class RuleTestCase(TestCase):
+    # The caches are process-wide and SQLite reuses the ids of rows rolled back between tests
+    def setUp(self):
+        for cache in (compiled_rules, compiled_rulesets, parsed_groups, rule_results):
+            cache.clear()
+        caches[shared_rules.alias].clear()
+        rule_index.invalidate_all()
+
+    def create(self, rule_name, rule_string):
+        response = self.client.post('/rules/', {'rule_name': rule_name, 'rule_string': rule_string}, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()['id']
+
+    def evaluate(self, rule_id, data):
+        response = self.client.post(f'/rules/{rule_id}/evaluate_fast', {'data': data}, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['result']
+
+
+class CompiledEvaluationTests(TestCase):
+    RULES = (
+        RULE,
+        "age > 30 AND department = 'Sales'",
+        "( age >= 30 OR salary <= 1000 ) AND ( experience = 2 OR department = 'HR' )",
+        'age > 30 AND age < 20',
+        "hired > 2020-01-01 OR name = 'x'",
+    )
+    VALUES = {
+        'age': (20, 30, 45, 'x'),
+        'department': ('Sales', 'Marketing', 'HR'),
+        'salary': (1000, 60000),
+        'experience': (2, 8),
+        'hired': ('2019-05-01', '2021-05-01'),
+        'name': ('x', 'y'),
+    }
+    # (rule, record, result or exception type), worked out by hand
+    EXPECTED = (
+        (RULE, {'age': 35, 'department': 'Sales', 'salary': 60000, 'experience': 1}, True),
+        (RULE, {'age': 35, 'department': 'Sales', 'salary': 1000, 'experience': 1}, False),
+        (RULE, {'age': 20, 'department': 'Marketing', 'salary': 1000, 'experience': 8}, True),
+        (RULE, {'age': 20, 'department': 'Sales', 'salary': 60000, 'experience': 8}, False),
+        (RULE, {'age': 28, 'department': 'Marketing', 'salary': 60000, 'experience': 8}, False),
+        ("department = 'Sales'", {'department': 'sales'}, False),
+        ('age > 30', {'age': '40'}, True),
+        ('age = 30.0', {'age': 30}, True),
+        ('age >= 30 AND age <= 30', {'age': 30}, True),
+        ('hired > 2020-01-01', {'hired': '2021-05-01'}, True),
+        ('hired > 2020-01-01', {'hired': '2019-12-31'}, False),
+        ('age > 30 OR salary > 5', {'age': 40}, True),
+        ('age > 30 AND salary > 5', {'age': 20}, False),
+        ('age > 30 AND salary > 5', {'age': 40}, ValueError),
+        ('age > 30', {'age': 'x'}, TypeError),
+        ('hired > 2020-01-01', {'hired': 'abc'}, TypeError),
+    )
+
+    def records(self):
+        fields = list(self.VALUES)
+        for values in product(*(self.VALUES[field] for field in fields[:4])):
+            yield dict(zip(fields, values), hired='2021-05-01', name='y')
+        yield {'department': 'Sales'}
+        yield {'hired': '2019-05-01', 'name': 'x'}
+
+    def test_expected_results(self):
+        for rule_string, data, expected in self.EXPECTED:
+            with self.subTest(rule=rule_string, data=data):
+                self.assertEqual(outcome(compiled(rule_string).evaluate, data), expected)
+
+    def test_compiled_rule_matches_the_ast(self):
+        for rule_string in self.RULES:
+            root = parse(rule_string)
+            rule = compile_ast(CompactAST.from_node(root))
+            for data in self.records():
+                with self.subTest(rule=rule_string, data=data):
+                    self.assertEqual(outcome(rule.evaluate, data), outcome(lambda data: views.evaluate_ast(root, data), data))
+
+
+class OptimizerTests(TestCase):
+    def test_implied_bound_is_dropped(self):
+        self.assertEqual(conditions('age > 30 AND age > 40'), ['age > 40'])
+        self.assertEqual(conditions('age > 30 OR age > 40'), ['age > 30'])
+
+    def test_duplicates_are_removed(self):
+        self.assertEqual(conditions('age > 30 AND age > 30'), ['age > 30'])
+        self.assertEqual(conditions('( age > 30 AND salary > 10 ) OR ( age > 30 AND salary > 10 )'), ['age > 30', 'salary > 10'])
+        self.assertEqual(views.create_rule('age > 30 AND age > 30')['nodes_removed'], 2)
+
+    def test_empty_range_is_false(self):
+        self.assertEqual(conditions('age > 30 AND age < 20'), ['age > 30', 'FALSE'])
+
+    def test_bounds_of_different_types_are_kept(self):
+        self.assertEqual(conditions('age > 30 AND age > 2020-01-01'), ['age > 30', 'age > 2020-01-01'])
+        self.assertEqual(conditions('age > 30 AND age > 40.5'), ['age > 30', 'age > 40.5'])
+
+    def test_folding_keeps_the_result(self):
+        # ( age > 30 AND age > 40 ) OR ( age < 10 AND ( age < 20 AND salary > 5 ) ), built without the parser,
+        # which already optimizes
+        def tree():
+            operand = lambda condition: views.Node('operand', value=condition)
+            operator = lambda value, left, right: views.Node('operator', left, right, value)
+            return operator(
+                'OR',
+                operator('AND', operand('age > 30'), operand('age > 40')),
+                operator('AND', operand('age < 10'), operator('AND', operand('age < 20'), operand('salary > 5'))),
+            )
+        unoptimized = compile_ast(CompactAST.from_node(tree()))
+        optimized, nodes_removed = optimize_ast(tree())
+        self.assertGreater(nodes_removed, 0)
+        optimized = compile_ast(CompactAST.from_node(optimized))
+        for age, salary in product((5, 15, 35, 45, 'x'), (1, 10)):
+            data = {'age': age, 'salary': salary}
+            with self.subTest(data=data):
+                self.assertEqual(outcome(optimized.evaluate, data), outcome(unoptimized.evaluate, data))
+
+
+class CacheInvalidationTests(RuleTestCase):
+    def test_save_bumps_the_version(self):
+        rule_id = self.create('adults', 'age > 30')
+        self.assertTrue(self.evaluate(rule_id, {'age': 40}))
+        rule = models.rules.objects.get(pk=rule_id)
+        self.assertIsNotNone(compiled_rules.get(rule_id, rule.version))
+
+        parsed = views.create_rule('age > 50')
+        rule.rule_string = 'age > 50'
+        rule.set_ast(parsed['content'], parsed['compact'])
+        rule.save()
+        self.assertIsNone(compiled_rules.get(rule_id, rule.version - 1))
+        self.assertFalse(self.evaluate(rule_id, {'age': 40}))
+
+    def test_saving_other_columns_keeps_the_version(self):
+        rule_id = self.create('adults', 'age > 30')
+        rule = models.rules.objects.get(pk=rule_id)
+        rule.rule_name = 'grown-ups'
+        rule.save(update_fields=['rule_name'])
+        self.assertEqual(models.rules.objects.get(pk=rule_id).version, 1)
+
+    def test_update_after_a_concurrent_bump(self):
+        # A PUT loads the rule, a plan is stored meanwhile (bumping the version as save_evaluation_plan
+        # does), then the PUT saves: its AST must not share a version with the planned old one
+        rule_id = self.create('adults', 'age > 30')
+        rule = models.rules.objects.get(pk=rule_id)
+        models.rules.objects.filter(pk=rule_id, version=rule.version).update(version=F('version') + 1)
+        shared_rules.changed(rule_id)
+        self.assertTrue(self.evaluate(rule_id, {'age': 40}))  # caches the old AST under version 2
+
+        parsed = views.create_rule('age > 50')
+        rule.rule_string = 'age > 50'
+        rule.set_ast(parsed['content'], parsed['compact'])
+        rule.save()
+        self.assertEqual(rule.version, 3)
+        self.assertEqual(models.rules.objects.get(pk=rule_id).version, 3)
+        self.assertFalse(self.evaluate(rule_id, {'age': 40}))
+        compiled_rules.clear()  # another worker, compiling from the shared cache
+        self.assertFalse(self.evaluate(rule_id, {'age': 40}))
+
+    def test_update_through_the_api(self):
+        rule_id = self.create('adults', 'age > 30')
+        self.assertTrue(self.evaluate(rule_id, {'age': 40}))
+        response = self.client.put(f'/rules/{rule_id}/', {'rule_name': 'adults', 'rule_string': 'age > 50'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.evaluate(rule_id, {'age': 40}))
+
+    def test_delete(self):
+        rule_id = self.create('adults', 'age > 30')
+        self.assertTrue(self.evaluate(rule_id, {'age': 40}))
+        models.rules.objects.get(pk=rule_id).delete()
+        response = self.client.post(f'/rules/{rule_id}/evaluate_fast', {'data': {'age': 40}}, content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+
+class BatchEvaluationTests(RuleTestCase):
+    def test_results_in_order_with_errors_in_place(self):
+        rule_id = self.create('sales', "age > 30 AND department = 'Sales'")
+        records = [
+            {'age': 40, 'department': 'Sales'},
+            {'age': 20, 'department': 'Sales'},
+            {'department': 'Sales'},
+            {'age': 40, 'department': 'HR'},
+        ]
+        response = self.client.post(f'/rules/{rule_id}/evaluate_batch', {'data': records}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['results'], [True, False, None, False])
+        self.assertEqual([error['index'] for error in body['errors']], [2])
+
+    def test_bare_list(self):
+        rule_id = self.create('adults', 'age > 30')
+        response = self.client.post(f'/rules/{rule_id}/evaluate_batch', [{'age': 40}, {'age': 1}], content_type='application/json')
+        self.assertEqual(response.json()['results'], [True, False])
+
+    def test_data_or_columns(self):
+        rule_id = self.create('adults', 'age > 30')
+        response = self.client.post(f'/rules/{rule_id}/evaluate_batch', {}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_missing_rule(self):
+        response = self.client.post('/rules/999/evaluate_batch', {'data': []}, content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+
+@skipIf(np is None, "numpy is not installed")
+class ColumnarEvaluationTests(TestCase):
+    RULES = (
+        "a = '1'", 'a = 1', "a = 'True'", 'a > 1', 'a <= 2.5', "a = '1.0'", 'a > 2020-01-01',
+        "( a = 1 OR b > 2 ) AND b < 40", "a = 'abc' OR b = 30",
+    )
+    # Columns mixing types numpy would otherwise unify: bool with int, int with float, numbers with text
+    COLUMNS = (
+        [1, 2.5], [True, 30], [False, 0, 1.0], [1, '1', 'abc'], [True, 'True', 2],
+        ['2021-06-01', '2019-01-01'], ['2021-06-01', 5], [1.0, 2.0], [1, 2], ['1', '30'], [30, None],
+    )
+
+    def scalar(self, compiled, columns):
+        # Row by row results, or None when a row raises (the columnar call raises then too)
+        rows = [dict(zip(columns, values)) for values in zip(*columns.values())]
+        try:
+            return [compiled.evaluate(row) for row in rows]
+        except (ValueError, TypeError):
+            return None
+
+    def test_matches_the_scalar_engine(self):
+        for rule_string in self.RULES:
+            rule = compiled(rule_string)
+            for a, b in product(self.COLUMNS, repeat=2):
+                length = min(len(a), len(b))
+                columns = {'a': a[:length], 'b': b[:length]}
+                with self.subTest(rule=rule_string, columns=columns):
+                    expected = self.scalar(rule, columns)
+                    if expected is None:
+                        with self.assertRaises((ValueError, TypeError)):
+                            evaluate_columns(rule, columns)
+                    else:
+                        self.assertEqual(evaluate_columns(rule, columns).tolist(), expected)
+
+    def test_reported_columns(self):
+        self.assertEqual(evaluate_columns(compiled("a = '1'"), {'a': [1, 2.5]}).tolist(), [True, False])
+        self.assertEqual(evaluate_columns(compiled('a = 1'), {'a': [True, 30]}).tolist(), [False, False])
+        self.assertEqual(evaluate_columns(compiled("a = 'True'"), {'a': [True, 30]}).tolist(), [True, False])
+
+    def test_columns_of_different_lengths(self):
+        with self.assertRaises(ValueError):
+            evaluate_columns(compiled('a > 1 AND b > 1'), {'a': [1, 2], 'b': [1]})
+
+
+class EvaluateManyTests(RuleTestCase):
+    def test_matches_and_errors(self):
+        adults = self.create('adults', 'age > 30')
+        sales = self.create('sales', "department = 'Sales' AND age > 30")
+        seniors = self.create('seniors', 'age > 60')
+        rich = self.create('rich', 'salary > 50000')
+        response = self.client.post('/rules/evaluate_many', {'data': {'age': 40, 'department': 'Sales'}}, content_type='application/json')
+        body = response.json()
+        self.assertEqual(sorted(body['matches']), [adults, sales])
+        self.assertEqual(list(body['errors']), [str(rich)])
+        self.assertNotIn(seniors, body['matches'])
+
+    def test_selected_ids_match_each_rule(self):
+        rule_strings = [RULE, 'age > 30', "age > 30 AND department = 'Sales'", 'age < 25 OR experience > 5']
+        ids = [self.create(f'rule {index}', rule_string) for index, rule_string in enumerate(rule_strings)]
+        data = {'age': 20, 'department': 'Marketing', 'salary': 60000, 'experience': 8}
+        response = self.client.post('/rules/evaluate_many', {'data': data, 'ids': ids[1:]}, content_type='application/json')
+        expected = [rule_id for rule_id in ids[1:] if self.evaluate(rule_id, data)]
+        self.assertEqual(sorted(response.json()['matches']), expected)
+
+    def test_update_is_seen(self):
+        rule_id = self.create('adults', 'age > 30')
+        many = lambda: self.client.post('/rules/evaluate_many', {'data': {'age': 40}}, content_type='application/json').json()['matches']
+        self.assertEqual(many(), [rule_id])
+        self.client.put(f'/rules/{rule_id}/', {'rule_name': 'adults', 'rule_string': 'age > 50'}, content_type='application/json')
+        self.assertEqual(many(), [])
+
+
+class MatchIndexTests(RuleTestCase):
+    def match(self, data):
+        response = self.client.post('/rules/match', {'data': data}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return sorted(response.json()['matches'])
+
+    def test_matches_every_rule_that_is_true(self):
+        rule_strings = [RULE, 'age > 30', "department = 'Sales'", 'age < 25 OR experience > 5', 'salary >= 60000 AND age > 60']
+        ids = [self.create(f'rule {index}', rule_string) for index, rule_string in enumerate(rule_strings)]
+        for data in (
+            {'age': 35, 'department': 'Sales', 'salary': 60000, 'experience': 1},
+            {'age': 20, 'department': 'Marketing', 'salary': 1000, 'experience': 8},
+            {'age': 70, 'department': 'HR', 'salary': 60000, 'experience': 1},
+        ):
+            with self.subTest(data=data):
+                self.assertEqual(self.match(data), [rule_id for rule_id in ids if self.evaluate(rule_id, data)])
+
+    def test_update_and_delete(self):
+        rule_id = self.create('adults', 'age > 30')
+        self.assertEqual(self.match({'age': 40}), [rule_id])
+        self.client.put(f'/rules/{rule_id}/', {'rule_name': 'adults', 'rule_string': 'age > 50'}, content_type='application/json')
+        self.assertEqual(self.match({'age': 40}), [])
+        self.client.delete(f'/rules/{rule_id}/')
+        self.assertEqual(self.match({'age': 60}), [])
+
+    def test_queryset_delete(self):
+        rule_id = self.create('adults', 'age > 30')
+        self.assertEqual(self.match({'age': 40}), [rule_id])
+        models.rules.objects.filter(pk=rule_id).delete()
+        self.assertEqual(self.match({'age': 40}), [])
+        self.assertIsNone(compiled_rules.recent(rule_id))
+
+    def test_rows_written_outside_save(self):
+        # As another worker or import_rules would: no save(), no signal, no change in this process' cache
+        self.assertEqual(self.match({'age': 40}), [])
+        parsed = views.create_rule('age > 30')
+        rule = models.rules(rule_name='adults', rule_string='age > 30')
+        rule.set_ast(parsed['content'], parsed['compact'])
+        models.rules.objects.bulk_create([rule])
+        self.assertEqual(self.match({'age': 40}), [rule.pk])
+        parsed = views.create_rule('age > 50')
+        models.rules.objects.filter(pk=rule.pk).update(
+            rule_ast=parsed['content'], rule_ast_compact=compact.encode(parsed['compact']), version=F('version') + 1
+        )
+        self.assertEqual(self.match({'age': 40}), [])
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {models.rules._meta.db_table} WHERE id = %s', [rule.pk])
+        self.assertEqual(self.match({'age': 60}), [])
+
+
+class ParserTests(RuleTestCase):
+    def test_condition_is_typed(self):
+        ast = deepjson.loads(views.create_rule("age > 30 AND department = 'Sales'")['content'])
+        self.assertEqual(ast['node_type'], 'operator')
+        self.assertEqual(ast['value'], 'AND')
+        self.assertEqual(ast['left'], {
+            'node_type': 'operand', 'value': 'age > 30',
+            'field': 'age', 'operator': '>', 'constant': 30, 'type': 'int',
+        })
+        self.assertEqual(ast['right'], {
+            'node_type': 'operand', 'value': "department = 'Sales'",
+            'field': 'department', 'operator': '=', 'constant': 'Sales', 'type': 'string',
+        })
+
+    def test_grouping(self):
+        root = parse(RULE)
+        self.assertEqual(root.value, 'AND')
+        self.assertEqual(root.left.value, 'OR')
+        self.assertEqual(root.right.value, 'OR')
+        self.assertEqual(root.left.left.left.value, 'age > 30')
+        self.assertEqual(root.right.right.value, 'experience > 5')
+
+    def test_chains_group_from_the_right(self):
+        for rule_string in ('a = 1 AND b = 2 OR c = 3', '( a = 1 AND b = 2 OR c = 3 )', '( ( a = 1 AND b = 2 OR c = 3 ) )'):
+            with self.subTest(rule=rule_string):
+                root = parse(rule_string)
+                self.assertEqual(root.value, 'AND')
+                self.assertEqual(root.left.value, 'a = 1')
+                self.assertEqual(root.right.value, 'OR')
+        root = parse('( a = 1 OR b = 2 AND c = 3 )')
+        self.assertEqual(root.value, 'OR')
+        self.assertEqual(root.right.value, 'AND')
+
+    def test_parentheses_keep_the_meaning(self):
+        rule = compiled('a = 1 AND b = 2 OR c = 3')
+        wrapped = compiled('( a = 1 AND b = 2 OR c = 3 ) AND d = 4')
+        for values in product((0, 1), (0, 2), (0, 3)):
+            data = dict(zip('abc', values), d=4)
+            with self.subTest(data=data):
+                self.assertEqual(wrapped.evaluate(data), rule.evaluate(data))
+
+    def test_unbalanced_parentheses(self):
+        self.assertFalse(views.create_rule('( age > 30 AND salary > 10')['valid'])
+        self.assertFalse(views.create_rule('age > 30 ) AND salary > 10')['valid'])
+
+    def test_constant_conditions(self):
+        self.assertFalse(compiled('age > 30 AND FALSE')({'age': 40}))
+        self.assertTrue(compiled('FALSE OR age > 30')({'age': 40}))
+        self.assertTrue(compiled('TRUE')({}))
+        self.assertEqual(conditions('flag = TRUE'), ['flag = TRUE'])
+
+    def test_deep_rule(self):
+        rule_string = ' AND '.join(f'field{index} > 1' for index in range(3000))
+        parsed = views.create_rule(rule_string)
+        self.assertTrue(parsed['valid'])
+        self.assertEqual(len(parsed['compact']), 2 * 3000 - 1)
+        self.assertEqual(conditions(rule_string), [f'field{index} > 1' for index in range(3000)])
+
+    def test_combined_rule_survives_an_update(self):
+        # A PUT resending the rule_string from GET re-parses it: the result must not change
+        chain = self.create('chain', 'a = 1 AND b = 2 OR c = 3')
+        other = self.create('other', 'd = 4')
+        response = self.client.post('/rules/combine_rules', {'rule_name': 'combined', 'ids': [chain, other]}, content_type='application/json')
+        combined = response.json()['new_rule_id']
+        data = {'a': 0, 'b': 0, 'c': 3, 'd': 0}
+        before = self.evaluate(combined, data)
+        self.assertFalse(before)
+        stored = self.client.get(f'/rules/{combined}/').json()
+        response = self.client.put(f'/rules/{combined}/', {'rule_name': 'renamed', 'rule_string': stored['rule_string']}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.evaluate(combined, data), before)
+
+    def test_export_and_import_keep_the_meaning(self):
+        chain = self.create('chain', 'a = 1 AND b = 2 OR c = 3')
+        other = self.create('other', 'd = 4')
+        response = self.client.post('/rules/combine_rules', {'rule_name': 'combined', 'ids': [chain, other]}, content_type='application/json')
+        combined = response.json()['new_rule_id']
+        data = {'a': 0, 'b': 0, 'c': 3, 'd': 0}
+        before = {rule_id: self.evaluate(rule_id, data) for rule_id in (chain, other, combined)}
+
+        exported = b''.join(self.client.get('/rules/export').streaming_content)
+        models.rules.objects.all().delete()
+        response = self.client.post('/rules/import', exported, content_type='application/x-ndjson')
+        ids = response.json()['ids']
+        self.assertEqual([self.evaluate(rule_id, data) for rule_id in ids], list(before.values()))
+
+
+class CombineTests(RuleTestCase):
+    def combine(self, ids, rule_name='combined'):
+        response = self.client.post('/rules/combine_rules', {'rule_name': rule_name, 'ids': ids}, content_type='application/json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return models.rules.objects.get(pk=response.json()['new_rule_id'])
+
+    def test_rule_string_parses_back_to_the_stored_tree(self):
+        rule_strings = (
+            RULE, 'a = 1 AND b = 2 OR c = 3', 'd = 4', 'age > 30 AND age < 20', 'age > 30 AND age > 40',
+            "( x = 'y' OR x = 'y' ) AND hired > 2020-01-01",
+        )
+        ids = [self.create(f'rule {index}', rule_string) for index, rule_string in enumerate(rule_strings)]
+        for selected in (ids, ids[1:3], ids[3:4], [ids[0], ids[0]]):
+            with self.subTest(ids=selected):
+                combined = self.combine(selected)
+                parsed = views.create_rule(combined.rule_string)
+                self.assertTrue(parsed['valid'], parsed['content'])
+                self.assertEqual(compact.encode(parsed['compact']), bytes(combined.rule_ast_compact))
+                self.assertEqual(deepjson.loads(parsed['content']), deepjson.loads(combined.rule_ast))
+
+    def test_rule_string_is_written_from_the_tree(self):
+        ids = [self.create('chain', 'a = 1 AND b = 2 OR c = 3'), self.create('empty', 'age > 30 AND age < 20'), self.create('single', '( d = 4 )')]
+        self.assertEqual(
+            self.combine(ids).rule_string,
+            '( a = 1 AND ( b = 2 OR c = 3 ) ) AND ( ( age > 30 AND FALSE ) AND d = 4 )',
+        )
+
+    def test_combined_rule_evaluates_like_its_parts(self):
+        left = self.create('chain', 'a = 1 AND b = 2 OR c = 3')
+        right = self.create('other', 'd = 4 OR a = 1')
+        combined = self.combine([left, right])
+        operator = deepjson.loads(combined.rule_ast)['value']
+        for values in product((0, 1), (0, 2), (0, 3), (0, 4)):
+            data = dict(zip('abcd', values))
+            parts = [self.evaluate(left, data), self.evaluate(right, data)]
+            with self.subTest(data=data):
+                self.assertEqual(self.evaluate(combined.pk, data), all(parts) if operator == 'AND' else any(parts))
+
+    def test_missing_rule(self):
+        rule_id = self.create('adults', 'age > 30')
+        response = self.client.post('/rules/combine_rules', {'rule_name': 'combined', 'ids': [rule_id, 999]}, content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+
+class AsyncViewTests(RuleTestCase):
+    def post(self, url, body):
+        response = self.client.post(url, body, content_type='application/json')
+        return response.status_code, response.json()
+
+    def test_same_responses_as_the_sync_views(self):
+        rule_id = self.create('sales', "age > 30 AND department = 'Sales'")
+        for data in ({'age': 40, 'department': 'Sales'}, {'age': 20, 'department': 'Sales'}, {'department': 'Sales'}):
+            with self.subTest(data=data):
+                self.assertEqual(self.post(f'/rules/{rule_id}/evaluate_async', {'data': data}), self.post(f'/rules/{rule_id}/evaluate_fast', {'data': data}))
+        records = {'data': [{'age': 40, 'department': 'Sales'}, {'age': 'x', 'department': 'Sales'}, {}]}
+        self.assertEqual(self.post(f'/rules/{rule_id}/evaluate_batch_async', records), self.post(f'/rules/{rule_id}/evaluate_batch', records))
+        self.assertEqual(self.post('/rules/999/evaluate_async', {'data': {}})[0], 404)
+        self.assertEqual(self.post('/rules/999/evaluate_batch_async', {'data': []})[0], 404)
+
+    def test_combine(self):
+        ids = [self.create('adults', 'age > 30'), self.create('sales', "department = 'Sales' OR salary > 10")]
+        status, body = self.post('/rules/combine_rules_async', {'rule_name': 'combined', 'ids': ids})
+        self.assertEqual(status, 201)
+        status, sync_body = self.post('/rules/combine_rules', {'rule_name': 'combined', 'ids': ids})
+        rule_strings = models.rules.objects.filter(pk__in=[body['new_rule_id'], sync_body['new_rule_id']]).values_list('rule_string', flat=True)
+        self.assertEqual(len(set(rule_strings)), 1)
+
+    def test_updates_are_seen(self):
+        rule_id = self.create('adults', 'age > 30')
+        self.assertEqual(self.post(f'/rules/{rule_id}/evaluate_async', {'data': {'age': 40}}), (200, {'result': True}))
+        # A save in this process drops the cached rule at once
+        response = self.client.put(f'/rules/{rule_id}/', {'rule_name': 'adults', 'rule_string': 'age > 50'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.post(f'/rules/{rule_id}/evaluate_async', {'data': {'age': 40}}), (200, {'result': False}))
+        # A save by another worker (no signal here) is seen once the last version check is older than the TTL
+        parsed = views.create_rule('age > 30')
+        models.rules.objects.filter(pk=rule_id).update(
+            rule_ast=parsed['content'], rule_ast_compact=compact.encode(parsed['compact']), version=F('version') + 1,
+        )
+        with mock.patch.object(compiled_rules, 'recent_ttl', 3600):
+            self.assertEqual(self.post(f'/rules/{rule_id}/evaluate_async', {'data': {'age': 40}}), (200, {'result': False}))
+        with mock.patch.object(compiled_rules, 'recent_ttl', 0):
+            self.assertEqual(self.post(f'/rules/{rule_id}/evaluate_async', {'data': {'age': 40}}), (200, {'result': True}))
+
+
+class SharedCacheTests(RuleTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(shared_rules, 'version_timeout', 60)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_another_worker_needs_no_query(self):
+        rule_id = self.create('adults', 'age > 30')
+        version = views.load_compiled_rule(rule_id)[0]
+        self.assertEqual(shared_rules.versions([rule_id]), {rule_id: version})
+        # A worker with an empty process cache takes the version and the encoded AST from the shared cache
+        compiled_rules.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(views.load_compiled_rule(rule_id)[0], version)
+        self.assertTrue(self.evaluate(rule_id, {'age': 40}))
+
+    def test_save_and_delete_drop_the_version(self):
+        rule_id = self.create('adults', 'age > 30')
+        views.load_compiled_rule(rule_id)
+        generation = shared_rules.generation()
+        rule = models.rules.objects.get(pk=rule_id)
+        rule.rule_name = 'renamed'
+        rule.save()
+        self.assertEqual(shared_rules.versions([rule_id]), {})
+        self.assertNotEqual(shared_rules.generation(), generation)
+        self.assertEqual(views.load_compiled_rule(rule_id)[0], rule.version)
+
+        rule.delete()
+        self.assertEqual(self.client.post(f'/rules/{rule_id}/evaluate_fast', {'data': {'age': 40}}, content_type='application/json').status_code, 404)
+        self.assertEqual(shared_rules.versions([rule_id]), {rule_id: 0})
+        with self.assertNumQueries(0):
+            response = self.client.post(f'/rules/{rule_id}/evaluate_fast', {'data': {'age': 40}}, content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_no_version_keys_without_a_timeout(self):
+        rule_id = self.create('adults', 'age > 30')
+        with mock.patch.object(shared_rules, 'version_timeout', 0):
+            views.load_compiled_rule(rule_id)
+            shared_rules.remember_versions({rule_id: 5})
+            self.assertEqual(shared_rules.versions([rule_id]), {})
+        self.assertEqual(shared_rules.versions([rule_id]), {})
+
+
+class ImportExportTests(RuleTestCase):
+    def test_round_trip(self):
+        self.create('existing', RULE)
+        lines = [
+            {'rule_name': 'first', 'rule_string': "age > 30 AND department = 'Sales'"},
+            {'rule_name': 'broken', 'rule_string': '( age > 30'},
+            {'rule_name': 'second', 'rule_string': 'salary > 50000 OR experience > 5'},
+        ]
+        body = b''.join(fastjson.dumps(line) + b'\n' for line in lines)
+        response = self.client.post('/rules/import', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        imported = response.json()
+        self.assertEqual(imported['created'], 2)
+        self.assertEqual([error['line'] for error in imported['errors']], [2])
+
+        response = self.client.get('/rules/export')
+        exported = [fastjson.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([rule['rule_name'] for rule in exported], ['existing', 'first', 'second'])
+        self.assertEqual([rule['id'] for rule in exported[1:]], imported['ids'])
+
+        models.rules.objects.all().delete()
+        body = b''.join(fastjson.dumps(rule) + b'\n' for rule in exported)
+        response = self.client.post('/rules/import', body, content_type='application/x-ndjson')
+        self.assertEqual(response.json()['created'], 3)
+        stored = list(models.rules.objects.order_by('id').values_list('rule_name', 'rule_string'))
+        self.assertEqual(stored, [(rule['rule_name'], rule['rule_string']) for rule in exported])
+        rule_id = models.rules.objects.get(rule_name='first').pk
+        self.assertTrue(self.evaluate(rule_id, {'age': 40, 'department': 'Sales'}))
+
+    def test_empty_body(self):
+        response = self.client.post('/rules/import', b'\n', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['created'], 0)
+
+    def test_commands(self):
+        ids = [self.create(f'rule {index}', f'age > {index}') for index in range(5)]
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/rules.ndjson'
+            call_command('export_rules', output=path, batch_size=2)
+            with open(path, encoding='utf-8') as file:
+                exported = [deepjson.loads(line) for line in file]
+            self.assertEqual([rule['id'] for rule in exported], ids)
+            models.rules.objects.all().delete()
+            with open(path, 'a', encoding='utf-8') as file:
+                file.write('{"rule_name": "broken", "rule_string": "( age > 1"}\n')
+            with self.assertRaises(CommandError):
+                call_command('import_rules', input=path, batch_size=2, stderr=io.StringIO())
+        stored = list(models.rules.objects.order_by('id').values_list('rule_name', 'rule_string'))
+        self.assertEqual(stored, [(rule['rule_name'], rule['rule_string']) for rule in exported])
+
+
+class PaginationTests(RuleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ids = [self.create(f'rule {index}', f'age > {index}') for index in range(5)]
+
+    def test_plain_list_by_default(self):
+        response = self.client.get('/rules/')
+        self.assertEqual([rule['id'] for rule in response.json()], self.ids)
+
+    def test_cursor_pages(self):
+        seen = []
+        url = '/rules/?page_size=2'
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page['results']), 2)
+            seen += [rule['id'] for rule in page['results']]
+            url = page['next']
+        self.assertEqual(seen, self.ids)
+
+    def test_name_prefix(self):
+        self.create('other', 'age > 1')
+        response = self.client.get('/rules/', {'rule_name_prefix': 'rule '})
+        self.assertEqual([rule['id'] for rule in response.json()], self.ids)
+
+    def test_exact_name_and_case_sensitive_prefix(self):
+        capitalized = self.create('Rule 9', 'age > 1')
+        self.assertEqual([rule['id'] for rule in self.client.get('/rules/', {'rule_name': 'rule 3'}).json()], [self.ids[3]])
+        self.assertEqual([rule['id'] for rule in self.client.get('/rules/', {'rule_name_prefix': 'Rule'}).json()], [capitalized])
+
+    def test_pages_run_no_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            page = self.client.get('/rules/', {'page_size': 2}).json()
+        self.assertEqual([rule['id'] for rule in page['results']], self.ids[:2])
+        self.assertFalse([query['sql'] for query in queries if 'COUNT(' in query['sql'].upper()])
+
+
+class MetricsTests(RuleTestCase):
+    def test_histogram_buckets(self):
+        recorder = Metrics()
+        recorder.observe('parse', 3e-6)
+        recorder.observe('parse', 0.2, weight=2)
+        text = recorder.render()
+        for line in (
+            'rule_engine_stage_seconds_bucket{stage="parse",le="2.5e-06"} 0',
+            'rule_engine_stage_seconds_bucket{stage="parse",le="5e-06"} 1',
+            'rule_engine_stage_seconds_bucket{stage="parse",le="0.1"} 1',
+            'rule_engine_stage_seconds_bucket{stage="parse",le="0.25"} 3',
+            'rule_engine_stage_seconds_bucket{stage="parse",le="+Inf"} 3',
+            'rule_engine_stage_seconds_count{stage="parse"} 3',
+        ):
+            self.assertIn(line, text.splitlines())
+
+    def test_sampled_evaluations_add_up(self):
+        recorder = Metrics(sample_every=4)
+        self.assertEqual([recorder.evaluation_weight() for _ in range(8)], [4, 0, 0, 0, 4, 0, 0, 0])
+        self.assertEqual([Metrics(enabled=False).evaluation_weight() for _ in range(2)], [0, 0])
+
+    def test_disabled_metrics_do_not_wrap(self):
+        def stage():
+            pass
+        self.assertIs(Metrics(enabled=False).timed('parse')(stage), stage)
+
+    def test_endpoint(self):
+        rule_id = self.create('adults', 'age > 30')
+        metrics.reset()
+        # Any run of sample_every consecutive evaluations holds exactly one timed one
+        for age in range(2 * metrics.sample_every):
+            self.evaluate(rule_id, {'age': age})
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        lines = response.content.decode().splitlines()
+        self.assertIn(f'rule_engine_rule_evaluations_total{{rule="{rule_id}"}} {2 * metrics.sample_every}', lines)
+        self.assertIn(f'rule_engine_stage_seconds_count{{stage="evaluate"}} {2 * metrics.sample_every}', lines)
+        self.assertIn('rule_engine_rules_evaluated 1', lines)
+        self.assertIn('rule_engine_cache_size{cache="compiled_rules"} 1', lines)
+
+
+class IncrementalUpdateTests(RuleTestCase):
+    def large_rule(self, last):
+        # Two parenthesized groups of 40 conditions and a last condition outside them
+        groups = [' OR '.join(f'{field}{index} > {index}' for index in range(40)) for field in ('a', 'b')]
+        return ' AND '.join(f'( {group} )' for group in groups) + f' AND c > {last}'
+
+    def put(self, rule_id, body):
+        response = self.client.put(f'/rules/{rule_id}/', body, content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_edit_reparses_only_the_edited_group(self):
+        rule_id = self.create('large', self.large_rule(1))
+        hits = parsed_groups.hits
+        self.put(rule_id, {'rule_name': 'large', 'rule_string': self.large_rule(2)})
+        self.assertEqual(parsed_groups.hits - hits, 2)
+        stored = models.rules.objects.get(pk=rule_id)
+        fresh = views.create_rule(self.large_rule(2), cache_groups=False)
+        self.assertEqual(bytes(stored.rule_ast_compact), compact.encode(fresh['compact']))
+
+    def test_unchanged_string_keeps_the_version(self):
+        rule_id = self.create('adults', 'age > 30')
+        version, compiled_rule = views.load_compiled_rule(rule_id)
+        self.put(rule_id, {'rule_name': 'renamed', 'rule_string': 'age  >  30'})
+        rule = models.rules.objects.get(pk=rule_id)
+        self.assertEqual((rule.rule_name, rule.version), ('renamed', version))
+        self.assertIs(views.load_compiled_rule(rule_id)[1], compiled_rule)
+
+    def test_statistics_of_kept_conditions_are_retained(self):
+        rule_id = self.create('sales', "age > 30 AND department = 'Sales'")
+        compiled_rule = views.load_compiled_rule(rule_id)[1]
+        rule_statistics.invalidate(rule_id)
+        with mock.patch.object(rule_statistics, 'leaves_per_sample', 2):
+            rule_statistics.record(rule_id, compiled_rule, {'age': 40, 'department': 'Sales'})
+        self.put(rule_id, {'rule_name': 'sales', 'rule_string': 'age > 30 AND salary > 10'})
+        self.assertEqual(set(rule_statistics.snapshot(rule_id)), {'age > 30'})
+
+    def test_large_rule_is_stored_unindented(self):
+        # Above PRETTY_PRINT_NODES nodes rule_ast is written without indentation
+        rule_id = self.create('large', ' AND '.join(f'field{index} > 1' for index in range(views.PRETTY_PRINT_NODES)))
+        self.assertNotIn('\n', models.rules.objects.get(pk=rule_id).rule_ast)
+        rule_id = self.create('small', 'age > 30')
+        self.assertIn('\n', models.rules.objects.get(pk=rule_id).rule_ast)
+
+
+class TypedConstantTests(RuleTestCase):
+    def test_constants(self):
+        expected = {
+            'salary > 50000.5': ('salary', '>', 50000.5),
+            'age >= -3': ('age', '>=', -3),
+            'hired < 2024-01-31': ('hired', '<', date(2024, 1, 31)),
+            "hired < '2024-01-31'": ('hired', '<', date(2024, 1, 31)),
+            'age = 30': ('age', '=', 30),
+            "age = '30'": ('age', '=', '30'),
+            'code = 007': ('code', '=', '007'),
+            'joined = 2024-01-31': ('joined', '=', date(2024, 1, 31)),
+        }
+        for condition, operand in expected.items():
+            with self.subTest(condition=condition):
+                self.assertEqual(tuple(parse_operand(condition)), operand)
+                self.assertIs(type(parse_operand(condition).constant), type(operand[2]))
+
+    def test_unusable_comparison_is_rejected(self):
+        for rule_string in ("department > 'Sales'", 'age > nan', 'hired < 2024-13-01'):
+            with self.subTest(rule_string=rule_string):
+                self.assertFalse(views.create_rule(rule_string)['valid'])
+                response = self.client.post('/rules/', {'rule_name': 'bad', 'rule_string': rule_string}, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+
+    def test_only_canonical_text_is_converted(self):
+        self.assertEqual([to_number(text) for text in ('40', '40.5', '-3', '040', '4e1', 'nan', 'inf')], [40, 40.5, -3, '040', '4e1', 'nan', 'inf'])
+        self.assertEqual([to_value(text) for text in ('2024-01-31', '2024-1-31', '30')], [date(2024, 1, 31), '2024-1-31', 30])
+
+    def test_text_inputs(self):
+        rule_id = self.create('typed', 'age > 30 AND hired >= 2020-01-01')
+        self.assertTrue(self.evaluate(rule_id, {'age': '40', 'hired': '2021-05-01'}))
+        self.assertFalse(self.evaluate(rule_id, {'age': 40.5, 'hired': '2019-12-31'}))
+        response = self.client.post(f'/rules/{rule_id}/evaluate_fast', {'data': {'age': '040', 'hired': '2021-05-01'}}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        # '=' with a number is numeric, every other '=' compares the text
+        self.assertTrue(compiled('age = 30')({'age': 30.0}))
+        self.assertTrue(compiled('age = 30')({'age': '30'}))
+        self.assertFalse(compiled("age = '30'")({'age': '30.0'}))
+
+
+class PlanningTests(RuleTestCase):
+    RULE = 'a > 0 AND c > 0 AND b > 0'
+
+    def setUp(self):
+        super().setUp()
+        settings = (rule_statistics.sample_every, rule_statistics.min_samples)
+        rule_statistics.sample_every, rule_statistics.min_samples = 1, 50
+        self.addCleanup(setattr, rule_statistics, 'sample_every', settings[0])
+        self.addCleanup(setattr, rule_statistics, 'min_samples', settings[1])
+        # Calibrated (probe, leaf, field check) ns depend on the machine; fixed ones keep the decision stable
+        patcher = mock.patch('main.statistics.costs', return_value=(0.0, 50.0, 5.0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_selective_condition_first(self):
+        # b > 0 never holds, so it decides the AND alone
+        stats = {'a > 0': (1000, 1.0, 10.0), 'c > 0': (1000, 1.0, 10.0), 'b > 0': (1000, 0.0, 10.0)}
+        planned, planned_cost, original_cost = reorder_ast(views.create_rule(self.RULE)['compact'], stats)
+        self.assertEqual(planned.condition(planned.left[0]), 'b > 0')
+        self.assertLess(planned_cost, original_cost)
+
+    def test_plan_is_stored_and_cleared_by_an_update(self):
+        rule_id = self.create('planned', self.RULE)
+        rule_statistics.invalidate(rule_id)
+        records = [{'a': 1, 'b': 0, 'c': 1}] * 200
+        response = self.client.post(f'/rules/{rule_id}/evaluate_batch', {'data': records}, content_type='application/json')
+        self.assertEqual(response.json()['results'], [False] * 200)
+        rule = models.rules.objects.get(pk=rule_id)
+        self.assertIsNotNone(rule.rule_ast_plan)
+        plan = rule.evaluation_plan()
+        self.assertEqual(plan.condition(plan.left[0]), 'b > 0')
+        # The planned order gives the same results and errors as the written one
+        twin_id = self.create('twin', self.RULE)
+        for data in ({'a': 1, 'b': 1, 'c': 1}, {'a': 1, 'b': 0, 'c': 1}, {'a': 1, 'c': 1}, {'b': 0}):
+            with self.subTest(data=data):
+                planned = self.client.post(f'/rules/{rule_id}/evaluate_fast', {'data': data}, content_type='application/json')
+                written = self.client.post(f'/rules/{twin_id}/evaluate_fast', {'data': data}, content_type='application/json')
+                self.assertEqual((planned.status_code, planned.json()), (written.status_code, written.json()))
+
+        response = self.client.put(f'/rules/{rule_id}/', {'rule_name': 'planned', 'rule_string': 'a > 0 AND b > 0'}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(models.rules.objects.get(pk=rule_id).rule_ast_plan)
+
+
+class ParallelEvaluationTests(TestCase):
+    RULES = {1: RULE, 2: 'age > 30 AND age < 20', 3: "department = 'Sales' OR experience > 5"}
+    RECORDS = [
+        {'age': age, 'department': department, 'salary': salary, 'experience': experience}
+        for age, department, salary, experience in product((20, 35, 'x'), ('Sales', 'Marketing'), (10, 60000), (1, 9))
+    ] + [{}, {'age': 40}]
+
+    def setUp(self):
+        self.compiled_by_id = {rule_id: compiled(rule_string) for rule_id, rule_string in self.RULES.items()}
+
+    def test_payload_round_trip(self):
+        recompiled = compile_payload(rule_payload(self.compiled_by_id))
+        self.assertEqual(evaluate_records(recompiled, self.RECORDS), evaluate_records(self.compiled_by_id, self.RECORDS))
+
+    def test_chunks_in_input_order(self):
+        chunks = [self.RECORDS[start:start + 5] for start in range(0, len(self.RECORDS), 5)]
+        with ParallelEvaluator(self.compiled_by_id, workers=2, pending=2) as evaluator:
+            outputs = list(evaluator.map(iter(chunks)))
+        self.assertEqual(outputs, [evaluate_records(self.compiled_by_id, chunk) for chunk in chunks])
+
+
+class EvaluateStreamTests(RuleTestCase):
+    def stream(self, rule_ids, text, suffix, **options):
+        # NDJSON output lines of evaluate_stream on text
+        with tempfile.TemporaryDirectory() as directory:
+            source, target = f'{directory}/input{suffix}', f'{directory}/output.ndjson'
+            with open(source, 'w', encoding='utf-8') as file:
+                file.write(text)
+            call_command('evaluate_stream', *rule_ids, input=source, output=target, stderr=io.StringIO(), **options)
+            with open(target, encoding='utf-8') as file:
+                return [deepjson.loads(line) for line in file]
+
+    def test_ndjson(self):
+        rule_id = self.create('adults', 'age > 30')
+        lines = self.stream([rule_id], '{"age": 40}\n\nnot json\n{"name": "x"}\n{"age": 20}\n', '.ndjson', chunk_size=2)
+        self.assertEqual([line['row'] for line in lines], [1, 3, 4, 5])
+        self.assertEqual([line['results'][str(rule_id)] for line in lines], [True, None, None, False])
+        self.assertEqual([sorted(line['errors']) for line in lines], [[], [str(rule_id)], [str(rule_id)], []])
+
+    def test_workers_keep_the_output(self):
+        rule_id = self.create('adults', 'age > 30')
+        text = ''.join(f'{{"age": {age}}}\n' for age in range(60)) + 'not json\n'
+        self.assertEqual(
+            self.stream([rule_id], text, '.ndjson', chunk_size=7, workers=2),
+            self.stream([rule_id], text, '.ndjson', chunk_size=7),
+        )
+
+    def test_csv(self):
+        adults = self.create('adults', 'age > 30')
+        sales = self.create('sales', "dept = 'Sales'")
+        lines = self.stream([adults, sales], 'age,dept\n40,Sales\n,HR\n20,Sales\n', '.csv')
+        self.assertEqual(
+            [line['results'] for line in lines],
+            [{str(adults): True, str(sales): True}, {str(adults): None, str(sales): False}, {str(adults): False, str(sales): True}],
+        )
+
+    def test_csv_row_with_extra_cells(self):
+        rule_id = self.create('adults', 'age > 30')
+        lines = self.stream([rule_id], 'age,dept\n40,Sales\n50,HR,extra\n20,HR\n', '.csv')
+        self.assertEqual([line['results'][str(rule_id)] for line in lines], [True, None, False])
+        self.assertEqual(lines[1]['errors'], {str(rule_id): 'Row 2 has 1 more cell(s) than the header'})
+
+
+class ResultCacheTests(RuleTestCase):
+    # One field compared with 40 constants: worth caching
+    RULE = ' OR '.join(f'age = {age}' for age in range(0, 80, 2))
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(rule_results, 'maxsize', 100)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_fields_the_rule_does_not_read_share_a_result(self):
+        rule_id = self.create('even', self.RULE)
+        hits = rule_results.hits
+        self.assertTrue(self.evaluate(rule_id, {'age': 4, 'name': 'a'}))
+        self.assertTrue(self.evaluate(rule_id, {'age': 4, 'name': 'b'}))
+        self.assertFalse(self.evaluate(rule_id, {'age': 5}))
+        self.assertEqual(rule_results.hits - hits, 1)
+
+    def test_keys(self):
+        rule_id = self.create('even', self.RULE)
+        version, compiled_rule = views.load_compiled_rule(rule_id)
+        keys = [rule_results.key(rule_id, version, compiled_rule, {'age': age}) for age in (4, 4.0, True, '4', 0.0, -0.0)]
+        self.assertEqual(len({key[0] for key in keys}), len(keys))
+        self.assertIsNone(rule_results.key(rule_id, version, compiled_rule, {'age': [4]}))
+        self.assertIsNone(rule_results.key(rule_id, version, compiled_rule, [('age', 4)]))
+        small_id = self.create('adults', 'age > 30')
+        self.assertIsNone(rule_results.key(small_id, *views.load_compiled_rule(small_id), {'age': 4}))
+
+    def test_update_and_errors_are_not_served_stale(self):
+        rule_id = self.create('even', self.RULE)
+        self.assertTrue(self.evaluate(rule_id, {'age': 4}))
+        response = self.client.put(f'/rules/{rule_id}/', {'rule_name': 'even', 'rule_string': self.RULE.replace('age = 4 OR ', '')}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(self.evaluate(rule_id, {'age': 4}))
+        for _ in range(2):
+            response = self.client.post(f'/rules/{rule_id}/evaluate_fast', {'data': {'name': 'a'}}, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_entries_expire(self):
+        rule_id = self.create('even', self.RULE)
+        version, compiled_rule = views.load_compiled_rule(rule_id)
+        key = rule_results.key(rule_id, version, compiled_rule, {'age': 4})
+        with mock.patch('main.cache.monotonic', return_value=1000.0):
+            rule_results.set(key, True)
+        with mock.patch('main.cache.monotonic', return_value=1000.0 + rule_results.ttl - 1):
+            self.assertTrue(rule_results.get(key))
+        with mock.patch('main.cache.monotonic', return_value=1000.0 + rule_results.ttl):
+            self.assertIsNone(rule_results.get(key))
@@ -8,5 +8,16 @@ router.register('rules',views.ruleStoreViewSet,basename='rules')
 
 urlpatterns=[
     path('rules/<int:rule_id>/evaluate',views.ruleEvaluate.as_view(),name='rule-evaluate'),
-    path('rules/combine_rules',views.CombineRules.as_view(),name='combine-rules')
+    path('rules/<int:rule_id>/evaluate_fast',views.ruleEvaluateFast.as_view(),name='rule-evaluate-fast'),
+    path('rules/<int:rule_id>/evaluate_batch',views.ruleEvaluateBatch.as_view(),name='rule-evaluate-batch'),
+    path('rules/evaluate_many',views.ruleEvaluateMany.as_view(),name='rule-evaluate-many'),
+    path('rules/match',views.ruleMatch.as_view(),name='rule-match'),
+    path('rules/combine_rules',views.CombineRules.as_view(),name='combine-rules'),
+    path('rules/import',views.ruleImport.as_view(),name='rule-import'),
+    path('rules/export',views.ruleExport.as_view(),name='rule-export'),
+    path('rules/<int:rule_id>/evaluate_async',views.ruleEvaluateAsync.as_view(),name='rule-evaluate-async'),
+    path('rules/<int:rule_id>/evaluate_batch_async',views.ruleEvaluateBatchAsync.as_view(),name='rule-evaluate-batch-async'),
+    path('rules/combine_rules_async',views.CombineRulesAsync.as_view(),name='combine-rules-async'),
+    path('rules/cache_stats',views.RuleCacheStats.as_view(),name='rule-cache-stats'),
+    path('metrics',views.RuleMetrics.as_view(),name='metrics')
 ]+router.urls
\ No newline at end of file
@@ -0,0 +1,141 @@
+from collections import namedtuple
+from datetime import date
+from functools import lru_cache
+import math
+
+# Typed condition constants and the coercion of input values.
+#
+# A condition "field op value" is parsed once into an Operand whose constant is an int, a float,
+# a date or a string, depending on how the value is written:
+#   - comparisons (>, <, >=, <=) take a number ("50000", "50000.5", "-3") or an ISO date
+#     ("2024-01-31"), quoted or not; anything else is rejected;
+#   - '=' takes a quoted value as a string ("department = 'Sales'") and an unquoted value as a
+#     number or date when it is written in canonical form ("age = 30"), otherwise as a string.
+# Conditions stay stored as their text, which is also their canonical encoding: the typed form is
+# a pure function of it, computed once per distinct condition and process.
+#
+# Records usually come from JSON or CSV, where dates (and sometimes numbers) are strings. A string
+# is converted only when it is the canonical text of a finite number or of a date
+# (str(converted) == text), so '=' tests on the text give the same answer before and after
+# conversion; "nan" and "inf" stay text, as they were before constants were typed. Conversion is
+# lazy: a predicate converts a string only when it is reached and the comparison needs it, so
+# records are never walked field by field up front.
+
+Operand = namedtuple('Operand', ('field', 'op', 'constant'))
+
+COMPARISON_OPERATORS = frozenset(('>', '<', '>=', '<='))
+TYPE_NAMES = {int: 'int', float: 'float', str: 'string', date: 'date'}
+
+
+def to_number(text):
+    # int or float for the canonical text of a finite number, text itself otherwise
+    for convert in (int, float):
+        try:
+            number = convert(text)
+        except ValueError:
+            continue
+        if str(number) == text and math.isfinite(number):
+            return number
+    return text
+
+
+def to_date(text):
+    # date for an ISO date written as YYYY-MM-DD, text itself otherwise
+    try:
+        value = date.fromisoformat(text)
+    except ValueError:
+        return text
+    return value if str(value) == text else text
+
+
+def to_value(text):
+    # Number or date for their canonical text, text itself otherwise
+    value = to_number(text)
+    return to_date(text) if value is text else value
+
+
+def parse_constant(op, text):
+    # Typed constant of a condition value as written in the rule (quotes included)
+    quoted = len(text) >= 2 and text[0] == text[-1] == "'"
+    value = text.strip("'")
+    if op == '=':
+        return value if quoted else to_value(value)
+    if op not in COMPARISON_OPERATORS:
+        raise ValueError(f"Unsupported operator: {op}")
+    for convert in (int, float):
+        try:
+            number = convert(value)
+        except ValueError:
+            continue
+        if math.isfinite(number):
+            return number
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid value {text} for '{op}': expected a number or a date") from None
+
+
+@lru_cache(maxsize=65536)
+def parse_operand(condition):
+    # Operand for a condition string such as "salary > 50000.5"; raises ValueError when the
+    # condition is malformed, its operator unknown or its value unusable with the operator
+    parts = condition.split()
+    if len(parts) != 3:
+        raise ValueError(f"Invalid condition format: {condition}")
+    field, op, value = parts
+    return Operand(field, op, parse_constant(op, value))
+
+
+def operand_key(operand):
+    # Hashable identity of an operand's meaning: 30 and 30.0 behave the same but report
+    # different errors for non-numeric input, so the constant's type is part of the key
+    return operand.field, operand.op, type(operand.constant), operand.constant
+
+
+def operand_json(condition):
+    # Structured form of a condition stored next to its text in rules.rule_ast, {} when it has none
+    try:
+        field, op, constant = parse_operand(condition)
+    except ValueError:
+        return {}
+    return {
+        'field': field,
+        'operator': op,
+        'constant': constant.isoformat() if isinstance(constant, date) else constant,
+        'type': TYPE_NAMES[type(constant)],
+    }
+
+
+def converter(constant):
+    # How input strings compared with constant are converted, None when they are not
+    if isinstance(constant, date):
+        return to_date
+    if isinstance(constant, (int, float)):
+        return to_number
+    return None
+
+
+class Schema:
+    # {field: converter} for the fields a rule compares with numbers or dates, used to convert
+    # text columns before a columnar evaluation
+    __slots__ = ('fields',)
+
+    def __init__(self, fields=None):
+        self.fields = fields or {}
+
+    @classmethod
+    def from_conditions(cls, conditions):
+        fields = {}
+        for condition in conditions:
+            if condition is None:
+                continue
+            try:
+                field, op, constant = parse_operand(condition)
+            except ValueError:
+                continue
+            convert = converter(constant)
+            if convert is None:
+                continue
+            # A field compared with both numbers and dates takes whichever its text is
+            fields[field] = convert if fields.get(field, convert) is convert else to_value
+        return cls(fields)
@@ -0,0 +1,142 @@
+from .compiler import COMPARATORS, CONSTANTS, TRUE, FALSE, compile_condition, parse_condition
+from .values import parse_operand
+
+try:
+    import numpy as np
+except ImportError:  # columnar evaluation is optional; the scalar engine does not need numpy
+    np = None
+
+# Columnar evaluation of a CompiledRule.
+#
+# Records arrive as column arrays ({"age": [...], "department": [...]}) and every condition
+# is evaluated once as a vectorized comparison producing a boolean mask. The masks are routed
+# through the rule's true/false jump targets, which is the same as combining them with &/|
+# along the AND/OR nodes, except that each condition only sees the rows evaluate_ast would
+# actually reach. That keeps the scalar short-circuit semantics: a row whose left operand
+# already decided an AND/OR never raises because of the right operand.
+# Columns of a single type are compared in numpy, mixed ones are kept as Python objects. Columns of
+# strings or mixed values (e.g. ISO dates from JSON) are first converted once through the rule's
+# Schema, and whatever numpy cannot compare directly runs the scalar predicate element by element,
+# so results always match the scalar engine.
+
+NUMERIC_KINDS = 'iuf'   # numpy dtype kinds compared directly with numbers
+
+
+def _require_numpy():
+    if np is None:
+        raise ValueError("Columnar evaluation requires numpy to be installed")
+
+
+def _column_array(values):
+    # A column as a numpy array holding the values as given. Only a column of one type numpy stores
+    # exactly (int, float, bool or str) becomes a typed array; anything mixed stays an object array,
+    # since numpy would change values (ints to floats, bools to ints, numbers to text)
+    if not isinstance(values, (list, tuple)):
+        return np.asarray(values)
+    kinds = set(map(type, values))
+    if len(kinds) == 1 and kinds <= {int, float, bool, str}:
+        array = np.asarray(values)
+        if array.dtype.kind in 'iufbU':
+            return array
+    if any(isinstance(value, (list, tuple)) for value in values):
+        raise ValueError("Columns must be one-dimensional arrays")
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+def _as_columns(columns, schema):
+    # Converts the input columns to numpy arrays and checks that they all have the same length.
+    # Text columns of fields in schema have their numbers and dates converted first
+    arrays = {}
+    length = None
+    for field, values in columns.items():
+        array = values if isinstance(values, np.ndarray) else _column_array(values)
+        convert = schema.fields.get(field)
+        if convert is not None and array.ndim == 1 and array.dtype.kind in 'UO':
+            converted = [convert(value) if type(value) is str else value for value in array.tolist()]
+            # Only all-int or all-float columns become numeric arrays; numpy would otherwise
+            # change values (ints to floats, bools to ints, numbers to text)
+            if set(map(type, converted)) in ({int}, {float}):
+                array = np.asarray(converted)
+            else:
+                array = np.empty(len(converted), dtype=object)
+                array[:] = converted
+        if array.ndim != 1:
+            raise ValueError(f"Column '{field}' must be a one-dimensional array")
+        if length is None:
+            length = len(array)
+        elif len(array) != length:
+            raise ValueError(f"Column '{field}' has {len(array)} rows, expected {length}")
+        arrays[field] = array
+    return arrays, length or 0
+
+
+def _condition_mask(condition, arrays, as_text, rows):
+    # Evaluates one condition over the selected rows (a boolean mask) and returns the result for those rows
+    if condition in CONSTANTS:
+        return np.full(int(rows.sum()), CONSTANTS[condition], dtype=bool)
+    field, op, value = parse_condition(condition)
+    if field not in arrays:
+        raise ValueError(f"Field '{field}' not present in input data")
+    constant = parse_operand(condition).constant  # raises like the scalar predicate would
+    array = arrays[field]
+    numeric = isinstance(constant, (int, float))
+
+    if op == '=':
+        if not numeric or array.dtype.kind == 'b':
+            # string comparison for equality, identical to str(data_value) == value
+            text = as_text.get(field)
+            if text is None:
+                text = as_text[field] = array.astype(str)
+            return text[rows] == value
+        if array.dtype.kind in NUMERIC_KINDS:
+            return array[rows] == constant
+        return _elementwise(condition, field, array[rows])
+    if numeric and array.dtype.kind in 'b' + NUMERIC_KINDS:
+        return np.asarray(COMPARATORS[op](array[rows], constant), dtype=bool)
+    return _elementwise(condition, field, array[rows])
+
+
+def _elementwise(condition, field, values):
+    # The scalar predicate on each value, for columns numpy cannot compare with the constant
+    predicate = compile_condition(condition)
+    return np.fromiter((predicate({field: value}) for value in values.tolist()), dtype=bool, count=len(values))
+
+
+def evaluate_columns(compiled, columns):
+    # Returns a boolean numpy array with one result per row, matching compiled.evaluate on each record
+    _require_numpy()
+    arrays, length = _as_columns(columns, compiled.schema)
+    result = np.zeros(length, dtype=bool)
+    if not compiled.conditions:
+        return result
+
+    conditions = compiled.conditions
+    on_true = compiled.on_true
+    on_false = compiled.on_false
+    reached = [None] * len(conditions)
+    reached[0] = np.ones(length, dtype=bool)
+    as_text = {}
+
+    def route(target, rows):
+        if target == TRUE:
+            result[rows] = True
+        elif target != FALSE:
+            reached[target] = rows if reached[target] is None else reached[target] | rows
+
+    # Jump targets always point forward, so one pass in leaf order sees every row a leaf can receive
+    for i, condition in enumerate(conditions):
+        rows = reached[i]
+        reached[i] = None
+        if rows is None or not rows.any():
+            continue
+        if condition is None:
+            outcome = np.zeros(int(rows.sum()), dtype=bool)
+        else:
+            outcome = _condition_mask(condition, arrays, as_text, rows)
+        true_rows = np.zeros(length, dtype=bool)
+        true_rows[rows] = outcome
+        route(on_true[i], true_rows)
+        route(on_false[i], rows & ~true_rows)
+    return result
@@ -1,21 +1,65 @@
 from django.shortcuts import render ,get_object_or_404
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.parsers import JSONParser
+from rest_framework.exceptions import ParseError
 from rest_framework import status
 from . import serializers
 from . import models
+from .parsers import NDJSONParser
+from .pagination import RuleCursorPagination
+from . import deepjson
+from . import fastjson
+from . import bulk
+from .cache import compiled_rules, compiled_rulesets, parsed_groups, rule_results, shared_rules
+from .compiler import CONSTANTS, compile_ast, compile_condition, compile_encoded, encode_compiled, CompiledRuleSet, PlannedRule
+from .values import operand_json, parse_operand
+from .statistics import rule_statistics
+from . import compact
+from django.conf import settings
+from django.db import connection
+from asgiref.sync import sync_to_async
+from django.db.models import F
+from .optimizer import optimize_ast
+from .compact import CompactAST
+from .vectorized import evaluate_columns
+from .matcher import rule_index
+from .metrics import metrics
+from time import perf_counter
 import re
+import io
 import json
+import logging
+import sys
 # Create your views here.
 
+logger = logging.getLogger(__name__)
+
 class Node:
+    # __slots__ drops the per-node __dict__; type and value strings are interned so the many
+    # copies of "operand", "AND" or "age > 30" across cached rules share one object
+    __slots__ = ('node_type', 'left', 'right', 'value', '_node_id')
+
     def __init__(self, node_type, left=None, right=None, value=None, node_id=None):
-        self.node_type = node_type  # "operator" or "operand"
+        self.node_type = sys.intern(node_type)  # "operator" or "operand"
         self.left = left            # Reference to left child (Node)
         self.right = right          # Reference to right child (Node)
-        self.value = value          # Value for operand nodes 
-        self.node_id = node_id or id(self)  # Unique identifier for each node
+        self.value = sys.intern(value) if isinstance(value, str) else value  # Value for operand nodes
+        self._node_id = node_id
+
+    @property
+    def node_id(self):
+        # Unique identifier for each node, computed on demand instead of stored
+        return self._node_id or id(self)
+
+    @node_id.setter
+    def node_id(self, node_id):
+        self._node_id = node_id
 
 
 
@@ -23,215 +67,336 @@ def ast_to_json(node):
     if node is None:
         return None
 
-    # Base case: Leaf node (operand)
-    if node.node_type == 'operand':
-        return {
-            'node_type': node.node_type,
-            'value': node.value
-        }
-
-    # Recursive case: Operator node (AND/OR)
-    return {
-        'node_type': node.node_type,
-        'value': node.value,
-        'left': ast_to_json(node.left),   # Recursively serialize the left child
-        'right': ast_to_json(node.right)  # Recursively serialize the right child
-    }
-
-def create_rule(rule_str):
-    tokens = re.findall(r"[\w']+|[()=><]|<=|>=", rule_str)
-    print(tokens)
-    stack = []
-    operators = ['AND', 'OR'] 
+    # Builds the nested dict top-down with an explicit stack, so deep trees don't hit the recursion limit
+    root = {}
+    stack = [(node, root)]
+    while stack:
+        node, output = stack.pop()
+        output['node_type'] = node.node_type
+        output['value'] = node.value
+        # Leaf node (operand) has no children; its field, operator and typed constant are stored with it
+        if node.node_type == 'operand':
+            output.update(operand_json(node.value))
+            continue
+        # Operator node (AND/OR): serialize the left and right children
+        for key, child in (('left', node.left), ('right', node.right)):
+            if child is None:
+                output[key] = None
+            else:
+                output[key] = {}
+                stack.append((child, output[key]))
+    return root
 
-    def create_operator_node(operator):
-        # Pop two operands (or subtrees) from the stack and create a new operator node
-        right = stack.pop()
-        left = stack.pop()
-        return Node(node_type='operator', left=left, right=right, value=operator)
-    
+def ast_to_rule_string(node):
+    # Rule string of an AST in the normalized form, every operator node but the root in parentheses,
+    # so it parses back to the same tree. TRUE / FALSE leaves (written by the optimizer) are kept as is
+    if node is None:
+        return ''
+    parts = []
+    stack = [(node, True)]
+    while stack:
+        item, root = stack.pop()
+        if isinstance(item, str):
+            parts.append(item)
+        elif item.node_type == 'operand':
+            parts.append(item.value)
+        else:
+            items = [item.left, f' {item.value} ', item.right]
+            if not root:
+                items = ['( ', *items, ' )']
+            stack.extend((part, False) for part in reversed(items))
+    return ''.join(parts)
+
+# Largest rule (in AST nodes) whose rule_ast create_rule pretty-prints. The pure-Python indenting
+# encoder is most of the time of creating or updating a large rule; the C encoder is ~6x faster
+PRETTY_PRINT_NODES = 512
+
+
+def dumps_ast(node, indent=4):
+    # JSON text stored in rules.rule_ast. Ordinary rules are pretty-printed as before; trees too deep
+    # for the stdlib encoder are written without indentation, which would grow quadratically with depth
+    ast_dict = ast_to_json(node)
+    try:
+        return json.dumps(ast_dict, indent=indent)
+    except RecursionError:
+        return deepjson.dumps(ast_dict)
+
+def loads_ast(rule_ast):
+    # Inverse of dumps_ast
+    return deserialize_ast(deepjson.loads(rule_ast))
+
+# Words, quoted words, numbers such as -3 or 50000.5 and ISO dates such as 2024-01-31
+TOKEN_PATTERN = re.compile(r"[\w'.-]+|<=|>=|[()=><]")
+COMPARISON_OPERATORS = ('=', '>', '<', '<=', '>=')
+# AND and OR have no precedence and a chain is grouped from the right, as the original parser grouped
+# top-level chains: "a AND b OR c" means "a AND (b OR c)", at the top level and inside parentheses
+# alike, so wrapping a rule in parentheses (combine_rules) or re-parsing it never changes its meaning
+LOGICAL_OPERATORS = ('AND', 'OR')
+
+
+@metrics.timed('parse')
+def create_rule(rule_str, cache_groups=True):
+    # Stack-based parser: every token is pushed and popped at most once, so parsing is linear in the
+    # size of the rule and needs no recursion for deeply nested groups. Operators are only reduced at
+    # a ')' or at the end, which groups every chain from the right
+    tokens = TOKEN_PATTERN.findall(rule_str)
+    logger.debug("Rule tokens: %s", tokens)
+    operands = []   # Nodes (operands or already built subtrees)
+    pending = []    # 'AND' / 'OR' / '(' waiting for their right-hand side
+    # Large groups are looked up in parsed_groups before being parsed, and stored once parsed.
+    # cache_groups=False (bulk import) leaves the cache alone: those rules are parsed once
+    use_cache = cache_groups and parsed_groups.enabled_for(tokens)
+    cached_groups = parsed_groups.groups(tokens) if use_cache else {}
+    group_starts = []  # token index of every '(' in pending
+
+    def reduce():
+        # Pops one operator and its two operands into a new operator node
+        operator = pending.pop()
+        right = operands.pop()
+        left = operands.pop()
+        operands.append(Node(node_type='operator', left=left, right=right, value=operator))
+
+    expect_operand = True
     i = 0
-    while i < len(tokens):
+    count = len(tokens)
+    while i < count:
         token = tokens[i]
+        if expect_operand:
+            if token == '(':
+                end = cached_groups.get(i)
+                if end is not None:
+                    subtree = parsed_groups.get(' '.join(tokens[i:end + 1]))
+                    if subtree is not None:
+                        operands.append(subtree)
+                        expect_operand = False
+                        i = end + 1
+                        continue
+                pending.append(token)
+                group_starts.append(i)
+                i += 1
+                continue
+            if token in CONSTANTS and (i + 1 == count or tokens[i + 1] not in COMPARISON_OPERATORS):
+                # TRUE / FALSE, as written by the optimizer into combined rules
+                operands.append(Node(node_type='operand', value=token))
+                expect_operand = False
+                i += 1
+                continue
+            # Process an operand: <field> <comparison operator> <value>
+            if (token not in LOGICAL_OPERATORS and token not in COMPARISON_OPERATORS and token != ')'
+                    and i + 2 < count and tokens[i + 1] in COMPARISON_OPERATORS
+                    and tokens[i + 2] not in COMPARISON_OPERATORS and tokens[i + 2] not in ('(', ')')):
+                condition = f"{token} {tokens[i + 1]} {tokens[i + 2]}"
+                try:
+                    parse_operand(condition)  # types the constant: int, float, date or string
+                except ValueError as error:
+                    return {'valid': False, 'content': str(error)}
+                operands.append(Node(node_type='operand', value=condition))
+                expect_operand = False
+                i += 3
+                continue
+            return {'valid': False, 'content': f"Invalid rule format at token '{token}': expected a comparison operator and value."}
 
-        if token == '(':
-            # Start of a new sub-expression, just push it to the stack
-            stack.append(token)
-        elif token == ')':
-            # Closing parenthesis means we need to pop until we find a matching '('
-            sub_expr = []
-            while stack and stack[-1] != '(':
-                sub_expr.append(stack.pop())
-            try:
-                stack.pop()  # Remove '('
-            except Exception:
-                raise ValueError(f"Invalid grouping of paranthesis") 
-
-            sub_expr.reverse()  # The sub_expr list will have nodes in reverse order
-
-            # Now process the sub-expression (contains a full expression like AND, OR)
-            while len(sub_expr) > 1:
-                left = sub_expr.pop(0)
-                operator = sub_expr.pop(0).value
-                right = sub_expr.pop(0)
-                stack.append(Node(node_type='operator', left=left, right=right, value=operator))
-        elif token in operators:
-            # Push the operator to the stack
-            stack.append(Node(node_type='operator', value=token))
+        if token == ')':
+            while pending and pending[-1] != '(':
+                reduce()
+            if not pending:
+                return {'valid': False, 'content': "Invalid grouping of paranthesis"}
+            pending.pop()  # Remove '('
+            start = group_starts.pop()
+            if cached_groups.get(start) == i:
+                parsed_groups.set(' '.join(tokens[start:i + 1]), operands[-1], i + 1 - start)
+        elif token in LOGICAL_OPERATORS:
+            pending.append(token)
+            expect_operand = True
         else:
-            # Process an operand
-            try:
-                operand = token
-                if i + 2 < len(tokens) and tokens[i + 1] in ['=', '>', '<' , '<=' , '>=']:
-                    operator = tokens[i + 1]
-                    comparison_value = tokens[i + 2]
-                    operand = f"{token} {operator} {comparison_value}"
-                    i += 2  # Skips over the operator and comparison value
-                    stack.append(Node(node_type='operand', value=operand))
-                else:
-                    # Invalid rule format, raise an error
-                    raise ValueError(f"Invalid rule format at token '{token}': expected a comparison operator and value.")
-            except ValueError as error:
-                return {'valid':False , 'content':str(error)}
-
-
+            return {'valid': False, 'content': f"Invalid rule format at token '{token}': expected AND, OR or ')'."}
         i += 1
 
-    # After processing all tokens, the stack should contain the complete AST
-    while len(stack) > 1:
-        right = stack.pop()
-        operator = stack.pop().value
-        left = stack.pop()
-        stack.append(Node(node_type='operator', left=left, right=right, value=operator))
+    if expect_operand:
+        if not tokens:
+            return {'valid': False, 'content': "Rule string is empty"}
+        return {'valid': False, 'content': f"Invalid rule format: expected a condition after '{tokens[-1]}'."}
 
-    rootnode = stack[0]  # The last item on the stack is the root of the AST
-    ast_dict = ast_to_json(rootnode)
-    return {'valid':True,'content':json.dumps(ast_dict, indent=4)}
+    # After processing all tokens, reduce whatever is left into the root of the AST
+    while pending:
+        if pending[-1] == '(':
+            return {'valid': False, 'content': "Invalid grouping of paranthesis"}
+        reduce()
 
+    rootnode, nodes_removed = optimize_ast(operands[0])
+    compact_ast = CompactAST.from_node(rootnode)
+    content = dumps_ast(rootnode, indent=4 if len(compact_ast) <= PRETTY_PRINT_NODES else None)
+    return {'valid':True,'content':content,'compact':compact_ast,'nodes_removed':nodes_removed}
 
 
+
+@metrics.timed('deserialize')
 def deserialize_ast(json_data):
     if not json_data:
         return None
-    
-    # Creates a node based on the current JSON object
-    node = Node(
-        node_type=json_data['node_type'],
-        value=json_data['value']
-    )
 
-    # If the node is an operator, recursively creating its left and right children
-    if node.node_type == 'operator':
-        node.left = deserialize_ast(json_data.get('left'))
-        node.right = deserialize_ast(json_data.get('right'))
-    
-    return node
+    # Creates nodes top-down with an explicit stack, attaching each child to its parent
+    root = Node(node_type=json_data['node_type'], value=json_data['value'])
+    stack = [(root, json_data)]
+    while stack:
+        node, data = stack.pop()
+        # If the node is an operator, creating its left and right children
+        if node.node_type != 'operator':
+            continue
+        for key in ('left', 'right'):
+            child_data = data.get(key)
+            if not child_data:
+                continue
+            child = Node(node_type=child_data['node_type'], value=child_data['value'])
+            setattr(node, key, child)
+            stack.append((child, child_data))
+    return root
 
 def evaluate_condition(condition, data):
-    # Split the condition (e.g., "age > 30")
-    print(f"Evaluating condition: {condition}")
-    
-    parts = condition.split()
-    if len(parts) != 3:
-        raise ValueError(f"Invalid condition format: {condition}")
-    field, operator, value = parts
-    value = value.strip("'")  # Removing  quotes if any (for string comparisons)
-    
-    # Retrieving the corresponding value from input data
-    if field not in data:
-        raise ValueError(f"Field '{field}' not present in input data")
-
-    # Converting the data value to the appropriate type for comparison
-    data_value = data[field]
-    
-    # Evaluate the condition based on the operator
-    if operator == '>':
-        return data_value > int(value)
-    elif operator == '<':
-        return data_value < int(value)
-    elif operator == '<=':
-        return data_value <= int(value)
-    elif operator == '>=':
-        return data_value >= int(value)
-    elif operator == '=':
-        return str(data_value) == value  # string comparison for equality
-    
-    else:
-        raise ValueError(f"Unsupported operator: {operator}")
+    # The condition (e.g., "age > 30") is parsed and its constant typed once per process;
+    # the cached predicate only looks up the field and compares
+    logger.debug("Evaluating condition: %s", condition)
+    return compile_condition(condition)(data)
 
-# Function to evaluate the AST tree recursively
+# Function to evaluate the AST tree with an explicit stack (no recursion limit on deep trees)
+@metrics.timed('evaluate_ast')
 def evaluate_ast(node, data):
     if node is None:
         return None
-    if node.node_type == 'operand':
-        # Leaf node: evaluate the condition
-        return evaluate_condition(node.value, data)
-    elif node.node_type == 'operator':
-        # Internal node: recursively evaluate the left and right subtrees
-        left_result = evaluate_ast(node.left, data)
-        
-        
-        # Combine the results based on the operator
-        if node.value == 'AND':
-            if not left_result:
-                return False
-            right_result = evaluate_ast(node.right, data)
-            return left_result and right_result
-        elif node.value == 'OR':
-            if left_result:
-                return True
-            right_result = evaluate_ast(node.right, data)
-            return left_result or right_result
+    result = None  # Result of the most recently evaluated subtree
+    stack = [(node, False)]
+    while stack:
+        node, left_done = stack.pop()
+        if node is None:
+            result = None
+        elif node.node_type == 'operand':
+            # Leaf node: evaluate the condition
+            result = evaluate_condition(node.value, data)
+        elif node.node_type == 'operator':
+            if not left_done:
+                # Internal node: evaluate the left subtree first, then come back to this node
+                stack.append((node, True))
+                stack.append((node.left, False))
+                continue
+            # result holds the left subtree's value; short-circuit or let the right subtree decide
+            if node.value == 'AND':
+                if not result:
+                    result = False
+                    continue
+            elif node.value == 'OR':
+                if result:
+                    result = True
+                    continue
+            else:
+                raise ValueError(f"Unsupported operator: {node.value}")
+            stack.append((node.right, False))
         else:
-            raise ValueError(f"Unsupported operator: {node.value}")
-    else:
-        raise ValueError(f"Invalid node type: {node.node_type}")
+            raise ValueError(f"Invalid node type: {node.node_type}")
+    return result
     
 
 def is_valid_parentheses(s):
-    stack = []
+    depth = 0
     # Traversing through each character of the string
     for char in s:
         if char == '(':
-            # Push opening parenthesis onto the stack
-            stack.append(char)
+            depth += 1
         elif char == ')':
-            # Pop the corresponding opening parenthesis if available
-            if not stack:
-                return False
-            stack.pop()
-    
-    # In the end, the stack should be empty if parentheses are balanced
-    if len(stack) != 0:
+            # A closing parenthesis without a matching opening one
+            if depth == 0:
+                raise ValueError("Invalid grouping of brackets")
+            depth -= 1
+
+    # In the end, every opening parenthesis should have been closed
+    if depth != 0:
         raise ValueError("Invalid grouping of brackets")
 
 def remove_redundant_parentheses(rule_str):
-    # Pattern to match redundant parentheses wrapping a logical expression
+    # Removes parentheses that directly surround another set of parentheses in a single pass
     # For example: ((age > 30 AND department)) -> (age > 30 AND department)
-    while True:
-        # Removing parentheses that directly surround another set of parentheses
-        new_str = re.sub(r'\(\s*\(([^()]+)\)\s*\)', r'(\1)', rule_str)
-        if new_str == rule_str:
-            break  # Exit loop if no further replacements are made
-        rule_str = new_str
-    return rule_str
+    # Expects the normalized form produced by ruleStoreViewSet, with tokens separated by single spaces
+    tokens = rule_str.split(' ')
+    match = {}
+    stack = []
+    for i, token in enumerate(tokens):
+        if token == '(':
+            stack.append(i)
+        elif token == ')' and stack:
+            opening = stack.pop()
+            match[opening] = i
+
+    redundant = set()
+    for opening, closing in match.items():
+        # The pair is redundant when the next pair starts right after it opens and ends right before it closes
+        if match.get(opening + 1) == closing - 1:
+            redundant.add(opening)
+            redundant.add(closing)
+    if not redundant:
+        return rule_str
+    return ' '.join(token for i, token in enumerate(tokens) if i not in redundant)
+
+
+def normalize_rule_string(rule_str):
+    # The form rules are parsed and stored in: tokens separated by single spaces, balanced
+    # parentheses (ValueError otherwise) and no redundant pairs of them.
+    # Regular expression to add spaces around operators, parentheses
+    formatted_string = re.sub(r'(<=|>=|[()><=])', r' \1 ', rule_str)
+
+    # Replace multiple spaces with a single space
+    formatted_string = re.sub(r'\s+', ' ', formatted_string).strip()
+    is_valid_parentheses(formatted_string)
+    return remove_redundant_parentheses(formatted_string)
+
+
+def prefix_upper_bound(prefix):
+    # Smallest string greater than every string starting with prefix, None when there is none
+    # (prefix made of U+10FFFF only). Text columns compare by code point (SQLite's BINARY collation)
+    prefix=prefix.rstrip(chr(0x10FFFF))
+    if not prefix:
+        return None
+    return prefix[:-1]+chr(ord(prefix[-1])+1)
+
 
 class ruleStoreViewSet(ModelViewSet):
+    # GET /rules/ is paginated on request (see RuleCursorPagination) and filtered by ?rule_name=
+    # (exact) or ?rule_name_prefix= (case-sensitive), both range scans of the (rule_name, id) index
     queryset=models.rules.objects.all()
     serializer_class=serializers.ruleStoreModelSerializer
-    def get_serializer_context(self):
-        serializer=serializers.ruleStoreModelSerializer(data=self.request.data)
-        if serializer.is_valid():
-            rule_string=self.request.data.get('rule_string',None)
+    pagination_class=RuleCursorPagination
+    # Columns the serializer outputs; reads skip the AST columns, which are most of a row
+    list_fields=('id','rule_name','rule_string')
+    # An update writes the AST columns without reading them
+    ast_fields=('rule_ast','rule_ast_compact','rule_ast_plan')
 
-            # Regular expression to add spaces around operators, parentheses
-            formatted_string = re.sub(r'([()><=])', r' \1 ', rule_string)
+    def get_queryset(self):
+        queryset=super().get_queryset()
+        if self.action in ('update','partial_update'):
+            return queryset.defer(*self.ast_fields)
+        if self.action not in ('list','retrieve'):
+            return queryset
+        queryset=queryset.only(*self.list_fields)
+        rule_name=self.request.query_params.get('rule_name')
+        if rule_name is not None:
+            queryset=queryset.filter(rule_name=rule_name)
+        prefix=self.request.query_params.get('rule_name_prefix')
+        if prefix:
+            # A range rather than startswith, which becomes a LIKE the index cannot serve
+            queryset=queryset.filter(rule_name__gte=prefix)
+            upper=prefix_upper_bound(prefix)
+            if upper is not None:
+                queryset=queryset.filter(rule_name__lt=upper)
+        return queryset
 
-            # Replace multiple spaces with a single space
-            formatted_string = re.sub(r'\s+', ' ', formatted_string).strip()
+    def get_serializer_context(self):
+        serializer=serializers.ruleStoreModelSerializer(data=self.request.data,partial=self.request.method=='PATCH')
+        if serializer.is_valid() and 'rule_string' in self.request.data:
+            rule_string=self.request.data.get('rule_string',None)
+            formatted_string=rule_string
             try:
-                is_valid_parentheses(formatted_string)
-                formatted_string=remove_redundant_parentheses(formatted_string)
+                formatted_string=normalize_rule_string(rule_string)
+                if formatted_string==self._stored_rule_string():
+                    # Same rule: the update keeps the stored AST, its version and every cached form
+                    return {'data':{'valid':True,'unchanged':True},'rule_string':formatted_string}
                 data=create_rule(formatted_string)
             except ValueError as e:
                  data = {'valid':False , 'content':str(e)}
@@ -247,16 +412,284 @@ class ruleStoreViewSet(ModelViewSet):
             '''
             return {'data':data ,'rule_string':formatted_string}
 
+    def _stored_rule_string(self):
+        # Normalized rule string of the rule being updated, None for other actions
+        if self.action not in ('update','partial_update'):
+            return None
+        lookup=self.kwargs.get(self.lookup_url_kwarg or self.lookup_field)
+        return models.rules.objects.filter(pk=lookup).values_list('rule_string',flat=True).first()
+
+
+@metrics.timed('compile')
+def compile_rule(rule):
+    # Compiles a rules row, using its evaluation plan when statistics have produced one
+    compiled = compile_ast(rule.compact_ast())
+    plan = rule.evaluation_plan()
+    if plan is not None:
+        compiled = PlannedRule(compiled, compile_ast(plan))
+    return compiled
+
+
+def _rule_version(rule_id):
+    # Current version of a stored rule, None when it does not exist. Runs on every evaluation: the
+    # shared cache answers when it can, otherwise the query is written once here instead of being
+    # compiled by the ORM per request
+    cached = shared_rules.versions([rule_id])
+    if rule_id in cached:
+        return cached[rule_id] or None
+    meta = models.rules._meta
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT {quote(meta.get_field('version').column)} FROM {quote(meta.db_table)} "
+            f"WHERE {quote(meta.pk.column)} = %s",
+            [rule_id],
+        )
+        row = cursor.fetchone()
+    shared_rules.remember_versions({rule_id: row[0] if row else 0})
+    return row[0] if row else None
+
+
+def _compile_missing(rule_id, version):
+    # (version, compiled rule) on a process cache miss: from the encoded AST another worker shared,
+    # or else from the database row, which is then shared in turn
+    payload = shared_rules.payloads([(rule_id, version)]).get((rule_id, version))
+    if payload is not None:
+        compiled = compile_encoded(*payload)
+    else:
+        rule = get_object_or_404(models.rules.objects.defer('rule_ast'), pk=rule_id)
+        compiled = compile_rule(rule)
+        version = rule.version
+        shared_rules.set_payloads({(rule_id, version): encode_compiled(compiled)})
+    compiled_rules.set(rule_id, version, compiled)
+    return version, compiled
+
+
+@metrics.timed('load')
+def load_compiled_rule(rule_id):
+    # Returns (version, compiled form) of a stored rule, parsing and compiling the stored AST only on a cache miss.
+    # Only the version is read on a hit; a bumped version makes the cached entry a miss.
+    version = _rule_version(rule_id)
+    if version is None:
+        raise Http404(f"No rule matches the given id {rule_id}")
+    compiled = compiled_rules.get(rule_id, version)
+    if compiled is None:
+        return _compile_missing(rule_id, version)
+    return version, compiled
+
+
+async def aload_compiled_rule(rule_id):
+    # load_compiled_rule for the async views. A rule whose version was checked in the last
+    # RULE_ASYNC_VERSION_TTL seconds is served from the process cache without a probe; otherwise the
+    # probe and cache misses (shared cache, database) run in the request's sync thread, so the event
+    # loop never waits on them
+    start = perf_counter()
+    try:
+        recent = compiled_rules.recent(rule_id)
+        if recent is not None:
+            return recent
+        version = await sync_to_async(_rule_version)(rule_id)
+        if version is None:
+            raise Http404(f"No rule matches the given id {rule_id}")
+        compiled = compiled_rules.get(rule_id, version)
+        if compiled is None:
+            return await sync_to_async(_compile_missing)(rule_id, version)
+        return version, compiled
+    finally:
+        metrics.observe('load', perf_counter() - start)
+
+
+def save_evaluation_plan(rule_id, version, compiled):
+    # Stores a reordered plan for the rule when its statistics justify one. The update only applies
+    # to the version the plan was computed from and bumps it, so every process recompiles the rule
+    plan = rule_statistics.plan(rule_id, compiled)
+    if plan is None:
+        return False
+    updated = models.rules.objects.filter(pk=rule_id, version=version).update(
+        rule_ast_plan=compact.encode(plan), version=F('version') + 1
+    )
+    compiled_rules.invalidate(rule_id)
+    rule_results.invalidate(rule_id)
+    shared_rules.changed(rule_id)
+    rule_index.invalidate(rule_id)
+    return bool(updated)
+
+
+def _timed_evaluate(rule_id, compiled, data):
+    # compiled.evaluate(data), timed for the metrics once every metrics.sample_every calls
+    weight = metrics.evaluation_weight()
+    if not weight:
+        return compiled.evaluate(data)
+    start = perf_counter()
+    try:
+        return compiled.evaluate(data)
+    finally:
+        elapsed = perf_counter() - start
+        metrics.observe('evaluate', elapsed, weight)
+        metrics.rule_evaluated(rule_id, elapsed * weight, weight)
+
+
+def evaluate_rule(rule_id, version, compiled, data):
+    # compiled.evaluate(data), profiling a sample of the calls for rule_statistics.
+    # A record evaluated before is answered from rule_results when the result cache is enabled
+    key = rule_results.key(rule_id, version, compiled, data)
+    if key is not None:
+        result = rule_results.get(key)
+        if result is not None:
+            return result
+    if rule_statistics.should_sample() and rule_statistics.record(rule_id, compiled, data):
+        save_evaluation_plan(rule_id, version, compiled)
+    result = _timed_evaluate(rule_id, compiled, data)
+    if key is not None:
+        rule_results.set(key, result)
+    return result
+
+
+async def aevaluate_rule(rule_id, version, compiled, data):
+    # evaluate_rule for the async views; only storing a new plan touches the database
+    key = rule_results.key(rule_id, version, compiled, data)
+    if key is not None:
+        result = rule_results.get(key)
+        if result is not None:
+            return result
+    if rule_statistics.should_sample() and rule_statistics.record(rule_id, compiled, data):
+        await sync_to_async(save_evaluation_plan)(rule_id, version, compiled)
+    result = _timed_evaluate(rule_id, compiled, data)
+    if key is not None:
+        rule_results.set(key, result)
+    return result
+
+
+@metrics.timed('load_many')
+def load_compiled_rules(rule_ids=None):
+    # Bulk version of load_compiled_rule for a list of ids (every stored rule when None).
+    # Returns {rule_id: CompiledRule} in the requested order; versions and cache misses not in the
+    # shared cache are fetched in one query each
+    if rule_ids is None:
+        versions = dict(models.rules.objects.values_list('id', 'version'))
+        rule_ids = sorted(versions)
+    else:
+        versions = shared_rules.versions(rule_ids)
+        unknown = [rule_id for rule_id in rule_ids if rule_id not in versions]
+        if unknown:
+            stored = dict(models.rules.objects.filter(pk__in=unknown).values_list('id', 'version'))
+            shared_rules.remember_versions({rule_id: stored.get(rule_id, 0) for rule_id in unknown})
+            versions.update(stored)
+        versions = {rule_id: version for rule_id, version in versions.items() if version}
+    missing = [rule_id for rule_id in rule_ids if rule_id not in versions]
+    if missing:
+        raise Http404(f"No rules match the given ids {missing}")
+
+    compiled_by_id = {}
+    to_load = []
+    for rule_id in rule_ids:
+        compiled = compiled_rules.get(rule_id, versions[rule_id])
+        if compiled is None:
+            to_load.append(rule_id)
+        compiled_by_id[rule_id] = compiled
+    if not to_load:
+        return compiled_by_id, versions
+
+    shared = shared_rules.payloads([(rule_id, versions[rule_id]) for rule_id in to_load])
+    for (rule_id, version), payload in shared.items():
+        compiled = compile_encoded(*payload)
+        compiled_rules.set(rule_id, version, compiled)
+        compiled_by_id[rule_id] = compiled
+    fetched = {}
+    to_fetch = [rule_id for rule_id in to_load if (rule_id, versions[rule_id]) not in shared]
+    for rule in models.rules.objects.defer('rule_ast').filter(pk__in=to_fetch):
+        compiled = compile_rule(rule)
+        compiled_rules.set(rule.id, rule.version, compiled)
+        compiled_by_id[rule.id] = compiled
+        fetched[(rule.id, rule.version)] = encode_compiled(compiled)
+    shared_rules.set_payloads(fetched)
+    return compiled_by_id, versions
+
+
+def sample_batch(rule_id, version, compiled, records):
+    # Profiles a sample of the records for rule_statistics up front, keeping evaluate_batch's loop
+    # untouched; may store a new evaluation plan
+    for index in rule_statistics.sample_positions(len(records)):
+        if not isinstance(records[index], Exception) and rule_statistics.record(rule_id, compiled, records[index]):
+            save_evaluation_plan(rule_id, version, compiled)
+
+
+def evaluate_batch(rule_id, compiled, records):
+    # Returns (results, errors) for a list of records; a record that fails to evaluate (or is an
+    # exception standing in for an undecodable record) gets None and an {'index', 'error'} entry
+    start = perf_counter()
+    evaluate = compiled.evaluate
+    results = []
+    errors = []
+    for index, record in enumerate(records):
+        try:
+            if isinstance(record, Exception):
+                raise record
+            results.append(evaluate(record))
+        except (ValueError, KeyError, TypeError) as error:
+            results.append(None)
+            errors.append({'index': index, 'error': str(error)})
+    elapsed = perf_counter() - start
+    metrics.observe('evaluate_batch', elapsed)
+    metrics.rule_evaluated(rule_id, elapsed, len(records))
+    return results, errors
+
+
+def evaluate_rule_columns(rule_id, compiled, columns):
+    # evaluate_columns, recorded like a batch of as many records as rows
+    start = perf_counter()
+    results = evaluate_columns(compiled, columns)
+    elapsed = perf_counter() - start
+    metrics.observe('evaluate_columns', elapsed)
+    metrics.rule_evaluated(rule_id, elapsed, len(results))
+    return results
+
+
+@metrics.timed('evaluate_many')
+def evaluate_many(data, rule_ids=None):
+    # Evaluates one record against many stored rules, evaluating each distinct condition at most once.
+    # Returns (matching rule ids, {rule_id: error message})
+    compiled_by_id, versions = load_compiled_rules(rule_ids)
+    key = tuple(compiled_by_id)
+    version = tuple(versions[rule_id] for rule_id in key)
+    ruleset = compiled_rulesets.get(key, version)
+    if ruleset is None:
+        ruleset = CompiledRuleSet(compiled_by_id)
+        compiled_rulesets.set(key, version, ruleset)
+    return ruleset.evaluate(data)
+
+
+def _load_rules_for_index(rule_ids):
+    # Loader for rule_index.sync: every stored rule when rule_ids is None
+    rows = models.rules.objects.defer('rule_ast')
+    if rule_ids is not None:
+        rows = rows.filter(pk__in=rule_ids)
+    for rule in rows.iterator():
+        compiled = compiled_rules.get(rule.id, rule.version) or compile_rule(rule)
+        yield rule.id, rule.version, compiled
+
+
+@metrics.timed('match')
+def match_rules(data):
+    # Matches one record against the whole rule store through the discrimination network.
+    # Returns (sorted matching rule ids, {rule_id: error}) for the rules that had to be evaluated.
+    # A new shared generation means some worker changed a rule: the stored versions tell which.
+    # Without version keys the cache is per process (locmem), so its generation misses changes made
+    # by other workers, import_rules or raw SQL, and the stored versions are compared on every call
+    generation = shared_rules.generation()
+    if generation != rule_index.generation or not shared_rules.version_timeout:
+        rule_index.refresh(dict(models.rules.objects.values_list('id', 'version')), generation)
+    rule_index.sync(_load_rules_for_index)
+    return rule_index.match(data)
+
 
 class ruleEvaluate(APIView):
     def post(self, request, rule_id):
         try:
             serializer = serializers.ruleEvaluvateSerializer(data=request.data)
             serializer.is_valid(raise_exception=True)
-            rule_ast = get_object_or_404(models.rules, pk=rule_id).rule_ast
-            print(rule_ast)  
-            root_node = deserialize_ast(json.loads(rule_ast))
-            result = evaluate_ast(root_node, serializer.validated_data['data'])
+            version, compiled = load_compiled_rule(rule_id)
+            result = evaluate_rule(rule_id, version, compiled, serializer.validated_data['data'])
             return Response({'result': result}, status=status.HTTP_200_OK)
         
         except ValueError as ve:
@@ -270,20 +703,118 @@ class ruleEvaluate(APIView):
             return Response({'error': f"An unexpected error occurred: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         '''
+
+
+def _json_response(payload, status_code=200):
+    return HttpResponse(fastjson.dumps(payload), status=status_code, content_type='application/json')
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ruleEvaluateFast(View):
+    # Lean version of ruleEvaluate for high request rates: the body is decoded and the response
+    # encoded with fastjson (orjson when installed) and the record is passed to the rule as is,
+    # skipping DRF's request parsing, serializer validation and content negotiation.
+    # Same request ({"data": {...}}) and response ({"result": true|false}) as ruleEvaluate
+    http_method_names = ['post']
+
+    def post(self, request, rule_id):
+        try:
+            payload = fastjson.loads(request.body)
+        except ValueError as error:
+            return _json_response({'error': f"Invalid JSON: {error}"}, 400)
+        if not isinstance(payload, dict) or 'data' not in payload:
+            return _json_response({'data': ['This field is required.']}, 400)
+        try:
+            version, compiled = load_compiled_rule(rule_id)
+        except Http404 as error:
+            return _json_response({'detail': str(error)}, 404)
+        try:
+            result = evaluate_rule(rule_id, version, compiled, payload['data'])
+        except (ValueError, TypeError) as error:
+            return _json_response({'error': str(error)}, 400)
+        except KeyError as error:
+            return _json_response({'error': f"Missing field: {error}"}, 400)
+        logger.debug("Evaluated rule %s: %s", rule_id, result)
+        return _json_response({'result': result})
+
+
+class ruleEvaluateBatch(APIView):
+    # Evaluates one rule against many records: {"data": [...]}, a bare JSON array or an NDJSON body.
+    # {"columns": {"field": [...]}} switches to the numpy columnar engine, one vectorized pass per condition
+    parser_classes = [JSONParser, NDJSONParser]
+
+    def post(self, request, rule_id):
+        payload = request.data
+        if isinstance(payload, list):
+            payload = {'data': payload}
+        serializer = serializers.ruleBatchEvaluvateSerializer(data=payload)
+        serializer.is_valid(raise_exception=True)
+        version, compiled = load_compiled_rule(rule_id)
+        if 'columns' in serializer.validated_data:
+            try:
+                results = evaluate_rule_columns(rule_id, compiled, serializer.validated_data['columns'])
+            except (ValueError, KeyError, TypeError) as error:
+                return Response({'error': str(error)}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({'results': results.tolist(), 'errors': []}, status=status.HTTP_200_OK)
+
+        records = serializer.validated_data['data']
+        sample_batch(rule_id, version, compiled, records)
+        results, errors = evaluate_batch(rule_id, compiled, records)
+        return Response({'results': results, 'errors': errors}, status=status.HTTP_200_OK)
+
+
+class ruleEvaluateMany(APIView):
+    def post(self, request):
+        serializer = serializers.ruleEvaluateManySerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        matches, errors = evaluate_many(serializer.validated_data['data'], serializer.validated_data.get('ids'))
+        return Response({'matches': matches, 'errors': errors}, status=status.HTTP_200_OK)
+
+
+class ruleMatch(APIView):
+    def post(self, request):
+        serializer = serializers.ruleEvaluvateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data['data']
+        if not isinstance(data, dict):
+            return Response({'error': 'data must be a JSON object'}, status=status.HTTP_400_BAD_REQUEST)
+        matches, errors = match_rules(data)
+        return Response({'matches': matches, 'errors': errors}, status=status.HTTP_200_OK)
+
+
+class RuleCacheStats(APIView):
+    def get(self, request):
+        return Response(compiled_rules.stats(), status=status.HTTP_200_OK)
+
         
+class RuleMetrics(View):
+    # Prometheus scrape endpoint: stage latency histograms, per-rule evaluation counts and times,
+    # and the compiled-rule, parsed-group and result cache counters of this process (see main.metrics)
+    http_method_names = ['get']
+
+    def get(self, request):
+        text = metrics.render({
+            'compiled_rules': compiled_rules.stats(),
+            'compiled_rulesets': compiled_rulesets.stats(),
+            'parsed_groups': parsed_groups.stats(),
+            'rule_results': rule_results.stats(),
+        })
+        return HttpResponse(text, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 class RuleCombiner:
     def __init__(self, rule_ids):
         self.rule_ids = rule_ids
         self.rules = self._retrieve_rules_by_ids()
 
     def _retrieve_rules_by_ids(self):
-        # Fetches rules from the database by their IDs and deserialize the AST
-        rules_ast = []
-        for rule_id in self.rule_ids:
-            rule = get_object_or_404(models.rules, pk=rule_id)
-            rule_ast = deserialize_ast(json.loads(rule.rule_ast))
-            rules_ast.append(rule_ast)
-        return rules_ast
+        # Fetches all the rules in one query and deserializes each distinct AST once
+        rules = models.rules.objects.defer('rule_ast').in_bulk(set(self.rule_ids))
+        missing = [rule_id for rule_id in self.rule_ids if rule_id not in rules]
+        if missing:
+            raise Http404(f"No rules match the given ids {missing}")
+        trees = {rule_id: rule.compact_ast().to_node(Node) for rule_id, rule in rules.items()}
+        return [trees[rule_id] for rule_id in self.rule_ids]
 
     def _find_frequent_operator(self):
         # Counts the frequency of 'AND' and 'OR' operators in the AST
@@ -293,34 +824,54 @@ class RuleCombiner:
         return "AND" if operator_count["AND"] > operator_count["OR"] else "OR"
 
     def _count_operators(self, node, operator_count):
-        if node.node_type == "operator":
-            operator_count[node.value] += 1
-            if node.left:
-                self._count_operators(node.left, operator_count)
-            if node.right:
-                self._count_operators(node.right, operator_count)
+        # Explicit stack instead of recursion, combined rules can be thousands of levels deep
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.node_type == "operator":
+                operator_count[node.value] += 1
+                if node.left:
+                    stack.append(node.left)
+                if node.right:
+                    stack.append(node.right)
 
     def _merge_rules(self, frequent_operator):
-        # Starts with the first rule and combine the rest one by one
-        combined_ast = self.rules[0]  # Start with the first AST
-        combined_rule_string = models.rules.objects.get(pk=self.rule_ids[0]).rule_string
-        for i in range(1, len(self.rules)):
-            new_root = Node(node_type="operator", value=frequent_operator)
-            new_root.left = combined_ast  # Left subtree is the current combined AST
-            new_root.right = self.rules[i]  # Right subtree is the next rule's AST
-            combined_ast = new_root
-            current_rule_string=models.rules.objects.get(pk=self.rule_ids[i]).rule_string
-            combined_rule_string = f"({combined_rule_string} {frequent_operator} ({current_rule_string}))"
+        # Combines the rules as a balanced tree, so the result is only log2(N) levels deeper
+        # than its deepest rule. The rule string is written from the merged tree rather than from
+        # the stored strings, fully parenthesized, so create_rule turns it back into the stored AST
+        def merge(start, end):
+            if end - start == 1:
+                return self.rules[start]
+            middle = (start + end) // 2
+            return Node(node_type="operator", left=merge(start, middle), right=merge(middle, end), value=frequent_operator)
 
-        return combined_ast,combined_rule_string
+        combined_ast = merge(0, len(self.rules))
+        return combined_ast, ast_to_rule_string(combined_ast)
 
+    @metrics.timed('combine')
     def combine_rules(self):
         frequent_operator = self._find_frequent_operator()
-        print(f'frequent_operator:{frequent_operator}')  # Get the most frequent operator
+        logger.debug("Combining %d rules with frequent operator %s", len(self.rules), frequent_operator)
         combined_ast,combined_rule_string = self._merge_rules(frequent_operator)  # Merges rules
+        combined_ast,self.nodes_removed = optimize_ast(combined_ast)  # Drops duplicate and subsumed conditions
         return combined_ast,combined_rule_string
 
 
+def combine_and_save(rule_ids, rule_name):
+    # Combines the stored rules into a new stored rule; returns (new rule, nodes removed by the optimizer)
+    combiner = RuleCombiner(rule_ids)
+    combined_ast, combined_rule_string = combiner.combine_rules()
+    # Serialize the combined AST to JSON, unindented: the pure-Python indenting encoder
+    # dominates the request time for combinations of thousands of rules
+    combined_rule_ast_json = dumps_ast(combined_ast, indent=None)
+
+    # Create a new rule in the database with the combined AST
+    new_rule = models.rules(rule_name=rule_name, rule_string=combined_rule_string)
+    new_rule.set_ast(combined_rule_ast_json, CompactAST.from_node(combined_ast))
+    new_rule.save()
+    return new_rule, combiner.nodes_removed
+
+
 class CombineRules(APIView):
     def post(self,request):
         serializer = serializers.ruleCombineSerializer(data=request.data)
@@ -328,25 +879,149 @@ class CombineRules(APIView):
         rule_ids=serializer.validated_data['ids']
         rule_name=serializer.validated_data['rule_name']
 
-    #try:
-        # Initialize the RuleCombiner and combine rules
-        combiner=RuleCombiner(rule_ids)
-        combined_ast,combined_rule_string=combiner.combine_rules()
-            # Serialize the combined AST to JSON
-        combined_rule_ast_json=json.dumps(ast_to_json(combined_ast), indent=4)
-
-    # Create a new rule in the database with the combined AST
-        new_rule = models.rules.objects.create(
-            rule_name=rule_name,
-            rule_string=combined_rule_string,
-            rule_ast=combined_rule_ast_json
-        )
-
-        return Response({"new_rule_id": new_rule.id}, status=status.HTTP_201_CREATED)
+        new_rule, nodes_removed = combine_and_save(rule_ids, rule_name)
+        return Response({"new_rule_id": new_rule.id, "nodes_removed": nodes_removed}, status=status.HTTP_201_CREATED)
 
     # except Exception as e:
     #     return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ruleImport(View):
+    # Bulk import of an NDJSON body, one {"rule_name": ..., "rule_string": ...} per line (see main.bulk).
+    # The body is read line by line, so its size is not limited by DATA_UPLOAD_MAX_MEMORY_SIZE.
+    # Returns {"created": n, "ids": [...], "errors": [{"line": n, "error": "..."}]}: 201 when at least
+    # one rule was created, 400 otherwise. Batches committed before an invalid line stay committed
+    http_method_names = ['post']
+
+    def post(self, request):
+        ids = []
+        errors = []
+        batch_size = getattr(settings, 'RULE_IMPORT_BATCH_SIZE', 500)
+        workers = getattr(settings, 'RULE_IMPORT_WORKERS', 1)
+        for created, batch_errors in bulk.import_rules(request, batch_size=batch_size, workers=workers):
+            ids += created
+            errors += [{'line': line_number, 'error': error} for line_number, error in batch_errors]
+        if not ids and not errors:
+            errors.append({'line': None, 'error': "The body has no rules"})
+        return _json_response({'created': len(ids), 'ids': ids, 'errors': errors}, 201 if ids else 400)
+
+
+class ruleExport(View):
+    # Streams every stored rule as NDJSON ({"id": ..., "rule_name": ..., "rule_string": ...} per line),
+    # reading RULE_EXPORT_BATCH_SIZE rows per query; the output can be posted to /rules/import
+    http_method_names = ['get']
+
+    def get(self, request):
+        rows = bulk.export_rules(batch_size=getattr(settings, 'RULE_EXPORT_BATCH_SIZE', 1000))
+        response = StreamingHttpResponse(rows, content_type=NDJSONParser.media_type)
+        response['Content-Disposition'] = 'attachment; filename="rules.ndjson"'
+        return response
+
+
+# Async views, for deployments behind an ASGI server (ruleEngineApplication.asgi).
+# They take the same requests and give the same responses as evaluate_fast, evaluate_batch and
+# combine_rules. Database work goes through the async ORM or sync_to_async, which Django runs in a
+# thread per request, and longer CPU work (batches, combining) is handed to that thread too, so one
+# worker process keeps many requests in flight while others wait on the database or the network.
+# DRF's APIView has no async support, so these are plain Django views encoding JSON with fastjson.
+
+def _read_json(request):
+    # (payload, None) for a JSON body, (None, error response) otherwise
+    try:
+        return fastjson.loads(request.body), None
+    except ValueError as error:
+        return None, _json_response({'error': f"Invalid JSON: {error}"}, 400)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ruleEvaluateAsync(View):
+    # Async evaluate_fast: {"data": {...}} -> {"result": true|false}
+    http_method_names = ['post']
+
+    async def post(self, request, rule_id):
+        payload, error_response = _read_json(request)
+        if error_response is not None:
+            return error_response
+        if not isinstance(payload, dict) or 'data' not in payload:
+            return _json_response({'data': ['This field is required.']}, 400)
+        try:
+            version, compiled = await aload_compiled_rule(rule_id)
+        except Http404 as error:
+            return _json_response({'detail': str(error)}, 404)
+        try:
+            result = await aevaluate_rule(rule_id, version, compiled, payload['data'])
+        except (ValueError, TypeError) as error:
+            return _json_response({'error': str(error)}, 400)
+        except KeyError as error:
+            return _json_response({'error': f"Missing field: {error}"}, 400)
+        logger.debug("Evaluated rule %s: %s", rule_id, result)
+        return _json_response({'result': result})
+
+
+def _batch_results(rule_id, data):
+    # The body of ruleEvaluateBatch for a validated payload, run off the event loop in one hop:
+    # loading the rule there too saves a second thread switch per request
+    try:
+        version, compiled = load_compiled_rule(rule_id)
+    except Http404 as error:
+        return {'detail': str(error)}, 404
+    if 'columns' in data:
+        try:
+            results = evaluate_rule_columns(rule_id, compiled, data['columns'])
+        except (ValueError, KeyError, TypeError) as error:
+            return {'error': str(error)}, 400
+        return {'results': results.tolist(), 'errors': []}, 200
+    records = data['data']
+    sample_batch(rule_id, version, compiled, records)
+    results, errors = evaluate_batch(rule_id, compiled, records)
+    return {'results': results, 'errors': errors}, 200
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ruleEvaluateBatchAsync(View):
+    # Async evaluate_batch: {"data": [...]}, a bare JSON array, an NDJSON body or {"columns": {...}}
+    http_method_names = ['post']
+
+    async def post(self, request, rule_id):
+        if request.content_type == NDJSONParser.media_type:
+            try:
+                payload = NDJSONParser().parse(io.BytesIO(request.body), parser_context={'encoding': request.encoding or settings.DEFAULT_CHARSET})
+            except ParseError as error:
+                return _json_response({'detail': str(error.detail)}, 400)
+        else:
+            payload, error_response = _read_json(request)
+            if error_response is not None:
+                return error_response
+        if isinstance(payload, list):
+            payload = {'data': payload}
+        serializer = serializers.ruleBatchEvaluvateSerializer(data=payload)
+        if not serializer.is_valid():
+            return _json_response(serializer.errors, 400)
+        body, status_code = await sync_to_async(_batch_results)(rule_id, serializer.validated_data)
+        return _json_response(body, status_code)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class CombineRulesAsync(View):
+    # Async combine_rules: {"rule_name": ..., "ids": [...]} -> {"new_rule_id", "nodes_removed"}
+    http_method_names = ['post']
+
+    async def post(self, request):
+        payload, error_response = _read_json(request)
+        if error_response is not None:
+            return error_response
+        serializer = serializers.ruleCombineSerializer(data=payload)
+        if not serializer.is_valid():
+            return _json_response(serializer.errors, 400)
+        try:
+            new_rule, nodes_removed = await sync_to_async(combine_and_save)(
+                serializer.validated_data['ids'], serializer.validated_data['rule_name']
+            )
+        except Http404 as error:
+            return _json_response({'detail': str(error)}, 404)
+        return _json_response({"new_rule_id": new_rule.id, "nodes_removed": nodes_removed}, 201)
+
             
 
         
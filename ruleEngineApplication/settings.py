@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 import os
 from dotenv import load_dotenv
 
@@ -46,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.middleware.RequestProfilerMiddleware',  # outermost so a profile covers the whole request; off by default
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -130,3 +132,125 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Rule engine
+# Maximum number of compiled rule ASTs kept in each process (LRU eviction beyond this)
+
+RULE_CACHE_SIZE = int(os.getenv('RULE_CACHE_SIZE', 1024))
+
+# Tokens of parsed rule groups kept in each process so rule updates only re-parse the edited groups (0 disables);
+# about 46 bytes per token, so the default holds the groups of a few 1,000-condition rules in ~2 MB
+RULE_PARSE_CACHE_TOKENS = int(os.getenv('RULE_PARSE_CACHE_TOKENS', 50000))
+
+# Cache shared by the worker processes for rule versions and encoded ASTs (see main.cache.SharedRuleCache).
+# RULE_CACHE_BACKEND selects 'locmem' (per process; the default, and what tests use), 'file' (a directory
+# shared by the workers of one host) or 'redis' (needs the redis package); RULE_CACHE_LOCATION overrides
+# the directory / server URL
+
+RULE_CACHE_BACKEND = os.getenv('RULE_CACHE_BACKEND', 'locmem')
+RULE_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'rules',
+        'OPTIONS': {'MAX_ENTRIES': 4 * RULE_CACHE_SIZE},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': str(BASE_DIR / '.rule_cache'),
+        'OPTIONS': {'MAX_ENTRIES': 4 * RULE_CACHE_SIZE},
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379',
+    },
+}
+if RULE_CACHE_BACKEND not in RULE_CACHE_BACKENDS:
+    raise ImproperlyConfigured(f"RULE_CACHE_BACKEND must be one of {', '.join(RULE_CACHE_BACKENDS)}")
+
+RULE_CACHE_ALIAS = 'rules'
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    RULE_CACHE_ALIAS: {
+        **RULE_CACHE_BACKENDS[RULE_CACHE_BACKEND],
+        'TIMEOUT': None,  # encoded ASTs are keyed by version and never go stale
+        'KEY_PREFIX': 'rule-engine',
+    },
+}
+if os.getenv('RULE_CACHE_LOCATION'):
+    CACHES[RULE_CACHE_ALIAS]['LOCATION'] = os.getenv('RULE_CACHE_LOCATION')
+
+# Seconds a rule version read from the shared cache is trusted instead of asking the database.
+# 0 (always ask) by default with locmem, where a worker never sees the other workers' saves
+
+RULE_VERSION_TIMEOUT = int(os.getenv('RULE_VERSION_TIMEOUT', 0 if RULE_CACHE_BACKEND == 'locmem' else 300))
+
+# Seconds the async views trust a compiled rule whose version was checked that recently, instead of
+# probing the version on every request. Saves in the same process are seen at once, saves made by other
+# workers within this many seconds. 0 probes on every request, as the sync views do
+
+RULE_ASYNC_VERSION_TTL = float(os.getenv('RULE_ASYNC_VERSION_TTL', 1))
+
+# Per-process cache of evaluation results keyed by rule version and the values of the fields the rule
+# reads, for traffic that repeats records: RULE_RESULT_CACHE_SIZE entries at most (0, the default,
+# disables it), each kept RULE_RESULT_CACHE_TTL seconds (0 keeps them until evicted)
+
+RULE_RESULT_CACHE_SIZE = int(os.getenv('RULE_RESULT_CACHE_SIZE', 0))
+RULE_RESULT_CACHE_TTL = int(os.getenv('RULE_RESULT_CACHE_TTL', 300))
+
+# Bulk import (/rules/import, manage.py import_rules) parses and inserts RULE_IMPORT_BATCH_SIZE lines
+# per transaction, on RULE_IMPORT_WORKERS processes (1 parses in the request's process, 0 uses every
+# CPU); export reads RULE_EXPORT_BATCH_SIZE rows per query
+
+RULE_IMPORT_BATCH_SIZE = int(os.getenv('RULE_IMPORT_BATCH_SIZE', 500))
+RULE_IMPORT_WORKERS = int(os.getenv('RULE_IMPORT_WORKERS', 1))
+RULE_EXPORT_BATCH_SIZE = int(os.getenv('RULE_EXPORT_BATCH_SIZE', 1000))
+
+# One rule evaluation in RULE_STATS_SAMPLE_EVERY is profiled for cost/selectivity statistics (0 disables),
+# on a window of RULE_STATS_LEAVES_PER_SAMPLE conditions that moves on with every profiled record;
+# a rule is re-planned once each of its conditions has about RULE_PLAN_MIN_SAMPLES profiled runs
+
+RULE_STATS_SAMPLE_EVERY = int(os.getenv('RULE_STATS_SAMPLE_EVERY', 64))
+RULE_STATS_LEAVES_PER_SAMPLE = int(os.getenv('RULE_STATS_LEAVES_PER_SAMPLE', 16))
+RULE_PLAN_MIN_SAMPLES = int(os.getenv('RULE_PLAN_MIN_SAMPLES', 1000))
+
+# Stage latency histograms and per-rule evaluation counts served by /metrics (main.metrics);
+# /metrics lists the RULE_METRICS_TOP_RULES rules with the highest time per evaluation. Single-record
+# evaluations are timed one in RULE_METRICS_SAMPLE_EVERY (1 times all of them)
+
+RULE_METRICS_ENABLED = os.getenv('RULE_METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RULE_METRICS_TOP_RULES = int(os.getenv('RULE_METRICS_TOP_RULES', 100))
+RULE_METRICS_SAMPLE_EVERY = int(os.getenv('RULE_METRICS_SAMPLE_EVERY', 16))
+
+# Opt-in cProfile hook (main.middleware.RequestProfilerMiddleware): when enabled, requests sent with
+# "X-Profile: 1" get their profile back, and every RULE_PROFILE_SAMPLE_EVERY-th request (0 disables)
+# has its profile logged with the RULE_PROFILE_TOP slowest functions
+
+RULE_PROFILE_ENABLED = os.getenv('RULE_PROFILE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+RULE_PROFILE_SAMPLE_EVERY = int(os.getenv('RULE_PROFILE_SAMPLE_EVERY', 0))
+RULE_PROFILE_TOP = int(os.getenv('RULE_PROFILE_TOP', 40))
+
+# Logging: the rule engine logs through the 'main' logger. Debug output (tokens, conditions,
+# combined operators) is off unless RULE_LOG_LEVEL=DEBUG, so nothing is formatted or written on
+# the evaluation path by default
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'structured': {
+            'format': 'time=%(asctime)s level=%(levelname)s logger=%(name)s message=%(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'structured',
+        },
+    },
+    'loggers': {
+        'main': {
+            'handlers': ['console'],
+            'level': os.getenv('RULE_LOG_LEVEL', 'WARNING'),
+            'propagate': False,
+        },
+    },
+}